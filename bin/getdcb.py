@@ -89,6 +89,10 @@ parser.add_argument('-c',
                     required=False,
                     default='p1c1',
                     help='Choose the code type(s) that the DCB file includes')
+parser.add_argument('--use-cache',
+                    dest='use_cache',
+                    action='store_true',
+                    help='Skip the download if the remote file has not changed since it was last downloaded to the same local file (checked via the remote file size/modification time or ETag/Last-Modified).')
 parser.add_argument('--verbose',
                     dest='verbose',
                     action='store_true',
@@ -128,6 +132,8 @@ if __name__ == '__main__':
         input_dct['save_as'] = args.save_as
     if args.save_dir:
         input_dct['save_dir'] = args.save_dir
+    if args.use_cache:
+        input_dct['use_cache'] = True
 
 #    ## try downloading the dcb file; if we fail do not throw, print the error
 #    ## message and return an intger > 0 to the shell.
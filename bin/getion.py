@@ -9,7 +9,6 @@ from pybern.products.codeion import get_ion, list_products
 from pybern.products.formats.ion import BernIon
 from pybern.products.formats.ionex import Ionex
 import pybern.products.fileutils.decompress as dc
-import pybern.products.fileutils.compress as cc
 from pybern.products.fileutils.cmpvar import is_compressed, find_os_compression_type
 
 
@@ -98,6 +97,10 @@ parser.add_argument(
     help=
     'Choose type of solution; can be any of (or multiple of) \"rapid, prediction, urapid, p2, p5\". If more than one types are specified (using comma seperated values), the program will try all types in the order given untill a file is found and downloaded. E.g. \'--type=final,rapid,p5\' means that we first try for the final solution; if found it is downloaded and the program ends. If it is not found found, then the program will try to download the rapid solution and then the p5 solution.'
 )
+parser.add_argument('--use-cache',
+                    dest='use_cache',
+                    action='store_true',
+                    help='Skip the download if the remote file has not changed since it was last downloaded to the same local file (checked via the remote file size/modification time or ETag/Last-Modified).')
 parser.add_argument('--verbose',
                     dest='verbose',
                     action='store_true',
@@ -132,8 +135,10 @@ def validate_interval(pydt, filename, informat, verbose=False):
             print('\tValidation: Given start epoch: {:} stop epoch {:}'.format(
                   dstart.strftime('%Y-%m-%d %H:%M:%S'),
                   dstop.strftime('%Y-%m-%d %H:%M:%S')))
+        ## the compressed file is kept by os_decompress; drop the decompressed
+        ## copy, leaving the downloaded file untouched (see --use-cache)
         if dct['compressed']:
-            cc.os_compress(decomp_filename, dct['ctype'], True)
+            os.remove(decomp_filename)
         return status
     except:
         return 20
@@ -170,6 +175,8 @@ if __name__ == '__main__':
         input_dct['save_as'] = args.save_as
     if args.save_dir:
         input_dct['save_dir'] = args.save_dir
+    if args.use_cache:
+        input_dct['use_cache'] = True
 
     ## try downloading the ion file; if we fail do not throw, print the error
     ## message and return an intger > 0 to the shell. We will try downloading
@@ -8,7 +8,6 @@ import datetime
 from pybern.products.codesp3 import get_sp3, list_products
 from pybern.products.formats.sp3 import Sp3
 import pybern.products.fileutils.decompress as dc
-import pybern.products.fileutils.compress as cc
 from pybern.products.fileutils.cmpvar import is_compressed, find_os_compression_type
 
 ##  If only the formatter_class could be:
@@ -94,6 +93,10 @@ parser.add_argument('-l',
                     dest='list_products',
                     action='store_true',
                     help='List available ERP products and exit')
+parser.add_argument('--use-cache',
+                    dest='use_cache',
+                    action='store_true',
+                    help='Skip the download if the remote file has not changed since it was last downloaded to the same local file (checked via the remote file size/modification time or ETag/Last-Modified).')
 parser.add_argument('--verbose',
                     dest='verbose',
                     action='store_true',
@@ -121,8 +124,10 @@ def validate_interval(pydt, filename, verbose=False):
             print('\tValidation: Given start epoch: {:} stop epoch {:}'.format(
                 dstart.strftime('%Y-%m-%d %H:%M:%S'),
                 dstop.strftime('%Y-%m-%d %H:%M:%S')))
+        ## the compressed file is kept by os_decompress; drop the decompressed
+        ## copy, leaving the downloaded file untouched (see --use-cache)
         if dct['compressed']:
-            cc.os_compress(decomp_filename, dct['ctype'], True)
+            os.remove(decomp_filename)
         return status
     except:
         return 20
@@ -160,6 +165,8 @@ if __name__ == '__main__':
         input_dct['save_as'] = args.save_as
     if args.save_dir:
         input_dct['save_dir'] = args.save_dir
+    if args.use_cache:
+        input_dct['use_cache'] = True
 
     ## try downloading the ion file; if we fail do not throw, print the error
     ## message and return an intger > 0 to the shell. We will try downloading
@@ -0,0 +1,66 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import sys
+import os
+import argparse
+import mysql.connector
+from pybern.products.gnssdb_query import parse_db_credentials_file
+from pybern.products.gnssdb_sqlite import export_snapshot, SNAPSHOT_TABLES
+
+class myFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                  argparse.RawTextHelpFormatter):
+    pass
+
+parser = argparse.ArgumentParser(
+    formatter_class=myFormatter,
+    description=
+    'Export the network/station metadata tables of the GNSS database ({:}) to a local SQLite file. Set GNSS_DB_BACKEND = sqlite and GNSS_DB_SQLITE to the exported file (in the config/credentials file) to have scripts read the snapshot instead of the MySQL server.'.format(', '.join(SNAPSHOT_TABLES)),
+    epilog=('''National Technical University of Athens,
+    Dionysos Satellite Observatory\n
+    Send bug reports to:
+    Xanthos Papanikolaou, xanthos@mail.ntua.gr
+    Dimitris Anastasiou,danast@mail.ntua.gr
+    November, 2022'''))
+
+parser.add_argument('-c',
+                    '--credentials-file',
+                    required=True,
+                    help='Credentials to access the (MySQL) data base',
+                    metavar='CREDENTIALS_FILE',
+                    dest='credentials_file',
+                    default=None)
+parser.add_argument('-o',
+                    '--output',
+                    required=True,
+                    help='The SQLite file to write the snapshot to; an existing file is replaced',
+                    metavar='SNAPSHOT_FILE',
+                    dest='output',
+                    default=None)
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    credentials_dct = parse_db_credentials_file(args.credentials_file)
+    try:
+        cnx = mysql.connector.connect(
+            host=credentials_dct['GNSS_DB_HOST'], 
+            database=credentials_dct['GNSS_DB_NAME'], 
+            user=credentials_dct['GNSS_DB_USER'], 
+            password=credentials_dct['GNSS_DB_PASS'],
+            connect_timeout=10)
+    except mysql.connector.Error as err:
+        print('[ERROR] Failed to connect to database!', file=sys.stderr)
+        print('[ERROR] ' + str(err), file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        exported = export_snapshot(cnx, args.output)
+    finally:
+        cnx.close()
+
+    for table, nrows in exported.items():
+        print('[DEBUG] Exported {:} rows from table {:}'.format(nrows, table))
+    print('[DEBUG] Snapshot written to {:}'.format(args.output))
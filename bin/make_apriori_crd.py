@@ -98,24 +98,15 @@ def id2domes(staid, dbdct):
     print('[WRNNG] No domes number found for station {:} (database query)'.format(staid), file=sys.stderr)
     return ''
 
-if __name__ == '__main__':
-
-    ## parse command line arguments
-    args = parser.parse_args()
-
-    ## get the date ...
-    if args.date is None:
-        args.date = datetime.datetime.now()
-    else:
-        try:
-            args.date = datetime.datetime.strptime(args.date, args.date_format)
-        except:
-            print('[ERROR] Failed to parse input date string {:} using the format string {:}'.format(args.date, args.date_format))
-            sys.exit(1)
-    
+def make_apriori_crd(network, credentials_file, crd_out, ssc_files, crd_files, date):
+    """ Write an a-priori coordinate file crd_out for the stations of network
+        at date (a datetime instance), using coordinates extrapolated from the
+        SSC files ssc_files or, for stations not found there, taken from the
+        (Bernese) CRD files crd_files.
+    """
     ## query database ...
-    db_credentials_dct = parse_db_credentials_file(args.credentials_file)
-    netsta_dct = query_sta_in_net(args.network, db_credentials_dct)
+    db_credentials_dct = parse_db_credentials_file(credentials_file)
+    netsta_dct = query_sta_in_net(network, db_credentials_dct)
 
     ## make a list of the stations in the network, using their 4-char id's
     sta_list = [s['mark_name_DSO'].upper() for s in netsta_dct]
@@ -131,12 +122,12 @@ if __name__ == '__main__':
     ## parse ssc file (in the order they were passed in) for the given station
     ## list
     ssc_records = []
-    for sscfn in args.ssc_files:
-        ssc_records += ssc.parse_ssc(sscfn, sta_list, args.date)
+    for sscfn in ssc_files:
+        ssc_records += ssc.parse_ssc(sscfn, sta_list, date)
 
     ## parse records off from the CRD files
     crd_records = []
-    for crdfn in args.crd_files:
+    for crdfn in crd_files:
         crd_records.append(parse_bern52_crd(crdfn))
 
     ## write header to crd file
@@ -145,10 +136,10 @@ if __name__ == '__main__':
     flag = 'APR'
     num = 0
     sta_sofar = []
-    with open(args.crd_out, 'w') as bout:
+    with open(crd_out, 'w') as bout:
         print("{:}".format(header), file=bout)
         print("--------------------------------------------------------------------------------", file=bout)
-        print("LOCAL GEODETIC DATUM: {:}           EPOCH: 2010-01-01 00:00:00".format(datum, args.date.strftime("%Y-%m-%d %H:%M:%S")), file=bout)
+        print("LOCAL GEODETIC DATUM: {:}           EPOCH: 2010-01-01 00:00:00".format(datum, date.strftime("%Y-%m-%d %H:%M:%S")), file=bout)
         print("", file=bout)
         print("NUM  STATION NAME           X (M)          Y (M)          Z (M)     FLAG", file=bout)
         print("", file=bout)
@@ -159,7 +150,7 @@ if __name__ == '__main__':
 
             index = find_station_in_ssc_records(station, ssc_records)
             if index >=0 :
-                x, y, z = ssc_records[index].extrapolate(args.date)
+                x, y, z = ssc_records[index].extrapolate(date)
                 if db_domes != ssc_records[index].domes.strip():
                     print('[WRNNG] Domes number mismatch for station {:}; DataBase entry [{:}], SSC entry [{:}]'.format(station, db_domes, ssc_records[index].domes.strip()))
                     print('[WRNNG] Using domes number from database entry, aka: {:} {:}'.format(station, db_domes))
@@ -182,3 +173,20 @@ if __name__ == '__main__':
             
             if not station_found:
                 print('[WRNNG] Failed to find station {:} in any of the provided SSC/CRD files!'.format(station), file=sys.stderr)
+
+if __name__ == '__main__':
+
+    ## parse command line arguments
+    args = parser.parse_args()
+
+    ## get the date ...
+    if args.date is None:
+        args.date = datetime.datetime.now()
+    else:
+        try:
+            args.date = datetime.datetime.strptime(args.date, args.date_format)
+        except:
+            print('[ERROR] Failed to parse input date string {:} using the format string {:}'.format(args.date, args.date_format))
+            sys.exit(1)
+
+    make_apriori_crd(args.network, args.credentials_file, args.crd_out, args.ssc_files, args.crd_files, args.date)
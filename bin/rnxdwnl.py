@@ -42,6 +42,22 @@ def runmain():
                         required=True,
                         help='The day-of-year (doy) of date.')
 
+    parser.add_argument('--end-year',
+                        metavar='END_YEAR',
+                        dest='end_year',
+                        type=int,
+                        required=False,
+                        default=None,
+                        help='Backfill mode: download RINEX files for all days from YEAR/DOY up to (and including) END_YEAR/END_DOY. If END_DOY is given but not END_YEAR, END_YEAR is set to YEAR; END_YEAR requires END_DOY.')
+
+    parser.add_argument('--end-doy',
+                        metavar='END_DOY',
+                        dest='end_doy',
+                        type=int,
+                        required=False,
+                        default=None,
+                        help='The day-of-year (doy) of the last date in backfill mode (see --end-year).')
+
 ##  download path
     parser.add_argument(
         '-O',
@@ -98,6 +114,14 @@ def runmain():
                         dest='db_name',
                         default=None)
 
+    parser.add_argument('--db-snapshot',
+                        action='store',
+                        required=False,
+                        help='Query a local SQLite snapshot of the database (see gnssdb_snapshot.py) instead of the MySQL server',
+                        metavar='DB_SNAPSHOT',
+                        dest='db_snapshot',
+                        default=None)
+
     parser.add_argument('-s',
                         '--station-list',
                         action='store',
@@ -117,6 +141,61 @@ def runmain():
                         dest='network',
                         default=None)
 
+    parser.add_argument('-w',
+                        '--max-workers',
+                        action='store',
+                        required=False,
+                        help='Maximum number of RINEX files to download concurrently',
+                        metavar='MAX_WORKERS',
+                        dest='max_workers',
+                        type=int,
+                        default=8)
+
+    parser.add_argument('--dc-limits-file',
+                        action='store',
+                        required=False,
+                        help='A file holding per data center download limits; each line should have the form \'DC_NAME MAX_CONNECTIONS REQUESTS_PER_SEC\' (lines starting with \'#\' are ignored). Data centers not listed use built-in defaults.',
+                        metavar='DC_LIMITS_FILE',
+                        dest='dc_limits_file',
+                        default=None)
+    parser.add_argument('--product-store-dir',
+                        action='store',
+                        required=False,
+                        help='Root directory of a product store shared between runs; RINEX files found there are linked instead of downloaded, and new downloads are added to it.',
+                        metavar='PRODUCT_STORE_DIR',
+                        dest='product_store_dir',
+                        default=None)
+    parser.add_argument('--product-store-max-size',
+                        action='store',
+                        required=False,
+                        help='Maximum size of the product store in GB; least recently used products are removed when exceeded.',
+                        metavar='PRODUCT_STORE_MAX_SIZE',
+                        dest='product_store_max_size',
+                        default=None)
+    parser.add_argument('--negative-cache-ttl',
+                        action='store',
+                        required=False,
+                        type=float,
+                        help='Do not retry remote RINEX files that failed to download within the last NEGATIVE_CACHE_TTL seconds; the wait time doubles on every consecutive failure. By default, files are always retried.',
+                        metavar='NEGATIVE_CACHE_TTL',
+                        dest='negative_cache_ttl',
+                        default=None)
+    parser.add_argument('--stream-decompress',
+                        dest='stream_decompress',
+                        action='store_true',
+                        help='Decompress (.Z/.gz and Hatanaka) RINEX files while they are being downloaded; the observation RINEX files are saved instead of the compressed ones.')
+    parser.add_argument('--crx2rnx-dir',
+                        action='store',
+                        required=False,
+                        help='Directory of the CRX2RNX program (used with --stream-decompress); if given, Hatanaka files are decoded using CRX2RNX instead of the built-in decoder.',
+                        metavar='CRX2RNX_DIR',
+                        dest='crx2rnx_dir',
+                        default=None)
+    parser.add_argument('--asyncio',
+                        dest='use_asyncio',
+                        action='store_true',
+                        help='Download RINEX files from a single thread using asyncio (many concurrent connections, at most MAX_WORKERS per host), instead of a thread pool.')
+
     parser.add_argument('--skip-download',
                         dest='skip_download',
                         action='store_true',
@@ -128,6 +207,19 @@ def runmain():
                         help='Trigger verbose run (prints debug messages).')
 
     cmdargs = parser.parse_args()
+    if cmdargs.end_year is not None and cmdargs.end_doy is None:
+        parser.error('--end-year requires --end-doy')
+
+    ## backfill mode; report holdings for every day as soon as it is done
+    if cmdargs.end_doy is not None:
+        if cmdargs.end_year is None: cmdargs.end_year = cmdargs.year
+        holdings = {}
+        for pt, day_holdings in rnxd.main_range(**vars(cmdargs)):
+            if cmdargs.verbose:
+                print('[DEBUG] Downloaded {:} RINEX files for {:}'.format(len(day_holdings), pt.strftime('%Y-%j')))
+            holdings[pt] = day_holdings
+        return holdings
+
     return rnxd.main(**vars(cmdargs))
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import sys
+import os
+import shlex
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import rundd
+from make_apriori_crd import make_apriori_crd
+
+##  Batch driver for rundd.py; processes a list of (network, date range)
+##+ jobs in a single process, so that database connections/queries, the
+##+ product store and the download caches are shared between runs. Runs are
+##+ started in date order; while a run is in the BPE, the following ones
+##+ download and prepare their data (RINEX, products), and wait for their
+##+ campaign to be free (runs of the same campaign use it one at a time, in
+##+ date order). At most MAX_BPE_SESSIONS BPE sessions run at any time.
+##
+##  The jobs file holds one job per line (lines starting with '#' are
+##+ ignored), as:
+##  NETWORK CONFIG_FILE FROM [TO] [RUNDD_OPTIONS]
+##  where FROM and TO are dates given as YYYY-DDD, YYYY-MM-DD or -N (aka N
+##+ days ago), and RUNDD_OPTIONS are any other options of rundd.py, e.g.
+##  greece /home/bpe/applications/autobern/config/config.greece -15 --min-reference-stations 10
+##  hepos  /home/bpe/applications/autobern/config/config.hepos 2021-123 2021-365 --min-reference-stations 10
+
+class myFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                  argparse.RawTextHelpFormatter):
+    pass
+
+parser = argparse.ArgumentParser(
+    formatter_class=myFormatter,
+    description=
+    'Run rundd.py for a list of (network, date range) jobs within a single process. Each line of the jobs file should be of the form:\nNETWORK CONFIG_FILE FROM [TO] [RUNDD_OPTIONS]\nwhere FROM and TO are dates given as YYYY-DDD, YYYY-MM-DD or -N (aka N days ago).',
+    epilog=('''National Technical University of Athens,
+    Dionysos Satellite Observatory\n
+    Send bug reports to:
+    Xanthos Papanikolaou, xanthos@mail.ntua.gr
+    Dimitris Anastasiou,danast@mail.ntua.gr
+    November, 2022'''))
+
+parser.add_argument('-j',
+                    '--jobs-file',
+                    metavar='JOBS_FILE',
+                    dest='jobs_file',
+                    required=True,
+                    help='File holding the jobs to run, one per line')
+parser.add_argument('--max-bpe-sessions',
+                    metavar='MAX_BPE_SESSIONS',
+                    dest='max_bpe_sessions',
+                    type=int,
+                    default=1,
+                    help='Maximum number of BPE sessions run concurrently (for different campaigns).')
+parser.add_argument('--prefetch',
+                    metavar='PREFETCH',
+                    dest='prefetch',
+                    type=int,
+                    default=1,
+                    help='Number of runs downloading/preparing their data while the BPE sessions are running.')
+parser.add_argument('--ssc-files',
+                    nargs='*',
+                    required=False,
+                    help='SSC files used to make the a-priori coordinate file of each run (see make_apriori_crd.py); if neither SSC nor CRD files are given, no a-priori coordinate file is made.',
+                    metavar='SSC_FILES',
+                    dest='ssc_files',
+                    default=[])
+parser.add_argument('--crd-files',
+                    nargs='*',
+                    required=False,
+                    help='CRD files used to make the a-priori coordinate file of each run (see make_apriori_crd.py).',
+                    metavar='CRD_FILES',
+                    dest='crd_files',
+                    default=[])
+
+def parse_date(date_str):
+    """ Parse a date given as YYYY-DDD, YYYY-MM-DD or -N (aka N days ago).
+    """
+    if date_str.startswith('-'):
+        day = datetime.datetime.now() - datetime.timedelta(days=int(date_str[1:]))
+        return datetime.datetime(day.year, day.month, day.day)
+    for fmt in ['%Y-%j', '%Y-%m-%d']:
+        try:
+            return datetime.datetime.strptime(date_str, fmt)
+        except ValueError:
+            pass
+    errmsg = '[ERROR] rundd_batch::parse_date Invalid date string {:}'.format(date_str)
+    raise RuntimeError(errmsg)
+
+def parse_jobs_file(jobs_file):
+    """ Parse the jobs file; returns a list of jobs, as dictionaries:
+        {'network': ..., 'config_file': ..., 'from': datetime, 'to': datetime,
+        'rundd_args': [...]}
+    """
+    jobs = []
+    with open(jobs_file, 'r') as fin:
+        for line in fin.readlines():
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            fields = shlex.split(line)
+            if len(fields) < 3:
+                errmsg = '[ERROR] rundd_batch::parse_jobs_file Invalid line in jobs file: {:}'.format(line.strip())
+                raise RuntimeError(errmsg)
+            job = {'network': fields[0], 'config_file': os.path.abspath(fields[1]), 'from': parse_date(fields[2])}
+            if len(fields) > 3 and not fields[3].startswith('--'):
+                job['to'] = parse_date(fields[3])
+                job['rundd_args'] = fields[4:]
+            else:
+                job['to'] = job['from']
+                job['rundd_args'] = fields[3:]
+            jobs.append(job)
+    return jobs
+
+class CampaignTurns:
+    """ Lets runs use a campaign one at a time, in the order they were
+        registered (see gate), with at most max_sessions of them (for all
+        campaigns) holding a campaign at any time.
+    """
+
+    def __init__(self, max_sessions):
+        self.cond = threading.Condition()
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+        ## campaign -> list of gates, in order
+        self.queues = {}
+
+    def gate(self, campaign):
+        """ Register a new run for campaign; returns its CampaignGate.
+        """
+        gate = CampaignGate(self, campaign.upper())
+        with self.cond:
+            self.queues.setdefault(gate.campaign, []).append(gate)
+        return gate
+
+class CampaignGate:
+
+    def __init__(self, turns, campaign):
+        self.turns = turns
+        self.campaign = campaign
+        self.acquired = False
+        self.released = False
+
+    def acquire(self):
+        """ Wait until all runs of the campaign registered before this one are
+            done, and for a free BPE session.
+        """
+        with self.turns.cond:
+            self.turns.cond.wait_for(lambda: self.turns.queues[self.campaign][0] is self)
+        self.turns.sessions.acquire()
+        self.acquired = True
+
+    def release(self):
+        """ Let the next run of the campaign proceed; can be called more than
+            once, and even if the gate was never acquired (e.g. a failed run).
+        """
+        if self.released:
+            return
+        self.released = True
+        if self.acquired:
+            self.turns.sessions.release()
+        with self.turns.cond:
+            self.turns.queues[self.campaign].remove(self)
+            self.turns.cond.notify_all()
+
+def run_task(task, args):
+    """ Run rundd for a (network, date) task; returns True if successeful.
+    """
+    options = task['options']
+    dt = task['date']
+    apriori_crd = None
+    try:
+        ## make an a-priori crd file for the BPE
+        if args.ssc_files or args.crd_files:
+            options['aprinf'] = 'REG{:}0_{:}'.format(dt.strftime('%y%j'), options['network'].upper())
+            apriori_crd = os.path.join(options['tables_dir'], 'crd', options['aprinf'] + '.CRD')
+            make_apriori_crd(options['network'], options['config_file'], apriori_crd, args.ssc_files, args.crd_files, dt)
+        return rundd.rundd(options, task['gate'], task['run_id'])
+    except (Exception, SystemExit) as e:
+        print('[ERROR] Run for network {:} at {:} failed: {:}'.format(options['network'], dt.strftime('%Y-%j'), e), file=sys.stderr)
+        return False
+    finally:
+        task['gate'].release()
+        if apriori_crd is not None and os.path.isfile(apriori_crd):
+            os.remove(apriori_crd)
+
+if __name__ == '__main__':
+
+    ## parse command line arguments
+    args = parser.parse_args()
+
+    ## expand jobs to (network, date) tasks, sorted by date (stable, so that
+    ## for the same date, the order of the jobs file is kept)
+    tasks = []
+    for job in parse_jobs_file(args.jobs_file):
+        dt = job['from']
+        while dt <= job['to']:
+            rundd_args = rundd.parser.parse_args(['-c', job['config_file'], '-n', job['network'], '-y', dt.strftime('%Y'), '-d', '{:}'.format(int(dt.strftime('%j')))] + job['rundd_args'])
+            tasks.append({'date': dt, 'options': rundd.make_options(rundd_args)})
+            dt += datetime.timedelta(days=1)
+    tasks.sort(key=lambda t: t['date'])
+
+    ## register the runs of every campaign, in order
+    turns = CampaignTurns(args.max_bpe_sessions)
+    for count, task in enumerate(tasks):
+        task['gate'] = turns.gate(task['options']['campaign'])
+        task['run_id'] = '{:}{:03d}'.format(os.getpid(), count)
+
+    with ThreadPoolExecutor(max_workers=args.max_bpe_sessions + args.prefetch) as executor:
+        results = list(executor.map(lambda t: run_task(t, args), tasks))
+
+    failed = [ t for t, ok in zip(tasks, results) if not ok ]
+    for task in failed:
+        print('[ERROR] Failed run for network {:} at {:}'.format(task['options']['network'], task['date'].strftime('%Y-%j')), file=sys.stderr)
+    print('[DEBUG] Batch done; {:} runs, {:} failed'.format(len(tasks), len(failed)))
+    sys.exit(1 if failed else 0)
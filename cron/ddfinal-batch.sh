@@ -0,0 +1,20 @@
+#! /bin/bash
+
+ABPE_DIR="/home/bpe/applications/autobern"
+if ! test -d $ABPE_DIR
+  then
+  echo "ERROR. Cannot find directory $ABPE_DIR"
+  exit 1
+fi
+
+## process all networks (see the jobs file) for the date 15 days ago, in one
+## go; a-priori crd files are made (and removed) by rundd_batch.py
+python3 ${ABPE_DIR}/bin/rundd_batch.py \
+  -j ${ABPE_DIR}/cron/ddfinal.jobs \
+  --max-bpe-sessions 1 \
+  --prefetch 1 \
+  --ssc-files ${HOME}/tables/ssc/EPN_A_IGS14.SSC ${HOME}/tables/ssc/EPN_IGb14.SSC ${HOME}/tables/ssc/EPND_D2150_IGS14.SSC \
+  --crd-files ${HOME}/tables/crd/NTUA52.CRD \
+  || { echo "ERROR. BPE and/or rundd script failed for (at least) one run!"; exit 1; }
+
+exit 0
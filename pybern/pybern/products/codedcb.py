@@ -258,6 +258,12 @@ def get_dcb(**kwargs):
       save_dir: 'foo/bar' Directory to save remote file; if both save_dir and 
           save_as are given, then the local file will be the concatenation
           of these two, aka os.path.join(save_dir, save_as)
+      use_cache: True/False If True, skip the download when the remote file
+          has not changed since it was last downloaded (see
+          downloaders.metacache)
+      check_listing: True/False If True, check that the remote file is listed
+          in its (cached) remote directory listing before downloading (see
+          downloaders.listcache)
       To provide a date, use either:
         * pydt=datetime.datetime(...) or 
         * year=... and doy=...
@@ -325,6 +331,10 @@ def get_dcb(**kwargs):
         indct['save_as'] = kwargs['save_as']
     if 'save_dir' in kwargs:
         indct['save_dir'] = kwargs['save_dir']
+    if 'use_cache' in kwargs:
+        indct['use_cache'] = kwargs['use_cache']
+    if 'check_listing' in kwargs:
+        indct['check_listing'] = kwargs['check_listing']
     status, remote, local = web_retrieve(target, **indct)
     return status, remote, local
 
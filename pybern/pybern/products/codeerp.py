@@ -194,6 +194,48 @@ def get_erp_rapid_target(**kwargs):
     return target
 
 
+def get_erp_request(**kwargs):
+    """ Resolve the remote target and the download options (to be passed to
+        web_retrieve) for an ERP product request, without downloading
+        anything. See get_erp for the kwargs.
+
+        Returns: target, indct
+    """
+    """ redundant checks
+    if 'span' in kwargs and kwargs['span'] not in ['daily', 'weekly']:
+        raise ArgumentError('[ERROR] code::get_erp Invalid span', 'span',
+                            **kwargs)
+    """
+    if 'span' not in kwargs:
+        kwargs['span'] = 'daily'
+    if kwargs['span'] == 'weekly' and kwargs['type'] != 'final':
+        msg = '[ERROR] codeerp::get_erp Invalid span: {:} for non-final product: {:}'.format(
+            kwargs['span'], kwargs['type'])
+        raise RuntimeError(msg)
+
+    if 'type' in kwargs and kwargs['type'] in [
+            'urapid', 'ultra-rapid', 'frapid', 'final-rapid', 'erapid',
+            'early-rapid', 'prediction', 'p2', 'p5', 'current'
+    ]:
+        target = get_erp_rapid_target(**kwargs)
+    elif 'type' not in kwargs or 'type' in kwargs and kwargs['type'] == 'final':
+        target = get_erp_final_target(**kwargs)
+    else:
+        raise ArgumentError('[ERROR] code::get_erp Invalid type', 'type',
+                            **kwargs)
+
+    indct = {}
+    if 'save_as' in kwargs:
+        indct['save_as'] = kwargs['save_as']
+    if 'save_dir' in kwargs:
+        indct['save_dir'] = kwargs['save_dir']
+    if 'use_cache' in kwargs:
+        indct['use_cache'] = kwargs['use_cache']
+    if 'check_listing' in kwargs:
+        indct['check_listing'] = kwargs['check_listing']
+    return target, indct
+
+
 def get_erp(**kwargs):
     """
       kwargs that matter:
@@ -206,6 +248,12 @@ def get_erp(**kwargs):
       save_dir: 'foo/bar' Directory to save remote file; if both save_dir and 
           save_as are given, then the local file will be the concatenation
           of these two, aka os.path.join(save_dir, save_as)
+      use_cache: True/False If True, skip the download when the remote file
+          has not changed since it was last downloaded (see
+          downloaders.metacache)
+      check_listing: True/False If True, check that the remote file is listed
+          in its (cached) remote directory listing before downloading (see
+          downloaders.listcache)
       To provide a date, use either:
         * pydt=datetime.datetime(...) or 
         * year=... and doy=...
@@ -235,34 +283,7 @@ def get_erp(**kwargs):
       (*) under /BSWUSER52/ORB/yyyy
       (+) under /CODE/yyyy
   """
-    """ redundant checks
-    if 'span' in kwargs and kwargs['span'] not in ['daily', 'weekly']:
-        raise ArgumentError('[ERROR] code::get_erp Invalid span', 'span',
-                            **kwargs)
-    """
-    if 'span' not in kwargs:
-        kwargs['span'] = 'daily'
-    if kwargs['span'] == 'weekly' and kwargs['type'] != 'final':
-        msg = '[ERROR] codeerp::get_erp Invalid span: {:} for non-final product: {:}'.format(
-            kwargs['span'], kwargs['type'])
-        raise RuntimeError(msg)
-
-    if 'type' in kwargs and kwargs['type'] in [
-            'urapid', 'ultra-rapid', 'frapid', 'final-rapid', 'erapid',
-            'early-rapid', 'prediction', 'p2', 'p5', 'current'
-    ]:
-        target = get_erp_rapid_target(**kwargs)
-    elif 'type' not in kwargs or 'type' in kwargs and kwargs['type'] == 'final':
-        target = get_erp_final_target(**kwargs)
-    else:
-        raise ArgumentError('[ERROR] code::get_erp Invalid type', 'type',
-                            **kwargs)
-
-    indct = {}
-    if 'save_as' in kwargs:
-        indct['save_as'] = kwargs['save_as']
-    if 'save_dir' in kwargs:
-        indct['save_dir'] = kwargs['save_dir']
+    target, indct = get_erp_request(**kwargs)
     status, remote, local = web_retrieve(target, **indct)
     return status, remote, local
 
@@ -197,6 +197,43 @@ def get_ion_rapid_target(**kwargs):
     return target
 
 
+def get_ion_request(**kwargs):
+    """ Resolve the remote target and the download options (to be passed to
+        web_retrieve) for an ION product request, without downloading
+        anything. See get_ion for the kwargs.
+
+        Returns: target, indct
+    """
+    if 'type' in kwargs and kwargs['type'] in [
+            'rapid', 'prediction', 'current', 'p2', 'p5'
+    ]:
+        target = get_ion_rapid_target(**kwargs)
+    elif 'type' not in kwargs or 'type' in kwargs and kwargs['type'] == 'final':
+        target = get_ion_final_target(**kwargs)
+
+    indct = {}
+    ## Rename LONG NAME to old names
+    ##+not e pemanent solution check again
+    pydt = _date(**kwargs)  ## this may throw
+    week, sow = pydt2gps(pydt)
+
+    if 'save_as' in kwargs:
+        indct['save_as'] = kwargs['save_as']
+    elif week >= 2238 and kwargs['type'] == 'final':
+        sdate = '{:04d}{:01d}'.format(week, sow2dow(sow))
+        frmt = 'ION'
+        indct['save_as'] = 'COD{:}.{:}.Z'.format(sdate, frmt)
+    if 'save_dir' in kwargs:
+        indct['save_dir'] = kwargs['save_dir']
+    if 'use_cache' in kwargs:
+        indct['use_cache'] = kwargs['use_cache']
+    if 'check_listing' in kwargs:
+        indct['check_listing'] = kwargs['check_listing']
+
+    #print(">> Note rtying to download target ION file: {:}".format(target))
+    return target, indct
+
+
 def get_ion(**kwargs):
     """
       kwargs that matter:
@@ -208,6 +245,12 @@ def get_ion(**kwargs):
       save_dir: 'foo/bar' Directory to save remote file; if both save_dir and
           save_as are given, then the local file will be the concatenation
           of these two, aka os.path.join(save_dir, save_as)
+      use_cache: True/False If True, skip the download when the remote file
+          has not changed since it was last downloaded (see
+          downloaders.metacache)
+      check_listing: True/False If True, check that the remote file is listed
+          in its (cached) remote directory listing before downloading (see
+          downloaders.listcache)
       To provide a date, use either:
         * pydt=datetime.datetime(...) or
         * year=... and doy=...
@@ -241,29 +284,7 @@ def get_ion(**kwargs):
       (*) current is an alias for 'urapid' and 'ultra-rapid'; any of those three
       strings describes the same type
   """
-    if 'type' in kwargs and kwargs['type'] in [
-            'rapid', 'prediction', 'current', 'p2', 'p5'
-    ]:
-        target = get_ion_rapid_target(**kwargs)
-    elif 'type' not in kwargs or 'type' in kwargs and kwargs['type'] == 'final':
-        target = get_ion_final_target(**kwargs)
-
-    indct = {}
-    ## Rename LONG NAME to old names
-    ##+not e pemanent solution check again
-    pydt = _date(**kwargs)  ## this may throw
-    week, sow = pydt2gps(pydt)
-
-    if 'save_as' in kwargs:
-        indct['save_as'] = kwargs['save_as']
-    elif week >= 2238 and kwargs['type'] == 'final':
-        sdate = '{:04d}{:01d}'.format(week, sow2dow(sow))
-        frmt = 'ION'
-        indct['save_as'] = 'COD{:}.{:}.Z'.format(sdate, frmt)
-    if 'save_dir' in kwargs:
-        indct['save_dir'] = kwargs['save_dir']
-
-    #print(">> Note rtying to download target ION file: {:}".format(target))
+    target, indct = get_ion_request(**kwargs)
     status, remote, local = web_retrieve(target, **indct)
     return status, remote, local
 
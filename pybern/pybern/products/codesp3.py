@@ -175,37 +175,12 @@ def get_sp3_rapid_target(**kwargs):
     return target
 
 
-def get_sp3(**kwargs):
-    """
-      kwargs that matter:
-      format: Optional but if it exists it must be 'sp3'
-      acid: 'cod' or 'cox' for final, GLONASS only solutions
-      type='final', rapid, prediction, .... (see Table)
-      save_as: '/some/path/foo.ION' Rename downloaded file to this filename
-      save_dir: 'foo/bar' Directory to save remote file; if both save_dir and
-          save_as are given, then the local file will be the concatenation
-          of these two, aka os.path.join(save_dir, save_as)
-      To provide a date, use either:
-        * pydt=datetime.datetime(...) or
-        * year=... and doy=...
-
-      Default values:
-      kwargs['format'] = sp3
-      kwargs['acid'] = cod
-      kwargs['type'] = final
+def get_sp3_request(**kwargs):
+    """ Resolve the remote target and the download options (to be passed to
+        web_retrieve) for an SP3 product request, without downloading
+        anything. See get_sp3 for the kwargs.
 
-      type=final
-      CODwwwwd.EPH.Z    CODE final GNSS orbits
-      COXwwwwd.EPH.Z    CODE final GLONASS orbits (for GPS weeks
-                        0990 to 1066)
-      type=current               | COD.EPH_U
-      type=current-5d            | COD.EPH_5D
-      type=urapid or ultra-rapid | CODwwwwd.EPH_U
-      type=frapid or final-rapid | CODwwwwd.EPH_M
-      type=erapid or early-rapid | CODwwwwd.EPH_R
-      type=prediction            | CODwwwwd.EPH_P
-      type=p2                    | CODwwwwd.EPH_P2
-      type=p5                    | CODwwwwd.EPH_5D
+        Returns: target, indct
     """
     """ redundant checks; performed in final/rapid functions
     if 'format' in kwargs and kwargs['format'] not in ['sp3']:
@@ -252,6 +227,52 @@ def get_sp3(**kwargs):
         indct['save_as'] = 'COD{:}.{:}.Z'.format(sdate, frmt)
     if 'save_dir' in kwargs:
         indct['save_dir'] = kwargs['save_dir']
+    if 'use_cache' in kwargs:
+        indct['use_cache'] = kwargs['use_cache']
+    if 'check_listing' in kwargs:
+        indct['check_listing'] = kwargs['check_listing']
+    return target, indct
+
+
+def get_sp3(**kwargs):
+    """
+      kwargs that matter:
+      format: Optional but if it exists it must be 'sp3'
+      acid: 'cod' or 'cox' for final, GLONASS only solutions
+      type='final', rapid, prediction, .... (see Table)
+      save_as: '/some/path/foo.ION' Rename downloaded file to this filename
+      save_dir: 'foo/bar' Directory to save remote file; if both save_dir and
+          save_as are given, then the local file will be the concatenation
+          of these two, aka os.path.join(save_dir, save_as)
+      use_cache: True/False If True, skip the download when the remote file
+          has not changed since it was last downloaded (see
+          downloaders.metacache)
+      check_listing: True/False If True, check that the remote file is listed
+          in its (cached) remote directory listing before downloading (see
+          downloaders.listcache)
+      To provide a date, use either:
+        * pydt=datetime.datetime(...) or
+        * year=... and doy=...
+
+      Default values:
+      kwargs['format'] = sp3
+      kwargs['acid'] = cod
+      kwargs['type'] = final
+
+      type=final
+      CODwwwwd.EPH.Z    CODE final GNSS orbits
+      COXwwwwd.EPH.Z    CODE final GLONASS orbits (for GPS weeks
+                        0990 to 1066)
+      type=current               | COD.EPH_U
+      type=current-5d            | COD.EPH_5D
+      type=urapid or ultra-rapid | CODwwwwd.EPH_U
+      type=frapid or final-rapid | CODwwwwd.EPH_M
+      type=erapid or early-rapid | CODwwwwd.EPH_R
+      type=prediction            | CODwwwwd.EPH_P
+      type=p2                    | CODwwwwd.EPH_P2
+      type=p5                    | CODwwwwd.EPH_5D
+    """
+    target, indct = get_sp3_request(**kwargs)
     status, remote, local = web_retrieve(target, **indct)
     return status, remote, local
 
@@ -0,0 +1,345 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import time
+import asyncio
+import functools
+import contextvars
+import ftplib
+from urllib.parse import urlsplit, unquote
+from pybern.products.downloaders.retrieve import web_retrieve, partial_file, url_split, partial_validator, drop_partial, resumable_offset, http_validator
+from pybern.products.downloaders.listcache import g_listing_cache
+from pybern.products.downloaders.negcache import g_negative_cache
+from pybern.products.downloaders.transfers import record_transfer
+from pybern.products.downloaders.connpool import FTP_TIMEOUT
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+##  Asynchronous (asyncio) counterpart of retrieve.web_retrieve, for
+##+ downloading many (small) files from many hosts, e.g. the RINEX files of a
+##+ network, from a single thread. Use as:
+##  async with AsyncRetriever() as retriever:
+##      status, target, saveas = await retriever.web_retrieve(url, **kwargs)
+##  * FTP (passive) is handled by a small asyncio-streams FTP client
+##+   (AsyncFtp); logged-in connections are pooled per host/user,
+##  * HTTP(S) is handled by aiohttp, if installed; else (and for active FTP,
+##+   ssh, use_cache or stream_decoder requests) the synchronous web_retrieve
+##+   is run in a worker thread.
+##  The kwargs (and return values) are the same as for retrieve.web_retrieve.
+
+## max concurrent connections per host
+ASYNC_MAX_PER_HOST = 8
+## seconds to wait for a server reply/data before giving up
+ASYNC_TIMEOUT = 20
+
+def local_filename(filename, **kwargs):
+    """ Resolve the local filename a remote file (named filename) is to be
+        saved as, given the save_as/save_dir kwargs (see web_retrieve).
+    """
+    saveas = kwargs['save_as'] if 'save_as' in kwargs else filename
+    if 'save_dir' in kwargs:
+        if not os.path.isdir(kwargs['save_dir']):
+            msg = '[ERROR] aretrieve::local_filename Directory does not exist {:}'.format(
+                kwargs['save_dir'])
+            raise RuntimeError(msg)
+        saveas = os.path.join(kwargs['save_dir'], saveas)
+    return saveas
+
+class AsyncFtp:
+    """ A minimal asyncio FTP client (passive mode, binary transfers). Errors
+        are reported with the ftplib exceptions (error_perm for 5xx replies,
+        error_temp for 4xx replies, error_reply for anything unexpected).
+    """
+
+    def __init__(self, host, port=21, timeout=ASYNC_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), FTP_TIMEOUT)
+        return await self.getresp('2')
+
+    async def getresp(self, expect=None):
+        """ Read a (possibly multi-line) reply; return it as a string. If
+            expect is given, the reply code must start with it.
+        """
+        line = (await asyncio.wait_for(self.reader.readline(), self.timeout)).decode('latin-1')
+        if line == '':
+            raise EOFError
+        resp = line.rstrip('\r\n')
+        if line[3:4] == '-':
+            code = line[0:3]
+            while True:
+                line = (await asyncio.wait_for(self.reader.readline(), self.timeout)).decode('latin-1')
+                if line == '':
+                    raise EOFError
+                resp += '\n' + line.rstrip('\r\n')
+                if line[0:3] == code and line[3:4] != '-':
+                    break
+        if resp[0] == '4':
+            raise ftplib.error_temp(resp)
+        if resp[0] == '5':
+            raise ftplib.error_perm(resp)
+        if expect is not None and not resp.startswith(expect):
+            raise ftplib.error_reply(resp)
+        return resp
+
+    async def sendcmd(self, cmd, expect=None):
+        self.writer.write((cmd + '\r\n').encode('latin-1'))
+        await self.writer.drain()
+        return await self.getresp(expect)
+
+    async def login(self, username='', password=''):
+        if username is None or username == '': username, password = 'anonymous', 'anonymous@'
+        resp = await self.sendcmd('USER ' + username)
+        if resp[0] == '3':
+            resp = await self.sendcmd('PASS ' + (password if password is not None else ''))
+        if resp[0] != '2':
+            raise ftplib.error_reply(resp)
+        return resp
+
+    async def size(self, remote):
+        resp = await self.sendcmd('SIZE ' + remote, '213')
+        return int(resp[3:].strip())
+
+    async def mdtm(self, remote):
+        """ See retrieve.ftp_mdtm.
+        """
+        try:
+            return (await self.sendcmd('MDTM ' + remote, '213')).split()[1]
+        except (ftplib.error_perm, ftplib.error_reply, IndexError):
+            return None
+
+    async def open_data(self):
+        """ Open a (passive) data connection.
+        """
+        try:
+            host, port = ftplib.parse229(await self.sendcmd('EPSV', '229'), (self.host, self.port))
+        except ftplib.Error:
+            host, port = ftplib.parse227(await self.sendcmd('PASV', '227'))
+        return await asyncio.wait_for(asyncio.open_connection(host, port), FTP_TIMEOUT)
+
+    async def retrbinary(self, remote, callback, rest=None):
+        """ Retrieve remote (binary), passing each data block to callback;
+            if rest is given, start at that offset.
+        """
+        reader, writer = await self.open_data()
+        try:
+            if rest is not None: await self.sendcmd('REST {:}'.format(rest), '3')
+            await self.sendcmd('RETR ' + remote, '1')
+            while True:
+                block = await asyncio.wait_for(reader.read(1024 * 1024), self.timeout)
+                if not block:
+                    break
+                callback(block)
+        finally:
+            writer.close()
+        return await self.getresp('2')
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(b'QUIT\r\n')
+            await self.writer.drain()
+        except:
+            pass
+        self.writer.close()
+        self.writer = None
+
+class AsyncRetriever:
+
+    def __init__(self, max_per_host=ASYNC_MAX_PER_HOST, timeout=ASYNC_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.session = None
+        ## per host semaphores, limiting concurrent connections
+        self.host_limits = {}
+        ## (host, username, password) -> [AsyncFtp, ...] idle logged-in
+        ## connections
+        self.ftp_idle = {}
+
+    async def __aenter__(self):
+        if aiohttp is not None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.max_per_host))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        for key, idle in self.ftp_idle.items():
+            for ftp in idle: await ftp.close()
+        self.ftp_idle = {}
+
+    def host_limit(self, host):
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self.host_limits[host]
+
+    async def run_sync(self, url, **kwargs):
+        """ Run the synchronous web_retrieve in a worker thread (in a copy of
+            the current context, see downloaders.transfers).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, web_retrieve, url, **kwargs))
+
+    async def ftp_download(self, host, path, username, password, remote, local):
+        """ Async counterpart of retrieve.ftp_pooled_retrieve (passive mode):
+            download to partial_file(local), resume if a partial file of the
+            same remote file (MDTM and SIZE) exists, rename when complete.
+            Returns 0 on success, 1 otherwise.
+        """
+        key = (host, username, password)
+        partial = partial_file(local)
+        status = 1
+        async with self.host_limit(host):
+            ftp = self.ftp_idle[key].pop() if key in self.ftp_idle and self.ftp_idle[key] else None
+            if ftp is None:
+                ftp = AsyncFtp(host, timeout=self.timeout)
+                try:
+                    await ftp.connect()
+                    await ftp.login(username, password)
+                except:
+                    await ftp.close()
+                    return 1
+            try:
+                await ftp.sendcmd('CWD ' + (path if path != '' else '/'), '2')
+                await ftp.sendcmd('TYPE I', '2')
+                remote_size = await ftp.size(remote)
+                mdtm = await ftp.mdtm(remote)
+                validator = '{:} {:}'.format(mdtm, remote_size) if mdtm is not None else None
+                offset = resumable_offset(local, validator)
+                if offset > remote_size:
+                    drop_partial(local)
+                    offset = 0
+                if offset == 0:
+                    open(partial, 'wb').close()
+                    if validator is not None: partial_validator(local, validator)
+                if offset < remote_size:
+                    start = time.time()
+                    with open(partial, 'ab' if offset > 0 else 'wb') as fout:
+                        await ftp.retrbinary(remote, fout.write, offset if offset > 0 else None)
+                    record_transfer(host, os.path.getsize(partial) - offset, time.time() - start)
+                if os.path.getsize(partial) == remote_size:
+                    os.replace(partial, local)
+                    drop_partial(local, True)
+                    status = 0
+            except ftplib.error_perm:
+                ## remote file missing; the session is still usable
+                drop_partial(local)
+            except:
+                await ftp.close()
+                return 1
+            if key not in self.ftp_idle: self.ftp_idle[key] = []
+            self.ftp_idle[key].append(ftp)
+        return status
+
+    async def http_download(self, target, saveas, auth=None):
+        """ Async counterpart of retrieve.http_download (using aiohttp).
+        """
+        partial = partial_file(saveas)
+        offset = resumable_offset(saveas, partial_validator(saveas))
+        headers = {'Range': 'bytes={:}-'.format(offset), 'If-Range': partial_validator(saveas)} if offset > 0 else {}
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        async with self.host_limit(urlsplit(target).netloc):
+            async with self.session.get(target, auth=aiohttp.BasicAuth(*auth) if auth else None, headers=headers, timeout=timeout) as r:
+                if r.status == 416 and offset > 0:
+                    drop_partial(saveas)
+                    restart = True
+                elif r.status not in [200, 206]:
+                    drop_partial(saveas)
+                    return 1
+                else:
+                    restart = False
+                    if r.status != 206:
+                        drop_partial(saveas)
+                        open(partial, 'wb').close()
+                        if http_validator(r.headers) is not None: partial_validator(saveas, http_validator(r.headers))
+                    start = time.time()
+                    received = 0
+                    with open(partial, 'ab') as fh:
+                        async for chunk in r.content.iter_chunked(1024 * 1024):
+                            fh.write(chunk)
+                            received += len(chunk)
+                    record_transfer(urlsplit(target).netloc, received, time.time() - start)
+        if restart:
+            return await self.http_download(target, saveas, auth)
+        os.replace(partial, saveas)
+        drop_partial(saveas, True)
+        return 0
+
+    async def web_retrieve(self, url, **kwargs):
+        """ Async counterpart of retrieve.web_retrieve; same kwargs and
+            return values.
+        """
+        filename = None if 'filename' not in kwargs else kwargs['filename']
+        if filename is None:
+            url, filename = url_split(url)
+        target = '{:}/{:}'.format(url, filename)
+        fail_error = kwargs['fail_error'] if 'fail_error' in kwargs else True
+        negative_ttl = kwargs['negative_cache_ttl'] if 'negative_cache_ttl' in kwargs and kwargs['negative_cache_ttl'] else None
+        username = kwargs['username'] if 'username' in kwargs and kwargs['username'] is not None else ''
+        password = kwargs['password'] if 'password' in kwargs and kwargs['password'] is not None else ''
+
+        ## anything we do not handle natively, goes to the synchronous
+        ## implementation
+        native = (target.startswith('ftp') and not ('active' in kwargs and kwargs['active'] == True)) or (target.startswith('http') and self.session is not None)
+        if not native or ('use_cache' in kwargs and kwargs['use_cache']) or ('stream_decoder' in kwargs and kwargs['stream_decoder'] is not None):
+            return await self.run_sync(target, **{k: v for k, v in kwargs.items() if k != 'filename'})
+
+        if negative_ttl is not None and g_negative_cache.is_missing(target):
+            status = 1
+        else:
+            if 'check_listing' in kwargs and kwargs['check_listing']:
+                loop = asyncio.get_running_loop()
+                listed = await loop.run_in_executor(None, functools.partial(g_listing_cache.exists, url, **dict(kwargs, filename=filename)))
+            else:
+                listed = None
+            saveas = local_filename(filename, **kwargs)
+            if listed == False:
+                status = 1
+            elif target.startswith('ftp'):
+                parts = urlsplit(target)
+                if parts.username: username = unquote(parts.username)
+                if parts.password: password = unquote(parts.password)
+                path, remote = url_split(parts.path)
+                status = await self.ftp_download(parts.hostname, path, username, password, remote, saveas)
+            else:
+                try:
+                    status = await self.http_download(target, saveas, (username, password) if username != '' or password != '' else None)
+                except:
+                    status = 1
+            if negative_ttl is not None:
+                if status == 0:
+                    g_negative_cache.remove(target)
+                else:
+                    g_negative_cache.add(target, negative_ttl)
+
+        if status > 0 and fail_error:
+            msg = '[ERROR] aretrieve::web_retrieve Failed to download file {:}'.format(target)
+            raise RuntimeError(msg)
+        return status, target, saveas if status == 0 else None
+
+def web_retrieve_many(requests, max_per_host=ASYNC_MAX_PER_HOST):
+    """ Download a list of files concurrently, from the calling thread; each
+        request is a (url, kwargs) tuple, as for web_retrieve. Returns a list
+        of results (in the same order), where each result is either a
+        (status, target, saveas) tuple or the exception raised by the
+        download.
+    """
+    async def run():
+        async with AsyncRetriever(max_per_host) as retriever:
+            return await asyncio.gather(*[ retriever.web_retrieve(url, **kwargs) for url, kwargs in requests ], return_exceptions=True)
+    return asyncio.run(run())
@@ -0,0 +1,178 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import sys
+import time
+import atexit
+import threading
+import contextlib
+import ftplib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+##  Pooled connections for the retrieve module. Within one process (e.g. a
+##+ rundd run) many files are fetched from the same few servers (RINEX,
+##+ SP3/ERP/ION/DCB, VMF1 grids); instead of opening (and logging in to) a
+##+ new connection for every file, connections are kept and reused:
+##  * HTTP(S): one requests.Session per scheme/host (the session keeps its own
+##+   pool of keep-alive connections and is thread-safe for plain GETs),
+##  * FTP: a pool of logged-in ftplib.FTP handles keyed on
+##+   (host, username, password, passive). A handle is used by one thread at
+##+   a time; idle handles are checked with NOOP before reuse and closed after
+##+   FTP_MAX_IDLE seconds of inactivity.
+
+## max seconds an FTP handle may stay idle in the pool before it is closed
+FTP_MAX_IDLE = 60
+## max idle FTP handles kept per key
+FTP_MAX_IDLE_PER_KEY = 4
+## timeout (seconds) for new FTP connections
+FTP_TIMEOUT = 10
+
+g_http_lock = threading.Lock()
+g_http_sessions = {}
+
+def http_session(url):
+    """ Return the (shared) requests.Session instance for the scheme/host of
+        the given url; create it if needed.
+    """
+    parts = urlsplit(url)
+    key = '{:}://{:}'.format(parts.scheme, parts.netloc)
+    with g_http_lock:
+        if key not in g_http_sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+            session.mount('{:}://'.format(parts.scheme), adapter)
+            g_http_sessions[key] = session
+        return g_http_sessions[key]
+
+def close_http_sessions():
+    with g_http_lock:
+        for key, session in g_http_sessions.items():
+            try:
+                session.close()
+            except:
+                pass
+        g_http_sessions.clear()
+
+class FtpPool:
+    """ A pool of logged-in ftplib.FTP handles; use as:
+        with g_ftp_pool.connection(host, username, password) as ftp:
+            ftp.retrbinary(...)
+        If an exception other than ftplib.error_perm (e.g. a 550, file not
+        found) is raised within the with block, the handle is considered
+        broken and is not returned to the pool.
+    """
+
+    def __init__(self, max_idle=FTP_MAX_IDLE, max_idle_per_key=FTP_MAX_IDLE_PER_KEY, timeout=FTP_TIMEOUT):
+        self.max_idle = max_idle
+        self.max_idle_per_key = max_idle_per_key
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        ## key -> [(ftp, last_used), ...]
+        self.idle = {}
+
+    @staticmethod
+    def close_handle(ftp):
+        try:
+            ftp.quit()
+        except:
+            try:
+                ftp.close()
+            except:
+                pass
+
+    def evict_idle(self):
+        """ Close (and remove from the pool) all handles that have been idle
+            for more than max_idle seconds.
+        """
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for key in list(self.idle):
+                keep = []
+                for ftp, last_used in self.idle[key]:
+                    if now - last_used > self.max_idle:
+                        expired.append(ftp)
+                    else:
+                        keep.append((ftp, last_used))
+                if keep:
+                    self.idle[key] = keep
+                else:
+                    del self.idle[key]
+        for ftp in expired:
+            self.close_handle(ftp)
+
+    def acquire(self, host, username='', password='', passive=True):
+        """ Get a logged-in handle for the given key; reuse an idle one (if
+            it is still alive) or open a new connection.
+        """
+        key = (host, username, password, passive)
+        self.evict_idle()
+        while True:
+            with self.lock:
+                ftp = self.idle[key].pop()[0] if key in self.idle and self.idle[key] else None
+            if ftp is None:
+                break
+            ## keep-alive check; the server may have closed the connection
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except:
+                self.close_handle(ftp)
+        ftp = ftplib.FTP(host=host, timeout=self.timeout)
+        try:
+            if username is None or username == '':
+                ftp.login()
+            else:
+                ftp.login(user=username, passwd=password if password is not None else '')
+            ftp.set_pasv(passive)
+        except:
+            self.close_handle(ftp)
+            raise
+        return ftp
+
+    def release(self, ftp, host, username='', password='', passive=True):
+        """ Return a (healthy) handle to the pool.
+        """
+        key = (host, username, password, passive)
+        with self.lock:
+            if key not in self.idle: self.idle[key] = []
+            if len(self.idle[key]) < self.max_idle_per_key:
+                self.idle[key].append((ftp, time.monotonic()))
+                return
+        self.close_handle(ftp)
+
+    @contextlib.contextmanager
+    def connection(self, host, username='', password='', passive=True):
+        ftp = self.acquire(host, username, password, passive)
+        try:
+            yield ftp
+        except ftplib.error_perm:
+            ## permanent (e.g. file not found) errors leave the session usable
+            self.release(ftp, host, username, password, passive)
+            raise
+        except:
+            self.close_handle(ftp)
+            raise
+        else:
+            self.release(ftp, host, username, password, passive)
+
+    def close_all(self):
+        with self.lock:
+            handles = [ ftp for key in self.idle for ftp, _ in self.idle[key] ]
+            self.idle = {}
+        for ftp in handles:
+            self.close_handle(ftp)
+
+## the process-wide FTP pool
+g_ftp_pool = FtpPool()
+
+def close_all():
+    """ Close every pooled connection (called at exit).
+    """
+    g_ftp_pool.close_all()
+    close_http_sessions()
+
+atexit.register(close_all)
@@ -0,0 +1,183 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import time
+import asyncio
+import threading
+import contextlib
+
+##  Per data center download limits. Keys are the 'dc_name' values recorded in
+##+ the ftprnx table of the GNSS database; each entry holds:
+##  * max_connections: maximum number of concurrent transfers from the data
+##+   center
+##  * requests_per_sec: maximum number of transfers started per second from
+##+   the data center
+##  Any data center not listed here, uses the 'default' entry.
+DC_LIMITS = {
+    ## TREECOMP only serves data via active FTP; one connection at a time
+    'TREECOMP2': {'max_connections': 1, 'requests_per_sec': 1.0},
+    ## Metrica/SmartNet RINEX received by the DSO server
+    'DSO_MTRC': {'max_connections': 2, 'requests_per_sec': 2.0},
+    'default': {'max_connections': 4, 'requests_per_sec': 10.0}
+}
+
+def parse_dc_limits_file(fn, limits=None):
+    """ Parse a data center limits table file. Every (non-comment) line of the
+        file should have the form:
+        DC_NAME MAX_CONNECTIONS REQUESTS_PER_SEC
+        e.g.
+        # dc_name   max_connections  requests_per_sec
+        TREECOMP2   1                0.5
+        default     6                10
+        Lines starting with '#' are ignored. The values parsed are added to
+        (or overwrite) the entries of the limits dictionary (a copy of
+        DC_LIMITS if not given), which is returned.
+    """
+    limits = dict(DC_LIMITS) if limits is None else limits
+    with open(fn, 'r') as fin:
+        for line in fin.readlines():
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            l = line.split()
+            try:
+                limits[l[0]] = {'max_connections': int(l[1]), 'requests_per_sec': float(l[2])}
+                assert(limits[l[0]]['max_connections'] > 0)
+            except:
+                msg = '[ERROR] dcscheduler::parse_dc_limits_file Failed to parse line \'{:}\' (file: {:})'.format(line.strip(), fn)
+                raise RuntimeError(msg)
+    return limits
+
+class DcScheduler:
+    """ A (thread-safe) scheduler that limits the number of concurrent
+        transfers per data center, as well as the rate at which new transfers
+        are started. Use it as:
+        scheduler = DcScheduler()
+        with scheduler.slot('TREECOMP2'):
+            web_retrieve(...)
+    """
+
+    def __init__(self, limits=None):
+        self.limits = DC_LIMITS if limits is None else limits
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.next_start = {}
+
+    def dc_limits(self, dc_name):
+        """ Return the limits dictionary for the given data center.
+        """
+        if dc_name in self.limits:
+            return self.limits[dc_name]
+        return self.limits['default'] if 'default' in self.limits else DC_LIMITS['default']
+
+    def semaphore(self, dc_name):
+        with self.lock:
+            if dc_name not in self.semaphores:
+                self.semaphores[dc_name] = threading.BoundedSemaphore(self.dc_limits(dc_name)['max_connections'])
+            return self.semaphores[dc_name]
+
+    def reserve_start(self, dc_name):
+        """ Reserve the next start time of a transfer from the data center,
+            given its requests_per_sec limit; returns the seconds to wait
+            before starting it.
+        """
+        rps = self.dc_limits(dc_name)['requests_per_sec']
+        if rps is None or rps <= 0: return 0e0
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_start.get(dc_name, now))
+            self.next_start[dc_name] = start_at + 1.0 / rps
+        return start_at - now
+
+    def wait_turn(self, dc_name):
+        """ Block until a new transfer from the data center is allowed, given
+            its requests_per_sec limit.
+        """
+        delay = self.reserve_start(dc_name)
+        if delay > 0:
+            time.sleep(delay)
+
+    @contextlib.contextmanager
+    def slot(self, dc_name):
+        """ Context manager: acquire a connection slot for the data center
+            (blocking if needed) and release it at exit.
+        """
+        sem = self.semaphore(dc_name)
+        sem.acquire()
+        try:
+            self.wait_turn(dc_name)
+            yield
+        finally:
+            sem.release()
+
+class AsyncDcScheduler:
+    """ The asyncio counterpart of DcScheduler, for use within an event
+        loop. It holds no limits/state of its own; connection slots and start
+        times are taken from the (thread-safe) DcScheduler given (the shared
+        one if None, see shared_scheduler), so that asyncio and threaded
+        downloads of the process respect the same limits:
+        scheduler = AsyncDcScheduler()
+        async with scheduler.slot('TREECOMP2'):
+            await retriever.web_retrieve(...)
+    """
+
+    ## seconds to sleep between attempts to get a connection slot
+    poll_interval = 0.05
+
+    def __init__(self, scheduler=None):
+        self.scheduler = shared_scheduler() if scheduler is None else scheduler
+
+    @contextlib.asynccontextmanager
+    async def slot(self, dc_name):
+        ## the semaphore is a threading one; never block the event loop on it
+        sem = self.scheduler.semaphore(dc_name)
+        while not sem.acquire(blocking=False):
+            await asyncio.sleep(self.poll_interval)
+        try:
+            delay = self.scheduler.reserve_start(dc_name)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            sem.release()
+
+## process-wide schedulers, one per limits table; the key is the (absolute)
+## path of the dc_limits_file, or None for DC_LIMITS
+g_schedulers = {}
+g_schedulers_lock = threading.Lock()
+
+def shared_scheduler(dc_limits_file=None):
+    """ Return the process-wide DcScheduler for the limits of dc_limits_file
+        (DC_LIMITS updated by the file, see parse_dc_limits_file), or of
+        DC_LIMITS if None. All downloads of the process (e.g. the runs of
+        rundd_batch) using the same limits table share the scheduler, hence
+        the limits hold for the process and not per run.
+    """
+    key = os.path.abspath(dc_limits_file) if dc_limits_file is not None else None
+    with g_schedulers_lock:
+        if key not in g_schedulers:
+            g_schedulers[key] = DcScheduler(parse_dc_limits_file(key) if key is not None else None)
+        return g_schedulers[key]
+
+def interleave_by_dc(rows, key='dc_name'):
+    """ Reorder a list of query rows (dictionaries) so that consecutive rows
+        belong to different data centers (round-robin over data centers), e.g.
+        [A1, A2, A3, B1, C1] -> [A1, B1, C1, A2, A3]
+        This way, a pool of workers does not get stuck behind a data center
+        that allows only few concurrent connections.
+    """
+    groups = {}
+    order = []
+    for row in rows:
+        dc = row[key] if key in row else None
+        if dc not in groups:
+            groups[dc] = []
+            order.append(dc)
+        groups[dc].append(row)
+    interleaved = []
+    while any([groups[dc] for dc in order]):
+        for dc in order:
+            if groups[dc]: interleaved.append(groups[dc].pop(0))
+    return interleaved
@@ -2,32 +2,98 @@
 #-*- coding: utf-8 -*-
 
 from __future__ import print_function
+import re
+import os
 import ftplib
+from urllib.parse import urlsplit, unquote, urljoin
+from pybern.products.downloaders.connpool import g_ftp_pool, http_session
 
 ## get ftp directory listing
 def ftp_dirlist(url, **kwargs):
     """
-    :return: An integer denoting the download status; anything other than 0 
-             denotes an error
+    :return: A list of the filenames in the remote directory
+
+    url: Either the FTP host (e.g. 'ftp.aiub.unibe.ch'), or a full url of the
+         directory (e.g. 'ftp://ftp.aiub.unibe.ch/CODE/2021'); in the later
+         case any credentials in the url are used.
 
     kwargs:
-    dir : directory to get the listing of
+    dir : directory to get the listing of (if not part of url)
     username: 'usrnm' Use the given username
     password: 'psswrd' Use the given password
+    active  : (boolean) true or false
+
+    Throws ftplib.error_perm if the remote directory does not exist.
   """
     ## username or password key(s) in kwargs
-    if set(['username', 'password']).intersection(set(kwargs)):
-        username = kwargs['username'] if 'username' in kwargs else ''
-        password = kwargs['password'] if 'password' in kwargs else ''
-    
-    rdir = kwargs['dir'] if dir in kwargs else '.'
-
-    ftp = ftplib.FTP(url)
-    ftp.login(username, password)
-    
-    try:
-        remote_files = ftp.nlst()
-    except ftplib.error_perm:
-        raise
-
-    return remote_files
+    username = kwargs['username'] if 'username' in kwargs and kwargs['username'] is not None else ''
+    password = kwargs['password'] if 'password' in kwargs and kwargs['password'] is not None else ''
+
+    rdir = kwargs['dir'] if 'dir' in kwargs else '.'
+    host = url
+    if url.startswith('ftp://'):
+        parts = urlsplit(url)
+        host = parts.hostname
+        if parts.path != '': rdir = parts.path
+        if parts.username: username = unquote(parts.username)
+        if parts.password: password = unquote(parts.password)
+    passive = not ('active' in kwargs and kwargs['active'] == True)
+
+    with g_ftp_pool.connection(host, username, password, passive) as ftp:
+        ## pooled connections are shared; always change to the requested dir
+        ftp.cwd(rdir if rdir != '' else '/')
+        try:
+            remote_files = ftp.nlst()
+        except ftplib.error_perm:
+            ## some servers reply '550 No files found' for empty directories
+            remote_files = []
+
+    return [ os.path.basename(f.rstrip('/')) for f in remote_files ]
+
+def http_dirlist(url, **kwargs):
+    """
+    :return: A list of the filenames in the remote directory (as parsed from
+             the links in the directory's html index page), or None if the
+             server does not provide an index for the directory (or the page
+             has no links to files in the directory)
+
+    url: The url of the directory, e.g. 'https://cddis.nasa.gov/archive/gnss/data/daily/2021/331/21d'
+
+    kwargs:
+    username: 'usrnm' Use the given username
+    password: 'psswrd' Use the given password
+    timeout : Timeout in seconds (default 20)
+
+    If the remote directory does not exist (404), an empty list is returned.
+  """
+    username = kwargs['username'] if 'username' in kwargs and kwargs['username'] is not None else ''
+    password = kwargs['password'] if 'password' in kwargs and kwargs['password'] is not None else ''
+    auth = (username, password) if username != '' or password != '' else None
+    timeout = kwargs['timeout'] if 'timeout' in kwargs else 20
+
+    url = url.rstrip('/') + '/'
+    r = http_session(url).get(url, auth=auth, timeout=timeout)
+    if r.status_code == 404:
+        return []
+    if r.status_code != 200 or 'html' not in r.headers.get('Content-Type', 'html'):
+        return None
+    ## redirected to another host (e.g. a login page); not a listing
+    if urlsplit(r.url).netloc != urlsplit(url).netloc:
+        return None
+
+    remote_files = set()
+    base = urlsplit(url).path
+    for href in re.findall(r'href\s*=\s*["\']([^"\'?#]+)["\']', r.text, re.IGNORECASE):
+        link = urlsplit(urljoin(url, href))
+        ## only keep files directly under the directory (skip sub-directories,
+        ## parent directories and links to other hosts)
+        if link.netloc != urlsplit(url).netloc or link.path.endswith('/'):
+            continue
+        if unquote(link.path[0:link.path.rindex('/') + 1]) != unquote(base):
+            continue
+        remote_files.add(unquote(os.path.basename(link.path)))
+    ## no file links at all; most probably not an index page (e.g. rendered
+    ## by javascript), so we do not know
+    if not remote_files:
+        return None
+    return sorted(remote_files)
@@ -0,0 +1,158 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import hashlib
+import ftplib
+import threading
+from pybern.products.downloaders.ftplist import ftp_dirlist, http_dirlist
+from pybern.products.downloaders.metacache import strip_credentials
+
+##  A cache of remote directory listings (e.g. ftp.aiub.unibe.ch/CODE/2021 or
+##+ the daily directories of RINEX archives). Product and RINEX downloads
+##+ guess remote filenames; checking a guess against the (cached) listing of
+##+ the remote directory, avoids starting a transfer (and waiting for it to
+##+ fail) for every missing file.
+##  Listings are kept in memory and on disk (one json file per directory under
+##+ LISTCACHE_DIR), so that they can be shared by consecutive runs, and are
+##+ considered valid for LISTCACHE_TTL seconds. A file missing from a listing
+##+ may have been published since, so negative answers are only trusted for
+##+ listings at most LISTCACHE_NEGATIVE_TTL seconds old; otherwise the
+##+ directory is listed again (e.g. when retrying for a product not yet
+##+ available).
+##  If a listing cannot be retrieved (e.g. the server does not allow it), the
+##+ availability of files in the directory is reported as unknown (None) and
+##+ the caller should just try the transfer.
+
+## directory to hold cached listings
+LISTCACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pybern', 'listings')
+## seconds a listing is considered valid
+LISTCACHE_TTL = 600
+## seconds a listing is considered valid to report a file as missing
+LISTCACHE_NEGATIVE_TTL = 30
+
+def split_url(url):
+    return url[0:url.rindex('/')], url[url.rindex('/') + 1:]
+
+class ListingCache:
+
+    def __init__(self, cache_dir=LISTCACHE_DIR, ttl=LISTCACHE_TTL, negative_ttl=LISTCACHE_NEGATIVE_TTL):
+        """ cache_dir: directory to store listings; if None, listings are only
+                kept in memory
+            ttl: seconds a listing is considered valid
+            negative_ttl: seconds a listing is considered valid to report a
+                file as missing (see exists)
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        ## key -> (time of listing, set of filenames)
+        self.listings = {}
+
+    def cache_file(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, key, ttl=None):
+        """ Return a (still valid) listing from memory or disk, or None. If
+            ttl is given, it is used instead of the cache's ttl.
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            if key in self.listings and now - self.listings[key][0] <= ttl:
+                return self.listings[key][1]
+        if self.cache_dir is None or not os.path.isfile(self.cache_file(key)):
+            return None
+        try:
+            with open(self.cache_file(key), 'r') as fin:
+                dct = json.load(fin)
+            if dct['url'] != key or now - dct['time'] > ttl:
+                return None
+        except:
+            return None
+        with self.lock:
+            self.listings[key] = (dct['time'], set(dct['files']))
+        return self.listings[key][1]
+
+    def store(self, key, files):
+        now = time.time()
+        with self.lock:
+            self.listings[key] = (now, set(files))
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fn = self.cache_file(key)
+            tmp = '{:}.{:}.{:}.tmp'.format(fn, os.getpid(), threading.get_ident())
+            with open(tmp, 'w') as fout:
+                json.dump({'url': key, 'time': now, 'files': sorted(files)}, fout)
+            os.replace(tmp, fn)
+        except:
+            print('[WRNNG] Failed to write listing cache for {:}'.format(key), file=sys.stderr)
+
+    def listing(self, dir_url, ttl=None, **kwargs):
+        """ Return the set of filenames in the remote directory dir_url (an
+            ftp or http(s) url), from the cache (if listed at most ttl seconds
+            ago; default is the cache's ttl) or the server. Returns None if
+            the listing could not be retrieved.
+            kwargs: username, password and active (see ftp_dirlist and
+            http_dirlist)
+        """
+        dir_url = dir_url.rstrip('/')
+        key = strip_credentials(dir_url)
+        files = self.load(key, ttl)
+        if files is not None:
+            return files
+        try:
+            if dir_url.startswith('ftp'):
+                try:
+                    files = ftp_dirlist(dir_url, **kwargs)
+                except ftplib.error_perm as e:
+                    ## 550: no such directory; anything else (e.g. failed
+                    ## login) means we do not know
+                    if not str(e).startswith('550'): raise
+                    files = []
+            elif dir_url.startswith('http'):
+                files = http_dirlist(dir_url, **kwargs)
+        except:
+            files = None
+        if files is None:
+            return None
+        self.store(key, files)
+        return set(files)
+
+    def exists(self, url, **kwargs):
+        """ Check if the remote file url (or url/kwargs['filename'] if the
+            filename is given) is listed in its remote directory.
+            Returns True or False, or None if the directory listing is not
+            available. False is only returned based on a listing at most
+            negative_ttl seconds old.
+        """
+        if 'filename' in kwargs and kwargs['filename'] is not None:
+            dir_url, filename = url, kwargs['filename']
+        else:
+            dir_url, filename = split_url(url)
+        files = self.listing(dir_url, **kwargs)
+        if files is not None and filename not in files:
+            files = self.listing(dir_url, self.negative_ttl, **kwargs)
+        if files is None:
+            return None
+        return filename in files
+
+    def invalidate(self, dir_url):
+        key = strip_credentials(dir_url.rstrip('/'))
+        with self.lock:
+            if key in self.listings: del self.listings[key]
+        if self.cache_dir is not None and os.path.isfile(self.cache_file(key)):
+            try:
+                os.remove(self.cache_file(key))
+            except OSError:
+                pass
+
+## the process-wide listing cache
+g_listing_cache = ListingCache()
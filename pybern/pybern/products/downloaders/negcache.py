@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+from pybern.products.downloaders.metacache import strip_credentials
+
+##  A persistent cache of remote files that could not be downloaded (e.g. the
+##+ RINEX files of a station that is offline). Each failed url is recorded
+##+ with the number of consecutive failures and a time before which it is not
+##+ tried again; the wait time starts at the TTL given by the caller and
+##+ doubles on every new failure (up to NEGCACHE_MAX_BACKOFF times the TTL).
+##+ A successful download removes the url from the cache.
+##  The cache is a json file (NEGCACHE_FN), shared between runs/processes:
+##  {'ftp://host/path/file.gz': {'failures': 2, 'until': 1669542000.0}, ...}
+##  Note that any failure is recorded, not only missing files; use small TTLs
+##+ if the remote servers are flaky.
+
+## the (default) negative cache file
+NEGCACHE_FN = os.path.join(os.path.expanduser('~'), '.cache', 'pybern', 'negative.json')
+## max wait time, as a multiple of the ttl
+NEGCACHE_MAX_BACKOFF = 16
+## seconds a record is kept after its wait time expires (so that a new
+## failure continues the backoff)
+NEGCACHE_KEEP = 86400
+
+class NegativeCache:
+
+    def __init__(self, filename=NEGCACHE_FN):
+        self.filename = filename
+        self.lock = threading.Lock()
+        ## url -> {'failures': int, 'until': float}; loaded on first use
+        self.entries = None
+
+    def read(self):
+        if not os.path.isfile(self.filename):
+            return {}
+        try:
+            with open(self.filename, 'r') as fin:
+                return json.load(fin)
+        except:
+            print('[WRNNG] Failed to read negative cache file {:}; ignoring'.format(self.filename), file=sys.stderr)
+            return {}
+
+    def update(self, url, entry):
+        """ Set (or remove, if entry is None) the record of url, both in
+            memory and on disk (merging with any changes made by other
+            processes). Records expired more than NEGCACHE_KEEP seconds ago
+            are dropped.
+        """
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                with open(self.filename + '.lock', 'a') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    try:
+                        entries = self.read()
+                        if entry is None:
+                            if url in entries: del entries[url]
+                        else:
+                            entries[url] = entry
+                        now = time.time()
+                        entries = { k: v for k, v in entries.items() if v['until'] + NEGCACHE_KEEP > now }
+                        tmp = '{:}.{:}.tmp'.format(self.filename, os.getpid())
+                        with open(tmp, 'w') as fout:
+                            json.dump(entries, fout, indent=1)
+                        os.replace(tmp, self.filename)
+                    finally:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+                self.entries = entries
+            except:
+                print('[WRNNG] Failed to update negative cache file {:}'.format(self.filename), file=sys.stderr)
+                if self.entries is None: self.entries = {}
+                if entry is None:
+                    if url in self.entries: del self.entries[url]
+                else:
+                    self.entries[url] = entry
+
+    def entry(self, url):
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.read()
+            key = strip_credentials(url)
+            return self.entries[key] if key in self.entries else None
+
+    def is_missing(self, url):
+        """ True if url has failed recently (and its wait time has not
+            expired yet).
+        """
+        entry = self.entry(url)
+        return entry is not None and entry['until'] > time.time()
+
+    def add(self, url, ttl):
+        """ Record a failure for url; it will not be tried for ttl seconds
+            times 2^(consecutive failures - 1), up to NEGCACHE_MAX_BACKOFF
+            times ttl.
+        """
+        entry = self.entry(url)
+        failures = entry['failures'] + 1 if entry is not None else 1
+        wait = min(ttl * 2**(failures - 1), ttl * NEGCACHE_MAX_BACKOFF)
+        self.update(strip_credentials(url), {'failures': failures, 'until': time.time() + wait})
+
+    def remove(self, url):
+        if self.entry(url) is not None:
+            self.update(strip_credentials(url), None)
+
+## the process-wide negative cache
+g_negative_cache = NegativeCache()
@@ -0,0 +1,34 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pybern.products.downloaders.retrieve import remote_exists
+
+##  Concurrent availability checks for (candidate) remote files. Products are
+##+ often resolved via a fallback chain (e.g. final, final-rapid, ...
+##+ ultra-rapid orbits); instead of trying to download each candidate in turn
+##+ (paying a timeout for every missing one), all candidates are checked at
+##+ once and only the best available one is downloaded.
+
+def probe_requests(requests, max_workers=8):
+    """ Given a list of requests, aka (target, indct) tuples as returned by
+        e.g. codesp3.get_sp3_request, check concurrently which remote targets
+        exist (see retrieve.remote_exists). Any entry of the list can be None
+        (e.g. a request that could not be formed), in which case it is
+        considered unavailable.
+        Returns a list of booleans, one per request (in the same order).
+    """
+    def probe(request):
+        if request is None:
+            return False
+        target, indct = request
+        return remote_exists(target, **indct)
+
+    if not requests:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+        ## checks run in (a copy of) the caller's context
+        futures = [ executor.submit(contextvars.copy_context().run, probe, request) for request in requests ]
+        return [ future.result() for future in futures ]
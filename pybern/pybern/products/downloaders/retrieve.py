@@ -6,35 +6,196 @@ import sys
 import re
 import os
 import shutil
+import time
 from contextlib import closing
 import requests
 import urllib.request
 from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit, unquote
 import socket
 import ftplib
 import paramiko
 from scp import SCPClient
+from pybern.products.downloaders.connpool import g_ftp_pool, http_session
+from pybern.products.downloaders import metacache
+from pybern.products.downloaders.listcache import g_listing_cache
+from pybern.products.downloaders.negcache import g_negative_cache
+from pybern.products.downloaders.transfers import record_transfer
+from pybern.products.fileutils.rnxstream import decode_file
+
+## extension of (partial) files being downloaded
+PARTIAL_EXT = '.part'
 
 def url_split(target):
     return target[0:target.rindex('/')], target[target.rindex('/') + 1:]
 
-def ftp_retrieve_active(ftpip, path, username, password, remote, local):
+def partial_file(saveas):
+    """ Downloads are written to a temporary sibling of the final file (named
+        saveas + PARTIAL_EXT) and renamed to saveas once complete. Hence, an
+        interrupted transfer never leaves a truncated file under the final
+        name; the partial file is kept so that a later try can resume it.
+        A partial file is only resumed if the remote file is still the one it
+        was started from; see partial_validator.
+    """
+    return saveas + PARTIAL_EXT
+
+def partial_validator(saveas, validator=None):
+    """ Get (or, if validator is given, set) the validator of the remote
+        file the partial file of saveas was started from; that is the HTTP
+        ETag/Last-Modified or the FTP MDTM and SIZE of the remote file. It is
+        kept in a sidecar file (partial_file(saveas) + '.validator'), since
+        remote files can be rewritten in place under the same name (e.g.
+        ultra-rapid products), in which case the partial file is useless.
+        Returns None if there is no (readable) validator.
+    """
+    sidecar = partial_file(saveas) + '.validator'
+    if validator is not None:
+        with open(sidecar, 'w') as fout:
+            fout.write(validator)
+        return validator
+    try:
+        with open(sidecar, 'r') as fin:
+            return fin.read().strip()
+    except OSError:
+        return None
+
+def drop_partial(saveas, keep_partial=False):
+    """ Remove the partial file of saveas (unless keep_partial is True, e.g.
+        after it has been renamed to saveas) and its validator.
+    """
+    for fn in ([] if keep_partial else [partial_file(saveas)]) + [partial_file(saveas) + '.validator']:
+        if os.path.isfile(fn): os.remove(fn)
+
+def resumable_offset(saveas, validator):
+    """ Size of the partial file of saveas, if it can be resumed, aka it
+        was started from the remote file identified by validator; otherwise
+        the partial file is removed and 0 is returned.
+    """
+    partial = partial_file(saveas)
+    if not os.path.isfile(partial):
+        drop_partial(saveas)
+        return 0
+    if validator is None or partial_validator(saveas) != validator:
+        drop_partial(saveas)
+        return 0
+    return os.path.getsize(partial)
+
+def http_validator(headers):
+    """ A validator (see partial_validator) usable in an If-Range header,
+        from the (response) headers; weak ETags cannot be used.
+    """
+    etag = headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'): return etag
+    return headers.get('Last-Modified')
+
+def ftp_mdtm(ftp, remote):
+    """ Return the modification time of the remote file as reported by the
+        FTP server (MDTM, e.g. '20221127093512'), or None if the server does
+        not support the command.
+    """
+    try:
+        return ftp.sendcmd('MDTM ' + remote).split()[1]
+    except (ftplib.error_perm, IndexError):
+        return None
+
+def ftp_pooled_retrieve(ftpip, path, username, password, remote, local, passive=True, use_cache=False):
+    """ Download the file path/remote from the FTP server ftpip to the local
+        file local, using a (pooled) logged-in connection, see
+        connpool.FtpPool.
+        The file is downloaded to partial_file(local) and atomically renamed
+        to local when complete. If a partial file already exists (from an
+        interrupted try), the transfer is resumed from its end (FTP REST),
+        as long as the remote MDTM and SIZE are the ones recorded when the
+        partial file was started (see partial_validator).
+        If use_cache is True and local was previously downloaded from the same
+        remote file, the transfer is skipped when the remote SIZE and MDTM
+        match the ones recorded in the metadata cache (see metacache).
+        Returns 0 on success, 1 if the remote file does not exist (or cannot
+        be accessed).
+    """
     status = 1
-    ftp = ftplib.FTP(host=ftpip, user=username, passwd=password, acct='', timeout=10)
-    # print('--> Downloading active with ftpip=[{:}], path=[{:}], username=[{:}], password=[{:}], remote=[{:}], local=[{:}]'.format(ftpip, path, username, password, remote, local))
-    ftp.set_pasv(False)
-    if path != '': ftp.cwd(path)
+    partial = partial_file(local)
+    remote_url = 'ftp://{:}{:}/{:}'.format(ftpip, path.rstrip('/'), remote)
+    # print('--> Downloading with ftpip=[{:}], path=[{:}], username=[{:}], password=[{:}], remote=[{:}], local=[{:}]'.format(ftpip, path, username, password, remote, local))
     try:
-        ## query size so that we fail if the remote does not exist and no local
-        ## file is created
-        assert( ftp.size(remote) )
-        ftp.retrbinary("RETR " + remote, open(local, 'wb').write)
-        status = 0
-    except FTP.error_perm:
-        os.remove(local)
-    ftp.close()
+        with g_ftp_pool.connection(ftpip, username, password, passive) as ftp:
+            ## pooled connections are shared; always change to the (absolute)
+            ## path of the file
+            ftp.cwd(path if path != '' else '/')
+            ## SIZE is not allowed in ASCII mode by some servers
+            ftp.voidcmd('TYPE I')
+            ## query size so that we fail if the remote does not exist and no
+            ## local file is created
+            remote_size = ftp.size(remote)
+            assert( remote_size is not None )
+            mdtm = ftp_mdtm(ftp, remote)
+            if use_cache and mdtm is not None:
+                cached = metacache.lookup(local, remote_url)
+                if cached is not None and cached['size'] == remote_size and cached['mdtm'] == mdtm:
+                    return 0
+            ## without MDTM we cannot tell if a partial file is still valid
+            validator = '{:} {:}'.format(mdtm, remote_size) if mdtm is not None else None
+            offset = resumable_offset(local, validator)
+            if offset > remote_size:
+                drop_partial(local)
+                offset = 0
+            if offset == 0:
+                open(partial, 'wb').close()
+                if validator is not None: partial_validator(local, validator)
+            if offset < remote_size:
+                start = time.time()
+                try:
+                    with open(partial, 'ab' if offset > 0 else 'wb') as fout:
+                        ftp.retrbinary("RETR " + remote, fout.write, rest=(offset if offset > 0 else None))
+                except ftplib.error_perm:
+                    ## server does not support REST; download the whole file
+                    if offset == 0: raise
+                    with open(partial, 'wb') as fout:
+                        ftp.retrbinary("RETR " + remote, fout.write)
+                    offset = 0
+                record_transfer(ftpip, os.path.getsize(partial) - offset, time.time() - start)
+            if os.path.getsize(partial) == remote_size:
+                os.replace(partial, local)
+                drop_partial(local, True)
+                status = 0
+                if use_cache: metacache.record(local, remote_url, size=remote_size, mdtm=mdtm)
+    except (ftplib.error_perm, AssertionError):
+        ## remote file missing; any partial file is stale
+        drop_partial(local)
     return status
 
+def ftp_pooled_stream(ftpip, path, username, password, remote, decoder):
+    """ Same as ftp_pooled_retrieve, but the remote file is not saved; its
+        bytes are written to decoder (e.g. a rnxstream.RinexStreamDecoder)
+        as they arrive and the decoder is closed when the transfer is
+        complete (aborted otherwise). Streamed transfers cannot be resumed.
+        Returns 0 on success, 1 otherwise.
+    """
+    received = [0]
+    def consume(block):
+        received[0] += len(block)
+        decoder.write(block)
+    try:
+        with g_ftp_pool.connection(ftpip, username, password, True) as ftp:
+            ftp.cwd(path if path != '' else '/')
+            ftp.voidcmd('TYPE I')
+            remote_size = ftp.size(remote)
+            assert( remote_size is not None )
+            start = time.time()
+            ftp.retrbinary("RETR " + remote, consume)
+            record_transfer(ftpip, received[0], time.time() - start)
+        if received[0] != remote_size:
+            decoder.abort()
+            return 1
+        decoder.close()
+    except:
+        decoder.abort()
+        return 1
+    return 0
+
+def ftp_retrieve_active(ftpip, path, username, password, remote, local, use_cache=False):
+    return ftp_pooled_retrieve(ftpip, path, username, password, remote, local, False, use_cache)
+
 def ftp_retrieve(url, filename=None, **kwargs):
     """
     :return: An integer denoting the download status; anything other than 0 
@@ -50,6 +211,18 @@ def ftp_retrieve(url, filename=None, **kwargs):
     active  : (boolean) true or false
     fail_error: True/False Throw exception if download fails. By default
                the function will throw if the download fails
+    use_cache: True/False Skip the transfer if the remote file has not
+               changed (same SIZE and MDTM) since it was last downloaded to
+               saveas (see metacache). Default is False
+    stream_decoder: A function returning a decoder for saveas (e.g.
+               rnxstream.rinex_stream_decoder), or None. If a decoder is
+               returned, the remote file is decoded while being downloaded
+               (see ftp_pooled_stream) and the returned saveas is the decoded
+               file (decoder.output). For active FTP, the file is decoded
+               right after the download.
+
+    The file is downloaded to partial_file(saveas) and renamed to saveas
+    only when complete; an existing partial file is resumed (FTP REST).
   """
     # print('>> called ftp_retrieve with args: url={:}, filename={:}, kwargs={:}'.format(url, filename, kwargs))
     if filename is None:
@@ -65,6 +238,8 @@ def ftp_retrieve(url, filename=None, **kwargs):
         # print('>> saveas is now {:}'.format(saveas))
     if not 'fail_error' in kwargs:
         kwargs['fail_error'] = True
+    use_cache = kwargs['use_cache'] if 'use_cache' in kwargs else False
+    decoder = kwargs['stream_decoder'](saveas) if 'stream_decoder' in kwargs and kwargs['stream_decoder'] is not None else None
 
     ## username or password key(s) in kwargs
     if set(['username', 'password']).intersection(set(kwargs)):
@@ -89,13 +264,23 @@ def ftp_retrieve(url, filename=None, **kwargs):
         ftpip = g.group(1).lstrip('@')
         target = filename
         path = g.group(2).replace(target, '')
-        status = ftp_retrieve_active(ftpip, path, username, password, target, saveas)
+        status = ftp_retrieve_active(ftpip, path, username, password, target, saveas, use_cache)
+        if decoder is not None and status == 0:
+            try:
+                saveas = decode_file(decoder, saveas)
+            except:
+                status = 1
     else:
         # print(">> Note that target={:}".format(target))
+        ## passive FTP, through a pooled connection
         try:
-            with closing(urllib.request.urlopen(target, timeout=10)) as r:
-                with open(saveas, 'wb') as f:
-                    shutil.copyfileobj(r, f)
+            parts = urlsplit(target)
+            path, remote = url_split(parts.path)
+            if decoder is not None:
+                status = ftp_pooled_stream(parts.hostname, path, unquote(parts.username) if parts.username else '', unquote(parts.password) if parts.password else '', remote, decoder)
+                saveas = decoder.output
+            else:
+                status = ftp_pooled_retrieve(parts.hostname, path, unquote(parts.username) if parts.username else '', unquote(parts.password) if parts.password else '', remote, saveas, True, use_cache)
         except:
             status = 1
     ## For debugging
@@ -164,6 +349,93 @@ def scp_retrieve(url, filename=None, **kwargs):
     os.rename(filename, saveas)
     return 0, url, saveas
 
+def scp_decode_retrieve(url, filename=None, **kwargs):
+    """ scp_retrieve followed by decoding of the downloaded file, using
+        kwargs['stream_decoder'] (see ftp_retrieve).
+    """
+    status, target, saveas = scp_retrieve(url, filename, **kwargs)
+    decoder = kwargs['stream_decoder'](saveas)
+    if status == 0 and decoder is not None:
+        saveas = decode_file(decoder, saveas)
+    return status, target, saveas
+
+def http_download(session, target, saveas, auth=None, timeout=20, use_cache=False):
+    """ Download the remote file target to the local file saveas, using the
+        requests session. The file is written to partial_file(saveas) and
+        atomically renamed to saveas when complete; if a partial file exists,
+        only the missing bytes are requested (HTTP Range), provided the remote
+        file has not changed since the partial file was started (If-Range,
+        with the validator recorded then; see partial_validator). If the
+        server replies with the whole file, it is downloaded from scratch.
+        If use_cache is True and saveas was previously downloaded from
+        target, a conditional request is made (If-None-Match/If-Modified-Since
+        using the ETag/Last-Modified recorded in the metadata cache, see
+        metacache); on a 304 (Not Modified) reply nothing is transfered.
+        Returns 0 on success, 1 otherwise. May throw (e.g. on timeout), in
+        which case the partial file is kept for a later try.
+    """
+    partial = partial_file(saveas)
+    offset = resumable_offset(saveas, partial_validator(saveas))
+    headers = {'Range': 'bytes={:}-'.format(offset), 'If-Range': partial_validator(saveas)} if offset > 0 else {}
+    cached = metacache.lookup(saveas, target) if use_cache and offset == 0 else None
+    if cached is not None:
+        if cached['etag'] is not None: headers['If-None-Match'] = cached['etag']
+        if cached['last_modified'] is not None: headers['If-Modified-Since'] = cached['last_modified']
+    with session.get(target, auth=auth, headers=headers, timeout=timeout, stream=True) as r:
+        if r.status_code == 304 and cached is not None:
+            ## not modified; local file is up-to-date
+            return 0
+        if r.status_code == 416 and offset > 0:
+            ## range not satisfiable; partial file is stale, start over
+            drop_partial(saveas)
+            return http_download(session, target, saveas, auth, timeout, use_cache)
+        if r.status_code not in [200, 206]:
+            drop_partial(saveas)
+            return 1
+        if r.status_code != 206:
+            ## whole file (remote changed, or no range support); start over,
+            ## recording the validator of the new remote file
+            drop_partial(saveas)
+            open(partial, 'wb').close()
+            if http_validator(r.headers) is not None: partial_validator(saveas, http_validator(r.headers))
+        start = time.time()
+        received = 0
+        with open(partial, 'ab') as fh:
+            for chunk in r.iter_content(1024 * 1024):
+                fh.write(chunk)
+                received += len(chunk)
+        record_transfer(urlsplit(target).netloc, received, time.time() - start)
+        etag, last_modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+    os.replace(partial, saveas)
+    drop_partial(saveas, True)
+    if use_cache:
+        metacache.record(saveas, target, etag=etag, last_modified=last_modified)
+    return 0
+
+def http_stream(session, target, decoder, auth=None, timeout=20):
+    """ Same as http_download, but the remote file is not saved; its bytes
+        are written to decoder (e.g. a rnxstream.RinexStreamDecoder) as they
+        arrive and the decoder is closed when the transfer is complete
+        (aborted otherwise). Streamed transfers cannot be resumed.
+        Returns 0 on success, 1 otherwise.
+    """
+    try:
+        with session.get(target, auth=auth, timeout=timeout, stream=True) as r:
+            if r.status_code != 200:
+                decoder.abort()
+                return 1
+            start = time.time()
+            received = 0
+            for chunk in r.iter_content(1024 * 1024):
+                decoder.write(chunk)
+                received += len(chunk)
+            record_transfer(urlsplit(target).netloc, received, time.time() - start)
+        decoder.close()
+    except:
+        decoder.abort()
+        return 1
+    return 0
+
 def http_retrieve(url, filename=None, **kwargs):
     """
     :return: An integer denoting the download status; anything other than 0 
@@ -178,6 +450,18 @@ def http_retrieve(url, filename=None, **kwargs):
                of these two, aka os.path.join(save_dir, save_as)
     fail_error: True/False Throw exception if download fails. By default
                the function will throw if the download fails
+    use_cache: True/False Make a conditional request (using the ETag and
+               Last-Modified headers recorded when saveas was last
+               downloaded, see metacache) and skip the transfer if the remote
+               file has not changed. Default is False
+    stream_decoder: A function returning a decoder for saveas (e.g.
+               rnxstream.rinex_stream_decoder), or None. If a decoder is
+               returned, the remote file is decoded while being downloaded
+               (see http_stream) and the returned saveas is the decoded file
+               (decoder.output).
+
+    The file is downloaded to partial_file(saveas) and renamed to saveas
+    only when complete; an existing partial file is resumed (HTTP Range).
   """
     if filename is None:
         url, filename = url_split(url)
@@ -190,6 +474,7 @@ def http_retrieve(url, filename=None, **kwargs):
         saveas = os.path.join(kwargs['save_dir'], saveas)
     if not 'fail_error' in kwargs:
         kwargs['fail_error'] = True
+    use_cache = kwargs['use_cache'] if 'use_cache' in kwargs else False
 
     use_credentials = False
     if set(['username', 'password']).intersection(set(kwargs)):
@@ -201,32 +486,20 @@ def http_retrieve(url, filename=None, **kwargs):
 
     target = '{:}/{:}'.format(url, filename)
 
+    ## connections to the same host are reused (see connpool)
+    session = http_session(target)
+
+    decoder = kwargs['stream_decoder'](saveas) if 'stream_decoder' in kwargs and kwargs['stream_decoder'] is not None else None
+
     status = 0
-    if not use_credentials:  ## download with no credentials
-        try:
-            ## allow timeout with requests
-            request = requests.get(target, timeout=20, stream=True)
-            if request.status_code == 200:
-              with open(saveas, 'wb') as fh:
-                  for chunk in request.iter_content(1024 * 1024):
-                      fh.write(chunk)
-
-            if not os.path.isfile(saveas):
-                status += 1
-        except:
-            status = 1
-    else:  ## download with credentials (not sure if this works for python 2)
-        try:
-            with requests.get(target, auth=(username, password), timeout=20) as r:
-                r.raise_for_status()
-                if r.status_code == 200:
-                  with open(saveas, 'wb') as f:
-                      #shutil.copyfileobj(r.raw, f)
-                      f.write(r.content)
-                if not os.path.isfile(saveas):
-                    status += 1
-        except:
-            status = 1
+    try:
+        if decoder is not None:
+            status = http_stream(session, target, decoder, (username, password) if use_credentials else None)
+            saveas = decoder.output
+        else:
+            status = http_download(session, target, saveas, (username, password) if use_credentials else None, use_cache=use_cache)
+    except:
+        status = 1
 
     if status > 0 and kwargs['fail_error'] == True:
         msg = '[ERROR] retrieve::http_retrieve Failed to download file {:}'.format(
@@ -236,16 +509,115 @@ def http_retrieve(url, filename=None, **kwargs):
     return status, target, saveas
 
 
+def remote_exists(url, **kwargs):
+    """ Check if a remote file exists, without downloading it; uses a HEAD
+        request for http(s) and a SIZE command for ftp urls (through the
+        pooled connections, see connpool). The url and kwargs are the same as
+        for web_retrieve (only filename, username, password, active, timeout
+        and check_listing matter). If check_listing is True and the listing
+        of the remote directory is available (see listcache), the answer is
+        based on the listing.
+        Returns True if the file exists, False if it does not (or the server
+        cannot be reached). For any other protocol (e.g. ssh), True is
+        returned, aka the caller should just try to download the file.
+    """
+    filename = None if 'filename' not in kwargs else kwargs['filename']
+    if filename is None:
+        url, filename = url_split(url)
+    target = '{:}/{:}'.format(url, filename)
+    username = kwargs['username'] if 'username' in kwargs and kwargs['username'] is not None else ''
+    password = kwargs['password'] if 'password' in kwargs and kwargs['password'] is not None else ''
+    timeout = kwargs['timeout'] if 'timeout' in kwargs else 20
+    if 'check_listing' in kwargs and kwargs['check_listing'] and not target.startswith('ssh'):
+        listed = g_listing_cache.exists(url, **dict(kwargs, filename=filename))
+        if listed is not None: return listed
+    try:
+        if target.startswith('http'):
+            session = http_session(target)
+            auth = (username, password) if username != '' or password != '' else None
+            r = session.head(target, auth=auth, timeout=timeout, allow_redirects=True)
+            if r.status_code in [405, 501]:
+                ## HEAD not supported; start a GET and close it
+                with session.get(target, auth=auth, timeout=timeout, stream=True) as r:
+                    return r.status_code == 200
+            return r.status_code == 200
+        elif target.startswith('ftp'):
+            parts = urlsplit(target)
+            if parts.username: username = unquote(parts.username)
+            if parts.password: password = unquote(parts.password)
+            path, remote = url_split(parts.path)
+            passive = not ('active' in kwargs and kwargs['active'] == True)
+            with g_ftp_pool.connection(parts.hostname, username, password, passive) as ftp:
+                ftp.cwd(path if path != '' else '/')
+                ftp.voidcmd('TYPE I')
+                return ftp.size(remote) is not None
+        return True
+    except:
+        return False
+
 def web_retrieve(url, **kwargs):
+    """ Download a remote file, using the protocol of the given url (http(s),
+        ftp or ssh). See http_retrieve, ftp_retrieve and scp_retrieve for
+        the kwargs accepted.
+        Note that http(s) and ftp connections are pooled (see connpool), so
+        that consecutive downloads from the same host reuse the same
+        (logged-in) connection.
+        If kwargs['negative_cache_ttl'] is given (seconds, > 0), urls that
+        failed to download recently (see negcache) are not tried again; the
+        download fails right away. Failed downloads are recorded in the
+        negative cache (waiting negative_cache_ttl seconds, doubled on every
+        consecutive failure) and successful ones are removed from it.
+        If kwargs['check_listing'] is True, the remote file is first looked up
+        in the (cached) listing of its remote directory (see listcache); if it
+        is not listed, no transfer is attempted and the download fails.
+        If the listing is not available, the transfer is attempted as usual.
+        A download that fails without a transfer, throws (or returns a
+        non-zero status if fail_error is False).
+        If kwargs['stream_decoder'] is given, files are decoded while being
+        downloaded (see ftp_retrieve and http_retrieve); files downloaded
+        via ssh are decoded right after the download.
+    """
     # print('>> called web_retrieve with args: url={:}, kwargs={:}'.format(url, kwargs))
     filename = None if 'filename' not in kwargs else kwargs['filename']
+    target = url if filename is None else '{:}/{:}'.format(url, filename)
+    fail_error = kwargs['fail_error'] if 'fail_error' in kwargs else True
+    negative_ttl = kwargs['negative_cache_ttl'] if 'negative_cache_ttl' in kwargs and kwargs['negative_cache_ttl'] else None
+
+    if negative_ttl is not None and g_negative_cache.is_missing(target):
+        if fail_error:
+            msg = '[ERROR] retrieve::web_retrieve Remote file {:} failed recently; not retrying yet (negative cache)'.format(target)
+            raise RuntimeError(msg)
+        return 1, target, None
+    if 'check_listing' in kwargs and kwargs['check_listing'] and not url.startswith('ssh'):
+        if g_listing_cache.exists(url, **kwargs) == False:
+            if negative_ttl is not None: g_negative_cache.add(target, negative_ttl)
+            if fail_error:
+                msg = '[ERROR] retrieve::web_retrieve Remote file {:} not listed in remote directory'.format(target)
+                raise RuntimeError(msg)
+            return 1, target, None
+
     if url.startswith('http'):
-        return http_retrieve(url, filename, **kwargs)
+        retrieve = http_retrieve
     elif url.startswith('ftp'):
-        return ftp_retrieve(url, filename, **kwargs)
+        retrieve = ftp_retrieve
     elif url.startswith('ssh'):
-        return scp_retrieve(url, filename, **kwargs)
+        retrieve = scp_retrieve
+        if 'stream_decoder' in kwargs and kwargs['stream_decoder'] is not None:
+            retrieve = scp_decode_retrieve
     else:
         msg = '[ERROR] retrieve::web_retrieve Unknown url protocol {:}'.format(
             url)
         raise RuntimeError(msg)
+
+    if negative_ttl is None:
+        return retrieve(url, filename, **kwargs)
+    try:
+        status, remote, saveas = retrieve(url, filename, **kwargs)
+    except:
+        g_negative_cache.add(target, negative_ttl)
+        raise
+    if status == 0:
+        g_negative_cache.remove(target)
+    else:
+        g_negative_cache.add(target, negative_ttl)
+    return status, remote, saveas
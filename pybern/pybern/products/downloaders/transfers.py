@@ -0,0 +1,82 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import threading
+import contextlib
+import contextvars
+
+##  Statistics of the (completed) transfers made by the downloaders (see
+##+ retrieve and aretrieve), per data center:
+##  {'DSO_MTRC': {'bytes': 10485760, 'files': 12, 'seconds': 8.2}, ...}
+##  where seconds is the (summed) time spent receiving data; used to report
+##+ bytes downloaded and throughput per data center (e.g. by rundd). Counters
+##+ only grow; use snapshot/difference to get the transfers of a period.
+##  Transfers are recorded (see record_transfer) to the process-wide
+##+ g_transfer_stats, and to the TransferStats of the current run (if any),
+##+ held in the context variable g_run_transfers; so that runs sharing the
+##+ process (see rundd_batch.py) only count their own transfers, worker
+##+ threads downloading for a run must run in (a copy of) its context (see
+##+ contextvars.copy_context).
+##  A transfer is labeled by the data center set with transfer_label (e.g.
+##+ the dc_name of a RINEX station row), or else by the remote host.
+
+class TransferStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def add(self, host, nbytes, seconds):
+        """ Record a transfer of nbytes bytes from host, that took seconds.
+        """
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = {'bytes': 0, 'files': 0, 'seconds': 0e0}
+            self.hosts[host]['bytes'] += nbytes
+            self.hosts[host]['files'] += 1
+            self.hosts[host]['seconds'] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return { host: dict(stats) for host, stats in self.hosts.items() }
+
+    def total_bytes(self):
+        with self.lock:
+            return sum([ stats['bytes'] for stats in self.hosts.values() ])
+
+def difference(new, old):
+    """ Transfers made between two snapshots (old, new) of TransferStats.
+    """
+    diff = {}
+    for host, stats in new.items():
+        prev = old[host] if host in old else {'bytes': 0, 'files': 0, 'seconds': 0e0}
+        if stats['files'] > prev['files']:
+            diff[host] = { k: stats[k] - prev[k] for k in stats }
+    return diff
+
+## the process-wide transfer statistics
+g_transfer_stats = TransferStats()
+## the transfer statistics of the current run, if any
+g_run_transfers = contextvars.ContextVar('run_transfers', default=None)
+## the data center of the transfers made in the current context, if known
+g_transfer_label = contextvars.ContextVar('transfer_label', default=None)
+
+@contextlib.contextmanager
+def transfer_label(label):
+    """ Label transfers made within the block as from data center label.
+    """
+    token = g_transfer_label.set(label)
+    try:
+        yield
+    finally:
+        g_transfer_label.reset(token)
+
+def record_transfer(host, nbytes, seconds):
+    """ Record a transfer of nbytes bytes from host, that took seconds, to
+        the process-wide and the current run's statistics.
+    """
+    label = g_transfer_label.get() or host
+    g_transfer_stats.add(label, nbytes, seconds)
+    run_stats = g_run_transfers.get()
+    if run_stats is not None: run_stats.add(label, nbytes, seconds)
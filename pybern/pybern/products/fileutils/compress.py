@@ -13,6 +13,7 @@ from sys import version_info as version_info
 #    from cmpvar import find_os_compression_type, name_of_decompressed
 #else:
 from .cmpvar import find_os_compression_type, name_of_decompressed
+from . import lzw
 
 
 def os_compress(filename, ctype, remove_original=False):
@@ -36,8 +37,11 @@ def os_compress(filename, ctype, remove_original=False):
     compressed_file = '{:}{:}'.format(filename, ctype)
     status = 0
     if ctype == '.Z':
+        ## encode LZW in-process; as with 'compress -f', the original file is
+        ## removed
         try:
-            subprocess.call(["compress", "-f", "{:}".format(filename)])
+            lzw.compress_file(filename, compressed_file)
+            os.remove(filename)
         except:
             status = 1
     elif ctype == '.gz':
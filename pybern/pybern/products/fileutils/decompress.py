@@ -9,11 +9,17 @@ import shutil
 import subprocess
 import gzip, tarfile, zipfile
 import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 #from sys import version_info as version_info
 #if version_info.major == 2:
 #    from cmpvar import find_os_compression_type, name_of_decompressed
 #else:
 from .cmpvar import find_os_compression_type, name_of_decompressed
+from . import lzw
+from .rnxstream import RinexStreamDecoder, decode_file
+from pybern.products.utils.timing import add_child_cpu
 
 def crx2rnx(filename, remove_compressed=True, path2crx2rnx=None):
     """ Decompress a Hatanaka-compressed RINEX file, to an obs file. This
@@ -54,6 +60,89 @@ def crx2rnx(filename, remove_compressed=True, path2crx2rnx=None):
     return filename, urnx
 
 
+def is_crinex(filename):
+    """ Check if filename (maybe .Z/.gz compressed) is the name of a
+        Hatanaka-compressed RINEX file, aka it ends in '.YYd' (RINEX v2) or in
+        '.crx' (RINEX v3).
+    """
+    return re.search(r'(\.[0-9]{2}d|\.crx)(\.Z|\.gz)?$', filename) is not None
+
+
+def decompress_path(filename, remove_compressed=True, path2crx2rnx=None):
+    """ Decompress a file, picking the codec from its name:
+        * Hatanaka-compressed RINEX files (maybe also .Z/.gz compressed, see
+          is_crinex) are decompressed to obs files (in-process, in one pass;
+          or using the CRX2RNX program in path2crx2rnx, if given),
+        * files compressed to any of ['.Z', '.gz', '.tar.gz', '.zip'] are
+          decompressed using os_decompress; if the resulting file is a
+          Hatanaka-compressed RINEX file (e.g. for .zip files) it is then
+          decompressed to an obs file,
+        * any other file is left as it is.
+        Returns a tuple (filename, decompressed_filename). Will throw if the
+        operation fails!
+    """
+    if not os.path.isfile(filename):
+        ermsg = '[ERROR] decompress::decompress_path file {:} does not exist'.format(filename)
+        raise RuntimeError(ermsg)
+    if is_crinex(filename):
+        return filename, decode_file(RinexStreamDecoder(filename, path2crx2rnx), filename, remove_compressed)
+    if find_os_compression_type(filename) is None:
+        return filename, filename
+    _, dfile = os_decompress(filename, remove_compressed)
+    if is_crinex(dfile):
+        ## always remove the (intermediate) Hatanaka file
+        dfile = decode_file(RinexStreamDecoder(dfile, path2crx2rnx), dfile, True)
+    return filename, dfile
+
+
+def decompress_path_cpu(filename, remove_compressed=True, path2crx2rnx=None):
+    """ decompress_path, returning (its result, the CPU time it took); used
+        by pool workers to report their CPU time (see decompress_many).
+    """
+    start = time.process_time()
+    result = decompress_path(filename, remove_compressed, path2crx2rnx)
+    return result, time.process_time() - start
+
+def decompress_many(paths, workers=None, remove_compressed=True, path2crx2rnx=None):
+    """ Decompress a list of files (see decompress_path), using a pool of (at
+        most) workers processes (default: one per CPU).
+        Returns a dictionary with an entry per file, of the form:
+        {filename: (decompressed_filename, None)} for files decompressed (or
+        not compressed) and {filename: (None, error_message)} for files that
+        failed.
+    """
+    results = {}
+    if workers == 1 or len(paths) < 2:
+        for fn in paths:
+            try:
+                results[fn] = (decompress_path(fn, remove_compressed, path2crx2rnx)[1], None)
+            except Exception as e:
+                results[fn] = (None, str(e))
+        return results
+
+    ## callers are multithreaded (download/stage pools); never fork them,
+    ## start the workers from a (single-threaded) fork server instead
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver')) as executor:
+        futures = { executor.submit(decompress_path_cpu, fn, remove_compressed, path2crx2rnx): fn for fn in paths }
+        for future in as_completed(futures):
+            fn = futures[future]
+            try:
+                result, cpu = future.result()
+                ## the workers' CPU time counts for the caller's (timing) spans
+                add_child_cpu(cpu)
+                results[fn] = (result[1], None)
+            except Exception as e:
+                results[fn] = (None, str(e))
+    return results
+
+
+def decompress_rinex_batch(filenames, workers=None, remove_compressed=True, path2crx2rnx=None):
+    """ Decompress a list of RINEX files to obs files, in parallel; see
+        decompress_many.
+    """
+    return decompress_many(filenames, workers, remove_compressed, path2crx2rnx)
+
+
 def os_decompress(filename, remove_original=False):
     """ decompress a file for any of the formats:
     ['.Z', '.gz', '.tar.gz', '.zip']
@@ -73,18 +162,13 @@ def os_decompress(filename, remove_original=False):
         return filename, filename
     noncmp_filename = name_of_decompressed(filename)
     status = 0
-    ## use 7-zip on windows and uncompress on Linux
+    ## decode LZW in-process (no uncompress/7z); unlike 'uncompress', the .Z
+    ## file is only removed if remove_original is set (as for all formats)
     if ctype == '.Z':
-        if os.name == 'nt':  ## windows
-            subprocess.check_call([
-                "7z", "e", "-y", "-bso0", "{:}".format(filename),
-                "-o{:}".format(os.path.dirname(noncmp_filename))
-            ])
-        else:
-            try:
-                subprocess.check_call(["uncompress", "-f", "{:}".format(filename)], stderr=sys.stderr)
-            except:
-                status = 1
+        try:
+            lzw.decompress_file(filename, noncmp_filename)
+        except:
+            status = 1
     elif ctype == '.gz':
         try:
             with gzip.open(filename, 'rb') as f_in:
@@ -122,6 +206,6 @@ def os_decompress(filename, remove_original=False):
         msg += "note: expected descompressed file {:} not found!".format(noncmp_filename)
         raise RuntimeError(msg)
     else:
-        if remove_original and ctype != '.Z':
+        if remove_original:
             os.remove(filename)
     return filename, noncmp_filename
@@ -0,0 +1,280 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+
+##  In-process decoder for Hatanaka-compressed (Compact RINEX, CRINEX 1.0 for
+##+ RINEX 2 and CRINEX 3.0 for RINEX 3) observation files, i.e. a Python
+##+ version of CRX2RNX. Use as:
+##  decoder = CrinexDecoder()
+##  for block in blocks: fout.write(decoder.decompress(block))
+##  fout.write(decoder.flush())
+##  or decompress_file('dion0010.21d', 'dion0010.21o').
+##
+##  Format notes (per epoch, after the header):
+##  * the epoch line, holding the satellite list (and no clock offset); it
+##+   is either given in full (first char '&' for CRINEX 1.0, '>' for 3.0,
+##+   aka initialization) or as a text difference to the previous one (a
+##+   blank means 'same char', '&' means 'blank'),
+##  * the receiver clock offset line (maybe empty),
+##  * one line per satellite, holding the observables as (integer)
+##+   differences of order up to M ('M&value' is the first value of an arc,
+##+   an empty field is a missing value), followed by the text difference of
+##+   the LLI/SSI flags.
+##  Epochs with event flags 2 to 5 (and their header/comment records) are
+##+ given in full, and are not differenced.
+
+## position of the epoch flag (followed by the number of satellites) and of
+## the satellite list in the (compact) epoch line, per CRINEX version
+EPOCH_FLAG = {1: 28, 3: 31}
+SAT_LIST = {1: 32, 3: 41}
+## decimals of the receiver clock offset, per CRINEX version
+CLOCK_DECIMALS = {1: 9, 3: 12}
+
+def repair(old, diff):
+    """ Apply the text difference diff to the string old.
+    """
+    new = list(old)
+    for i, c in enumerate(diff):
+        if i >= len(new):
+            new.append(' ' if c == '&' else c)
+        elif c == '&':
+            new[i] = ' '
+        elif c != ' ':
+            new[i] = c
+    return ''.join(new)
+
+def fixed_point(value, decimals, width):
+    """ Format the integer value (in units of 10^-decimals) as CRX2RNX does,
+        i.e. a fixed point number with no leading zero ('-.005').
+    """
+    sign = '-' if value < 0 else ''
+    units, frac = divmod(abs(value), 10**decimals)
+    return '{:}{:}.{:0{:}d}'.format(sign, units if units else '', frac, decimals).rjust(width)
+
+class CrinexDecoder:
+
+    def __init__(self):
+        self.buf = ''
+        self.line_nr = 0
+        self.version = None
+        ## 'crinex' (first header line), 'header', 'epoch', 'clock', 'data'
+        ## or 'event'
+        self.state = 'crinex'
+        ## number of observation types; per satellite system for RINEX 3
+        self.num_types = {}
+        self.epoch = ''
+        self.sats = []
+        self.sat_index = 0
+        self.event_lines = 0
+        self.clock = None
+        ## satellite -> [per observable arc state, flags]
+        self.arcs = {}
+        self.new_arcs = {}
+
+    def error(self, msg):
+        msg = '[ERROR] hatanaka::CrinexDecoder {:} (line {:})'.format(msg, self.line_nr)
+        raise RuntimeError(msg)
+
+    def header_line(self, line):
+        label = line[60:].strip()
+        if label == '# / TYPES OF OBSERV' and line[0:6].strip():
+            self.num_types[''] = int(line[0:6])
+        elif label == 'SYS / # / OBS TYPES' and line[0] != ' ':
+            self.num_types[line[0]] = int(line[3:6])
+
+    def arc_value(self, field, arc):
+        """ Decode a numeric field; arc is the state of the arc (None if it
+            is not initialized), as [order, D0, D1, ...] where Dk is the k-th
+            order difference at the previous epoch. Returns (value, arc).
+        """
+        if len(field) > 1 and field[1] == '&':
+            arc = [int(field[0]), int(field[2:])]
+            return arc[1], arc
+        if arc is None:
+            self.error('Difference without initialization')
+        order = min(len(arc) - 1, arc[0])
+        cur = [0] * (order + 1)
+        cur[order] = int(field)
+        for j in range(order - 1, -1, -1):
+            cur[j] = cur[j+1] + arc[j+1]
+        return cur[0], [arc[0]] + cur
+
+    def epoch_line(self, line):
+        marker = '&' if self.version == 1 else '>'
+        if line.startswith(marker):
+            new = (' ' + line[1:]) if self.version == 1 else line
+            flag = new[EPOCH_FLAG[self.version]:EPOCH_FLAG[self.version]+1]
+            if flag in ['2', '3', '4', '5']:
+                ## special event; the following records are given in full
+                self.event_lines = int(new[EPOCH_FLAG[self.version]+1:EPOCH_FLAG[self.version]+4] or 0)
+                self.state = 'event' if self.event_lines > 0 else 'epoch'
+                return new.rstrip()
+            ## initialization; all arcs start over
+            self.epoch = new
+            self.arcs = {}
+            self.clock = None
+        else:
+            if not self.epoch:
+                self.error('Epoch difference without initialization')
+            self.epoch = repair(self.epoch, line)
+        pos = SAT_LIST[self.version]
+        try:
+            nsat = int(self.epoch[EPOCH_FLAG[self.version]+1:EPOCH_FLAG[self.version]+4])
+        except ValueError:
+            self.error('Invalid epoch line')
+        self.sats = [ self.epoch[pos+3*i:pos+3*i+3] for i in range(nsat) ]
+        self.new_arcs = {}
+        self.sat_index = 0
+        self.state = 'clock'
+        return None
+
+    def clock_line(self, line):
+        """ Decode the clock line and return the (RINEX) epoch line(s).
+        """
+        clock = None
+        if line.strip():
+            clock, self.clock = self.arc_value(line.strip(), self.clock)
+        else:
+            self.clock = None
+        pos = SAT_LIST[self.version]
+        if self.version == 1:
+            lines = []
+            for i in range(0, max(len(self.sats), 1), 12):
+                head = self.epoch[0:pos] if i == 0 else ' ' * pos
+                lines.append(head + ''.join(self.sats[i:i+12]))
+            if clock is not None:
+                lines[0] = lines[0].ljust(68) + fixed_point(clock, CLOCK_DECIMALS[1], 12)
+        else:
+            lines = [self.epoch[0:EPOCH_FLAG[3]+4]]
+            if clock is not None:
+                lines[0] = lines[0].ljust(pos) + fixed_point(clock, CLOCK_DECIMALS[3], 15)
+        self.state = 'data' if self.sats else 'epoch'
+        return '\n'.join([ l.rstrip() for l in lines ])
+
+    def data_line(self, line):
+        """ Decode the observables of the next satellite and return the
+            (RINEX) data line(s).
+        """
+        sat = self.sats[self.sat_index]
+        ntypes = self.num_types.get('' if self.version == 1 else sat[0])
+        if ntypes is None:
+            self.error('No observation types for satellite {:}'.format(sat))
+        fields = line.split(' ', ntypes)
+        fields += [''] * (ntypes + 1 - len(fields))
+        old_arcs, old_flags = self.arcs.get(sat, ([], ''))
+        old_arcs = old_arcs + [None] * (ntypes - len(old_arcs))
+        arcs = []
+        values = []
+        for field, arc in zip(fields[0:ntypes], old_arcs):
+            if field:
+                try:
+                    value, arc = self.arc_value(field, arc)
+                except ValueError:
+                    self.error('Invalid field \'{:}\''.format(field))
+                values.append(value)
+            else:
+                values.append(None)
+                arc = None
+            arcs.append(arc)
+        flags = list(repair(old_flags, fields[ntypes]).ljust(2 * ntypes))
+        ## missing values have no flags (also for the next epoch's difference)
+        for i, v in enumerate(values):
+            if v is None: flags[2*i:2*i+2] = '  '
+        flags = ''.join(flags)
+        self.new_arcs[sat] = (arcs, flags)
+        obs = [ ' ' * 16 if v is None else fixed_point(v, 3, 14) + flags[2*i:2*i+2] for i, v in enumerate(values) ]
+        self.sat_index += 1
+        if self.sat_index == len(self.sats):
+            ## satellites not in this epoch start new arcs when they reappear
+            self.arcs = self.new_arcs
+            self.state = 'epoch'
+        if self.version == 1:
+            return '\n'.join([ ''.join(obs[i:i+5]).rstrip() for i in range(0, max(ntypes, 1), 5) ])
+        return (sat + ''.join(obs)).rstrip()
+
+    def decode_line(self, line):
+        """ Decode one line of the CRINEX file; returns the RINEX line(s) or
+            None.
+        """
+        self.line_nr += 1
+        if self.state == 'crinex':
+            if line[60:].strip() != 'CRINEX VERS   / TYPE':
+                self.error('Not a Compact RINEX file')
+            if line[0:3] == '1.0':
+                self.version = 1
+            elif line[0:3] == '3.0':
+                self.version = 3
+            else:
+                self.error('Unsupported CRINEX version {:}'.format(line[0:20].strip()))
+            self.state = 'header'
+            return None
+        elif self.state == 'header':
+            if line[60:].strip() == 'CRINEX PROG / DATE':
+                return None
+            self.header_line(line)
+            if line[60:].strip() == 'END OF HEADER':
+                self.state = 'epoch'
+            return line
+        elif self.state == 'epoch':
+            if not line.strip():
+                ## e.g. blank lines at the end of file
+                return None
+            return self.epoch_line(line)
+        elif self.state == 'clock':
+            return self.clock_line(line)
+        elif self.state == 'data':
+            return self.data_line(line)
+        else:
+            self.header_line(line)
+            self.event_lines -= 1
+            if self.event_lines == 0:
+                self.state = 'epoch'
+            return line
+
+    def decompress(self, data):
+        """ Feed (a chunk of) the CRINEX file (bytes); returns the RINEX data
+            decoded so far (possibly empty).
+        """
+        self.buf += data.decode('latin-1')
+        lines = self.buf.split('\n')
+        self.buf = lines.pop()
+        out = []
+        for line in lines:
+            rnx = self.decode_line(line.rstrip('\r'))
+            if rnx is not None:
+                out.append(rnx + '\n')
+        return ''.join(out).encode('latin-1')
+
+    def flush(self):
+        """ Signal the end of the CRINEX file; returns any remaining decoded
+            data. Raises if the file is truncated (in the middle of an epoch).
+        """
+        data = b''
+        if self.buf:
+            data = self.decompress(b'\n')
+        if self.state not in ['epoch']:
+            self.error('Truncated Compact RINEX file')
+        return data
+
+def decompress_file(source, target, blocksize=1024*1024):
+    """ Decompress the (Hatanaka-compressed) RINEX file source to target;
+        target is written to a temporary file and renamed when complete.
+        Returns target.
+    """
+    dcmp = CrinexDecoder()
+    tmp = target + '.part'
+    try:
+        with open(source, 'rb') as fin, open(tmp, 'wb') as fout:
+            while True:
+                block = fin.read(blocksize)
+                if not block:
+                    break
+                fout.write(dcmp.decompress(block))
+            fout.write(dcmp.flush())
+    except:
+        if os.path.isfile(tmp): os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+    return target
@@ -0,0 +1,312 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+
+##  In-process codec for the Unix 'compress' (.Z) format, aka LZW with
+##+ variable code size (9 to 16 bits), as written by compress/ncompress and
+##+ read by uncompress/gzip. Use as:
+##  decompressor = LZWDecompressor()
+##  for block in blocks: fout.write(decompressor.decompress(block))
+##  fout.write(decompressor.flush())
+##  or decompress_file('foo.Z', 'foo') / compress_file('foo', 'foo.Z').
+##
+##  Format notes:
+##  * a 3-byte header: 0x1f 0x9d and a flags byte (max code size in the low
+##+   5 bits, 0x80 if block mode, aka if CLEAR codes are used)
+##  * codes are packed LSB first, in groups of 8 codes (n_bits bytes per
+##+   group); when the code size changes (or after a CLEAR code), the rest of
+##+   the current group is skipped (padding)
+##  The decoder works one group at a time, and the string table holds the
+##+ bytes of every entry (table-driven), so that each code costs a lookup and
+##+ (at most) one concatenation.
+
+MAGIC = b'\x1f\x9d'
+BLOCK_MODE = 0x80
+BIT_MASK = 0x1f
+INIT_BITS = 9
+MAX_BITS = 16
+CLEAR = 256
+## compression ratio is checked every CHECK_GAP input bytes, once the table
+## is full (see LZWCompressor)
+CHECK_GAP = 10000
+
+class LZWDecompressor:
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.header = False
+        self.eof = False
+        self.maxbits = MAX_BITS
+        self.block_mode = True
+        self.reset()
+
+    def reset(self):
+        """ Reset the string table and the code size (start, or CLEAR).
+        """
+        self.table = [ bytes([i]) for i in range(256) ]
+        if self.block_mode:
+            ## CLEAR code; never output
+            self.table.append(b'')
+        self.n_bits = INIT_BITS
+        self.maxcode = (1 << self.n_bits) - 1
+        self.prev = None
+
+    def next_code_size(self):
+        self.n_bits += 1
+        self.maxcode = (1 << self.n_bits) - 1 if self.n_bits < self.maxbits else self.maxmaxcode
+
+    def read_header(self):
+        if self.buf[0:2] != MAGIC:
+            msg = '[ERROR] lzw::LZWDecompressor Not in compress (.Z) format'
+            raise RuntimeError(msg)
+        self.maxbits = self.buf[2] & BIT_MASK
+        self.block_mode = (self.buf[2] & BLOCK_MODE) != 0
+        if self.maxbits > MAX_BITS or self.maxbits < INIT_BITS:
+            msg = '[ERROR] lzw::LZWDecompressor Invalid max code size {:}'.format(self.maxbits)
+            raise RuntimeError(msg)
+        self.maxmaxcode = 1 << self.maxbits
+        del self.buf[0:3]
+        self.header = True
+        self.reset()
+
+    def decode(self, final=False):
+        """ Decode all complete groups of codes in the buffer (and the last,
+            partial, group if final is True); returns the decoded bytes.
+        """
+        out = []
+        table = self.table
+        pos = 0
+        size = len(self.buf)
+        while True:
+            ## next entry needs a larger code (at a group boundary)
+            if len(table) > self.maxcode and self.n_bits < self.maxbits:
+                self.next_code_size()
+            group_bytes = self.n_bits
+            if size - pos < group_bytes:
+                if not final or size - pos == 0:
+                    break
+                ## last (partial) group
+                group_bytes = size - pos
+            n_bits = self.n_bits
+            num_codes = (group_bytes * 8) // n_bits
+            bits = int.from_bytes(self.buf[pos:pos+group_bytes], 'little')
+            pos += group_bytes
+            mask = (1 << n_bits) - 1
+            prev = self.prev
+            for i in range(num_codes):
+                ## next entry needs a larger code; skip the rest of the group
+                if len(table) > self.maxcode and self.n_bits < self.maxbits:
+                    self.next_code_size()
+                    break
+                code = (bits >> (i * n_bits)) & mask
+                if code == CLEAR and self.block_mode:
+                    self.reset()
+                    table = self.table
+                    prev = None
+                    break
+                if prev is None:
+                    if code > 255:
+                        msg = '[ERROR] lzw::LZWDecompressor Corrupt input (invalid first code {:})'.format(code)
+                        raise RuntimeError(msg)
+                    entry = table[code]
+                elif code < len(table):
+                    entry = table[code]
+                    if len(table) < self.maxmaxcode: table.append(prev + entry[0:1])
+                elif code == len(table):
+                    ## KwKwK case
+                    entry = prev + prev[0:1]
+                    if len(table) < self.maxmaxcode: table.append(entry)
+                else:
+                    msg = '[ERROR] lzw::LZWDecompressor Corrupt input (code {:} not in table)'.format(code)
+                    raise RuntimeError(msg)
+                out.append(entry)
+                prev = entry
+            self.prev = prev
+        del self.buf[0:pos]
+        return b''.join(out)
+
+    def decompress(self, data):
+        """ Feed (a chunk of) compressed data; returns the data decoded so far
+            (possibly empty).
+        """
+        self.buf += data
+        if not self.header:
+            if len(self.buf) < 3:
+                return b''
+            self.read_header()
+        return self.decode()
+
+    def flush(self):
+        """ Signal the end of the compressed data; returns any remaining
+            decoded data.
+        """
+        if not self.header:
+            if len(self.buf) == 0 and self.eof:
+                return b''
+            if len(self.buf) < 3:
+                msg = '[ERROR] lzw::LZWDecompressor Truncated input (no header)'
+                raise RuntimeError(msg)
+            self.read_header()
+        data = self.decode(True)
+        self.eof = True
+        return data
+
+class LZWCompressor:
+
+    def __init__(self, maxbits=MAX_BITS):
+        if maxbits > MAX_BITS or maxbits < INIT_BITS:
+            msg = '[ERROR] lzw::LZWCompressor Invalid max code size {:}'.format(maxbits)
+            raise RuntimeError(msg)
+        self.maxbits = maxbits
+        self.maxmaxcode = 1 << maxbits
+        self.header = False
+        ## codes of the current group, packed in an int
+        self.group = 0
+        self.group_codes = 0
+        self.in_count = 0
+        self.out_count = 3
+        self.checkpoint = CHECK_GAP
+        self.ratio = 0
+        self.prefix = None
+        self.reset()
+
+    def reset(self):
+        ## (prefix code, byte) -> code
+        self.table = {}
+        self.free_ent = CLEAR + 1
+        self.n_bits = INIT_BITS
+        self.maxcode = (1 << self.n_bits) - 1
+
+    def flush_group(self, out, pad=True):
+        """ Write the current group; if pad is True, the group is padded to
+            n_bits bytes, else only the bytes needed for its codes are
+            written (end of data).
+        """
+        if self.group_codes > 0:
+            nbytes = self.n_bits if pad else (self.group_codes * self.n_bits + 7) // 8
+            out += self.group.to_bytes(nbytes, 'little')
+            self.out_count += nbytes
+        self.group = 0
+        self.group_codes = 0
+
+    def output(self, code, out):
+        self.group |= code << (self.group_codes * self.n_bits)
+        self.group_codes += 1
+        if self.group_codes == 8:
+            self.flush_group(out)
+        ## next entry needs a larger code
+        if self.free_ent > self.maxcode and self.n_bits < self.maxbits:
+            self.flush_group(out)
+            self.n_bits += 1
+            self.maxcode = (1 << self.n_bits) - 1 if self.n_bits < self.maxbits else self.maxmaxcode
+
+    def clear(self, out):
+        self.output(CLEAR, out)
+        self.flush_group(out)
+        self.reset()
+
+    def compress(self, data):
+        """ Feed (a chunk of) data; returns the compressed data produced so
+            far (possibly empty).
+        """
+        out = bytearray()
+        if not self.header:
+            out += MAGIC + bytes([self.maxbits | BLOCK_MODE])
+            self.header = True
+        table = self.table
+        prefix = self.prefix
+        for c in data:
+            self.in_count += 1
+            if prefix is None:
+                prefix = c
+                continue
+            key = (prefix << 8) | c
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                continue
+            self.output(prefix, out)
+            prefix = c
+            if self.free_ent < self.maxmaxcode:
+                table[key] = self.free_ent
+                self.free_ent += 1
+            elif self.in_count >= self.checkpoint:
+                ## table is full; start over if compression degrades
+                self.checkpoint = self.in_count + CHECK_GAP
+                ratio = self.in_count * 256 // max(self.out_count, 1)
+                if ratio > self.ratio:
+                    self.ratio = ratio
+                else:
+                    self.ratio = 0
+                    self.clear(out)
+                    table = self.table
+        self.prefix = prefix
+        return bytes(out)
+
+    def flush(self):
+        """ Signal the end of the data; returns the remaining compressed
+            data.
+        """
+        out = bytearray()
+        if not self.header:
+            out += MAGIC + bytes([self.maxbits | BLOCK_MODE])
+            self.header = True
+        if self.prefix is not None:
+            self.output(self.prefix, out)
+            self.prefix = None
+        self.flush_group(out, False)
+        return bytes(out)
+
+def decompress(data):
+    """ Decompress a (complete) .Z byte string.
+    """
+    dcmp = LZWDecompressor()
+    return dcmp.decompress(data) + dcmp.flush()
+
+def compress(data, maxbits=MAX_BITS):
+    """ Compress a byte string to the .Z format.
+    """
+    cmp = LZWCompressor(maxbits)
+    return cmp.compress(data) + cmp.flush()
+
+def decompress_file(source, target, blocksize=1024*1024):
+    """ Decompress the .Z file source to target; target is written to a
+        temporary file and renamed when complete. Returns target.
+    """
+    dcmp = LZWDecompressor()
+    tmp = target + '.part'
+    try:
+        with open(source, 'rb') as fin, open(tmp, 'wb') as fout:
+            while True:
+                block = fin.read(blocksize)
+                if not block:
+                    break
+                fout.write(dcmp.decompress(block))
+            fout.write(dcmp.flush())
+    except:
+        if os.path.isfile(tmp): os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+    return target
+
+def compress_file(source, target, blocksize=1024*1024):
+    """ Compress the file source to the .Z file target; target is written to
+        a temporary file and renamed when complete. Returns target.
+    """
+    cmp = LZWCompressor()
+    tmp = target + '.part'
+    try:
+        with open(source, 'rb') as fin, open(tmp, 'wb') as fout:
+            while True:
+                block = fin.read(blocksize)
+                if not block:
+                    break
+                fout.write(cmp.compress(block))
+            fout.write(cmp.flush())
+    except:
+        if os.path.isfile(tmp): os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+    return target
@@ -0,0 +1,180 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import contextlib
+
+##  A local store of (downloaded and decompressed) products, shared between
+##+ runs (e.g. the greece, hepos and croasp cron jobs processing the same day).
+##  Every product is keyed by (product type, date, solution type), e.g.
+##+ ('sp3', datetime(2021,11,27), 'final'), and stored as:
+##  ROOT/PTYPE/YYYYDDD/SOLTYPE/FILENAME
+##  An index file (ROOT/INDEX_FN) records the file, size and time added of
+##+ every entry; the last access time of an entry is the access time of its
+##+ (stored) file, set on every lookup, so that lookups never rewrite the
+##+ index. When the total size exceeds max_bytes, the least recently used
+##+ entries are removed. Products are delivered to their destination
+##+ (e.g. a campaign's ORB/ATM/GRD/RAW directory) as hardlinks, falling back
+##+ to copies when the destination is on another filesystem.
+##  The store can be used by several processes at the same time; the index
+##+ is guarded by a lock on ROOT/LOCK_FN (shared for lookups, exclusive for
+##+ updates).
+##  Note that delivered files are hardlinks of the stored ones; they should
+##+ not be edited in place (rename/replace them instead).
+
+INDEX_FN = 'index.json'
+LOCK_FN = '.lock'
+
+def deliver(source, target):
+    """ Make target a hardlink of source (any existing target is replaced).
+        If hardlinking fails (e.g. different filesystems), copy the file.
+    """
+    if os.path.isfile(target) or os.path.islink(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    return target
+
+def open_store(root, max_size_gb=None):
+    """ Return a ProductStore rooted at root, limited to max_size_gb GB (if
+        given); if root is None (or empty), return None (aka no store).
+    """
+    if root is None or root.strip() == '':
+        return None
+    max_bytes = int(float(max_size_gb) * 1024 * 1024 * 1024) if max_size_gb is not None else None
+    return ProductStore(root, max_bytes)
+
+class ProductStore:
+
+    def __init__(self, root, max_bytes=None):
+        """ root: the (top-level) directory of the store; created if needed
+            max_bytes: maximum total size of the store's files in bytes; None
+                means no limit
+        """
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(ptype, pydt, soltype):
+        return '{:}/{:}/{:}'.format(ptype.lower(), pydt.strftime('%Y%j'), soltype.lower())
+
+    @contextlib.contextmanager
+    def locked_index(self, write=True):
+        """ Acquire the store's lock and yield its index (dictionary); the
+            index is written back (atomically) at exit. If write is False, the
+            lock is shared and the index is only read (changes to it are
+            discarded).
+        """
+        with open(os.path.join(self.root, LOCK_FN), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                fn = os.path.join(self.root, INDEX_FN)
+                index = {}
+                if os.path.isfile(fn):
+                    try:
+                        with open(fn, 'r') as fin:
+                            index = json.load(fin)
+                    except:
+                        print('[WRNNG] Failed to read product store index {:}; starting a new one'.format(fn), file=sys.stderr)
+                yield index
+                if not write: return
+                tmp = fn + '.tmp'
+                with open(tmp, 'w') as fout:
+                    json.dump(index, fout, indent=1)
+                os.replace(tmp, fn)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def lookup(self, ptype, pydt, soltype, max_age=None):
+        """ Return the (full path of the) stored product for the given key, or
+            None if it is not in the store. If max_age (seconds) is given,
+            entries added more than max_age seconds ago are ignored (useful
+            for products that get updated, e.g. ultra-rapid orbits).
+        """
+        k = self.key(ptype, pydt, soltype)
+        with self.locked_index(write=False) as index:
+            if k not in index:
+                return None
+            fn = os.path.join(self.root, index[k]['file'])
+            if max_age is not None and time.time() - index[k]['added'] > max_age:
+                return None
+            ## record the access on the file (keep its mtime); a missing
+            ## file is dropped from the index by the next add
+            try:
+                os.utime(fn, (time.time(), os.stat(fn).st_mtime))
+            except OSError:
+                return None
+        return fn
+
+    def add(self, ptype, pydt, soltype, filename, move=False):
+        """ Add the (local) file filename to the store, under the given key;
+            if move is True the file is moved into the store, else it is
+            hardlinked (or copied). Any previous entry for the key is
+            replaced. Returns the full path of the stored file.
+        """
+        k = self.key(ptype, pydt, soltype)
+        pdir = os.path.join(self.root, k)
+        os.makedirs(pdir, exist_ok=True)
+        stored = os.path.join(pdir, os.path.basename(filename))
+        with self.locked_index() as index:
+            if k in index and os.path.join(self.root, index[k]['file']) != stored:
+                self.remove_file(index[k]['file'])
+            if move:
+                if os.path.isfile(stored): os.remove(stored)
+                shutil.move(filename, stored)
+            elif os.path.abspath(filename) != stored:
+                deliver(filename, stored)
+            now = time.time()
+            os.utime(stored, (now, os.stat(stored).st_mtime))
+            index[k] = {'file': os.path.relpath(stored, self.root),
+                'size': os.path.getsize(stored), 'added': now}
+            self.evict(index, k)
+        return stored
+
+    def remove_file(self, relpath):
+        try:
+            os.remove(os.path.join(self.root, relpath))
+        except OSError:
+            pass
+
+    def last_access(self, entry):
+        """ The last access time of an index entry (the access time of its
+            file), or None if the file is missing.
+        """
+        try:
+            return os.stat(os.path.join(self.root, entry['file'])).st_atime
+        except OSError:
+            return None
+
+    def evict(self, index, keep=None):
+        """ Remove entries whose file is missing, and least recently used
+            entries (never the one with key keep) from the store, untill its
+            total size is below max_bytes. Must be called with the index
+            (exclusively) locked.
+        """
+        atimes = {}
+        for k in list(index):
+            atimes[k] = self.last_access(index[k])
+            if atimes[k] is None and k != keep:
+                del index[k]
+        if self.max_bytes is None:
+            return
+        total = sum([entry['size'] for entry in index.values()])
+        for k in sorted(index, key=lambda k: atimes[k] or 0e0):
+            if total <= self.max_bytes:
+                break
+            if k == keep:
+                continue
+            self.remove_file(index[k]['file'])
+            total -= index[k]['size']
+            del index[k]
@@ -0,0 +1,187 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import zlib
+import subprocess
+from .lzw import LZWDecompressor
+from .hatanaka import CrinexDecoder
+
+##  Streaming decompression of (compressed) RINEX files, e.g. as they are
+##+ being downloaded. A RinexStreamDecoder is a sink for the raw bytes of a
+##+ '.Z' or '.gz' compressed (and maybe Hatanaka compressed) RINEX file; the
+##+ bytes are passed through the needed decoders (gzip/LZW and Hatanaka) as
+##+ they arrive, and the observation RINEX file is written in one pass:
+##  decoder = RinexStreamDecoder('/foo/dion0010.21d.Z')
+##  for block in blocks: decoder.write(block)
+##  obs = decoder.close() ## -> '/foo/dion0010.21o'
+##  * gzip is decoded in-process (zlib),
+##  * LZW (.Z) is decoded in-process (see lzw.py),
+##  * Hatanaka is decoded in-process (see hatanaka.py), or by a 'CRX2RNX -'
+##+   process if the directory of the CRX2RNX program is given.
+##  The observation file is written to a partial file and renamed when
+##+ complete, so that a failed decoding never leaves a truncated RINEX.
+
+def rinex_decompressed_name(fn):
+    """ Name of the (fully) decompressed RINEX file for a (compressed) RINEX
+        filename, e.g. 'dion0010.21d.Z' -> 'dion0010.21o' and
+        'DION00GRC_R_20210010000_01D_30S_MO.crx.gz' ->
+        'DION00GRC_R_20210010000_01D_30S_MO.rnx'.
+    """
+    for ext in ['.Z', '.gz']:
+        if fn.endswith(ext): fn = fn[0:-len(ext)]
+    if fn.endswith('d'):
+        return fn[0:-1]+'o'
+    elif fn.endswith('crx'):
+        return fn[0:-3]+'rnx'
+    return fn
+
+def is_hatanaka(fn):
+    for ext in ['.Z', '.gz']:
+        if fn.endswith(ext): fn = fn[0:-len(ext)]
+    return fn.endswith('d') or fn.endswith('crx')
+
+def rinex_stream_decoder(filename, crx2rnx_dir=None):
+    """ Return a RinexStreamDecoder for the (compressed) RINEX file filename,
+        or None if the file cannot be decoded as a stream (e.g. .zip files).
+    """
+    if not filename.endswith('.Z') and not filename.endswith('.gz'):
+        return None
+    return RinexStreamDecoder(filename, crx2rnx_dir)
+
+class RinexStreamDecoder:
+
+    def __init__(self, filename, crx2rnx_dir=None):
+        """ filename: the name of the compressed RINEX file (.Z or .gz, and/or
+                Hatanaka compressed); the decoded observation file is written
+                to rinex_decompressed_name(filename)
+            crx2rnx_dir: if given, Hatanaka compressed files are decoded using
+                the CRX2RNX program in this directory, instead of in-process
+        """
+        self.filename = filename
+        self.output = rinex_decompressed_name(filename)
+        self.partial = self.output + '.part'
+        self.lzw = filename.endswith('.Z')
+        self.gz = filename.endswith('.gz')
+        self.hatanaka = is_hatanaka(filename)
+        self.crx2rnx = None
+        if self.hatanaka and crx2rnx_dir is not None:
+            self.crx2rnx = os.path.join(crx2rnx_dir, 'CRX2RNX')
+        self.gunzip = None
+        self.unlzw = None
+        self.crinex = None
+        self.procs = []
+        self.fout = None
+        self.sink = None
+
+    def start(self):
+        """ Open the output (partial) file and start the decoding processes;
+            called on the first write.
+        """
+        self.fout = open(self.partial, 'wb')
+        stdout = self.fout
+        ## start from the end of the pipeline
+        if self.crx2rnx is not None:
+            self.procs.insert(0, subprocess.Popen([self.crx2rnx, '-'], stdin=subprocess.PIPE, stdout=stdout, stderr=sys.stderr))
+            stdout = self.procs[0].stdin
+        elif self.hatanaka:
+            self.crinex = CrinexDecoder()
+        if self.lzw:
+            self.unlzw = LZWDecompressor()
+        elif self.gz:
+            ## gzip (or zlib) with automatic header detection
+            self.gunzip = zlib.decompressobj(wbits=47)
+        self.sink = stdout
+        ## the pipeline now holds references to the pipe ends; close ours
+        ## (except the one we write to)
+        for proc in self.procs[1:]:
+            proc.stdin.close()
+
+    def write(self, block):
+        if self.sink is None:
+            self.start()
+        if self.gunzip is not None:
+            data = self.gunzip.decompress(block)
+            ## concatenated gzip members
+            while self.gunzip.eof and self.gunzip.unused_data:
+                unused = self.gunzip.unused_data
+                self.gunzip = zlib.decompressobj(wbits=47)
+                data += self.gunzip.decompress(unused)
+            block = data
+        elif self.unlzw is not None:
+            block = self.unlzw.decompress(block)
+        if self.crinex is not None:
+            block = self.crinex.decompress(block)
+        self.sink.write(block)
+
+    def close(self):
+        """ Flush all decoders and wait for the decoding processes to finish;
+            on success the decoded file is renamed to self.output, which is
+            returned. On failure, the partial file is removed and a
+            RuntimeError is raised.
+        """
+        if self.sink is None:
+            self.start()
+        try:
+            block = b''
+            if self.gunzip is not None:
+                block = self.gunzip.flush()
+                if not self.gunzip.eof:
+                    raise RuntimeError
+            if self.unlzw is not None:
+                block = self.unlzw.flush()
+            if self.crinex is not None:
+                block = self.crinex.decompress(block) + self.crinex.flush()
+            self.sink.write(block)
+            if self.sink is not self.fout:
+                self.sink.close()
+            for proc in self.procs:
+                if proc.wait() != 0:
+                    raise RuntimeError
+        except Exception as e:
+            self.abort()
+            msg = '[ERROR] rnxstream::RinexStreamDecoder Failed decoding RINEX file {:}'.format(self.filename)
+            if str(e): msg += ' ({:})'.format(e)
+            raise RuntimeError(msg)
+        self.fout.close()
+        os.replace(self.partial, self.output)
+        return self.output
+
+    def abort(self):
+        """ Stop decoding and remove any (partial) output.
+        """
+        for proc in self.procs:
+            try:
+                proc.kill()
+                proc.wait()
+            except:
+                pass
+        if self.fout is not None:
+            self.fout.close()
+        if os.path.isfile(self.partial):
+            os.remove(self.partial)
+        self.procs = []
+        self.sink = None
+        self.gunzip = None
+        self.unlzw = None
+        self.crinex = None
+
+def decode_file(decoder, filename, remove_compressed=True):
+    """ Feed the (local) compressed file filename to decoder; returns the
+        decoded filename (see RinexStreamDecoder.close).
+    """
+    try:
+        with open(filename, 'rb') as fin:
+            while True:
+                block = fin.read(1024 * 1024)
+                if not block:
+                    break
+                decoder.write(block)
+    except:
+        decoder.abort()
+        raise
+    output = decoder.close()
+    if remove_compressed: os.remove(filename)
+    return output
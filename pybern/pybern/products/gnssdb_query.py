@@ -5,13 +5,37 @@ from __future__ import print_function
 import os
 import datetime
 import sys
+import time
+import threading
 from pybern.products.fileutils.keyholders import extract_key_values
 from pybern.products.downloaders.retrieve import web_retrieve
+from pybern.products.gnssdb_sqlite import SqliteConnection
+import sqlite3
 import mysql.connector
+import mysql.connector.pooling
 from mysql.connector import errorcode
 
 g_verbose_rnxdwnl = False
 
+##  Connections to the database are pooled (one pool per host/database/user),
+##+ so that consecutive queries within a process (e.g. query_sta_in_net,
+##+ query_tsupd_net and the rnxdwnl queries of a rundd run) reuse the same
+##+ connection(s) instead of reconnecting.
+##  Query results are memoized (per database, query and arguments) for
+##+ QUERY_CACHE_TTL seconds; use execute_query(..., use_cache=False) or
+##+ clear_query_cache() to force a new query.
+
+## number of connections per pool
+DB_POOL_SIZE = 4
+## seconds a (memoized) query result is considered valid
+QUERY_CACHE_TTL = 300
+
+## (host, database, user, password) -> MySQLConnectionPool
+g_db_pools = {}
+## (host, database, user, query, args) -> (time of query, rows)
+g_query_cache = {}
+g_db_lock = threading.Lock()
+
 net_upd_ts_query=(
     """SELECT
         stacode.mark_name_DSO,
@@ -41,30 +65,92 @@ sta_in_net_query=(
 
 def parse_db_credentials_file(credentials_file):
     ## parse credentials to a dictionary (from file)
-    credentials_dct = {'GNSS_DB_USER':None, 'GNSS_DB_PASS':None, 'GNSS_DB_HOST':None, 'GNSS_DB_NAME':None}
+    credentials_dct = {'GNSS_DB_USER':None, 'GNSS_DB_PASS':None, 'GNSS_DB_HOST':None, 'GNSS_DB_NAME':None, 'GNSS_DB_BACKEND':'mysql', 'GNSS_DB_SQLITE':None}
     credentials_dct = extract_key_values(credentials_file, **credentials_dct)
     return credentials_dct
 
-def execute_query(credentials_dct, query_str, *args):
-    """ 
+def use_sqlite(credentials_dct):
+    """ True if the credentials (see parse_db_credentials_file) point to a
+        local SQLite snapshot (see gnssdb_sqlite) instead of a MySQL server.
     """
-    connection_error = 0 
-    ## Connect to the database
+    return 'GNSS_DB_BACKEND' in credentials_dct and credentials_dct['GNSS_DB_BACKEND'] is not None and credentials_dct['GNSS_DB_BACKEND'].strip().lower() == 'sqlite'
+
+def db_key(credentials_dct):
+    if use_sqlite(credentials_dct):
+        return ('sqlite', credentials_dct['GNSS_DB_SQLITE'], None, None)
+    return (credentials_dct['GNSS_DB_HOST'], credentials_dct['GNSS_DB_NAME'],
+        credentials_dct['GNSS_DB_USER'], credentials_dct['GNSS_DB_PASS'])
+
+def connect(credentials_dct):
+    """ Get a connection to the database described by credentials_dct (see
+        parse_db_credentials_file) from the connection pool; the pool is
+        created on first use. If all pooled connections are in use, a new
+        (non-pooled) connection is opened. Calling close() on the returned
+        connection, returns it to the pool.
+        If GNSS_DB_BACKEND is 'sqlite', a (read-only) connection to the
+        snapshot file GNSS_DB_SQLITE is returned instead (see gnssdb_sqlite).
+        Throws mysql.connector.Error (or sqlite3.Error) on failure.
+    """
+    if use_sqlite(credentials_dct):
+        if credentials_dct['GNSS_DB_SQLITE'] is None:
+            msg = '[ERROR] gnssdb_query::connect GNSS_DB_BACKEND is sqlite but GNSS_DB_SQLITE is not set'
+            raise RuntimeError(msg)
+        return SqliteConnection(credentials_dct['GNSS_DB_SQLITE'])
+    key = db_key(credentials_dct)
+    with g_db_lock:
+        if key not in g_db_pools:
+            g_db_pools[key] = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name='gnssdb{:}'.format(len(g_db_pools)),
+                pool_size=DB_POOL_SIZE,
+                host=credentials_dct['GNSS_DB_HOST'], 
+                database=credentials_dct['GNSS_DB_NAME'], 
+                user=credentials_dct['GNSS_DB_USER'], 
+                password=credentials_dct['GNSS_DB_PASS'],
+                connect_timeout=10)
+        pool = g_db_pools[key]
     try:
-        cnx = mysql.connector.connect(
+        return pool.get_connection()
+    except mysql.connector.errors.PoolError:
+        return mysql.connector.connect(
             host=credentials_dct['GNSS_DB_HOST'], 
             database=credentials_dct['GNSS_DB_NAME'], 
             user=credentials_dct['GNSS_DB_USER'], 
             password=credentials_dct['GNSS_DB_PASS'],
             connect_timeout=10)
-        ## get a cursor to perform queries ...
-        cursor = cnx.cursor(dictionary=True)
-        ## execute query ...
-        cursor.execute(query_str, (args))
-        ## get response
-        rows = cursor.fetchall()
-        ## close the cursor
-        cursor.close()
+
+def clear_query_cache():
+    with g_db_lock:
+        g_query_cache.clear()
+
+def execute_query(credentials_dct, query_str, *args, use_cache=True):
+    """ Execute the query query_str (with arguments args) and return the
+        resulting rows, as a list of dictionaries. If use_cache is True, a
+        result of the same query (and arguments) obtained within the last
+        QUERY_CACHE_TTL seconds is returned instead of querying the database.
+    """
+    key = db_key(credentials_dct)[0:3] + (query_str, args)
+    if use_cache:
+        with g_db_lock:
+            if key in g_query_cache and time.time() - g_query_cache[key][0] <= QUERY_CACHE_TTL:
+                ## return copies; callers may edit the rows
+                return [ dict(row) for row in g_query_cache[key][1] ]
+
+    connection_error = 0 
+    ## Connect to the database
+    try:
+        cnx = connect(credentials_dct)
+        try:
+            ## get a cursor to perform queries ...
+            cursor = cnx.cursor(dictionary=True)
+            ## execute query ...
+            cursor.execute(query_str, (args))
+            ## get response
+            rows = cursor.fetchall()
+            ## close the cursor
+            cursor.close()
+        finally:
+            ## return the connection to the pool
+            cnx.close()
     except mysql.connector.Error as err:
         print('[ERROR] Failed to connect to database!', file=sys.stderr)
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
@@ -76,12 +162,18 @@ def execute_query(credentials_dct, query_str, *args):
         else:
             print('[ERROR] ' + str(err), file=sys.stderr)
             connection_error = 12
+    except sqlite3.Error as err:
+        print('[ERROR] Failed to query database snapshot {:}'.format(credentials_dct['GNSS_DB_SQLITE']), file=sys.stderr)
+        print('[ERROR] ' + str(err), file=sys.stderr)
+        connection_error = 13
     
     if connection_error > 0:
         msg = '[ERROR] Failed to connect to to database at {:}@{:}; fatal!'.format(credentials_dct['GNSS_DB_NAME'], credentials_dct['GNSS_DB_HOST'])
         raise RuntimeError(msg)
 
-    return rows
+    with g_db_lock:
+        g_query_cache[key] = (time.time(), rows)
+    return [ dict(row) for row in rows ]
 
 def query_sta_in_net(network, credentials_dct):
     """ Returns a dictionary of type:
@@ -0,0 +1,108 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import datetime
+import decimal
+import sqlite3
+
+##  A local (SQLite) snapshot of the GNSS database tables holding network and
+##+ station metadata, to be used instead of the MySQL server (e.g. for
+##+ offline runs, testing, or just to reduce the load on the server). Set
+##+ GNSS_DB_BACKEND = sqlite and GNSS_DB_SQLITE = /path/to/snapshot.db in the
+##+ credentials/config file to use it (see gnssdb_query.connect).
+##  The snapshot holds a copy of the SNAPSHOT_TABLES tables (all columns);
+##+ datetime (and date) values are stored as 'YYYY-MM-DD HH:MM:SS' strings,
+##+ so that they compare the same way as in MySQL. Text columns are compared
+##+ case-insensitively (as with MySQL's default collation). Note that
+##+ datetime columns are returned as strings when querying the snapshot.
+
+SNAPSHOT_TABLES = ['station', 'stacode', 'dataperiod', 'ftprnx', 'sta2nets', 'network']
+
+def sqlite_value(value):
+    """ Translate a value (as returned by mysql.connector, or passed as a
+        query argument) to a value to be stored in/compared with the snapshot.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d 00:00:00')
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return value
+
+def export_snapshot(cnx, filename, tables=SNAPSHOT_TABLES):
+    """ Copy the given tables from the (MySQL) database connection cnx to the
+        SQLite file filename. The snapshot is written to a temporary file and
+        renamed when complete, so that readers never see a partial snapshot.
+        Returns a dictionary with the number of rows exported per table.
+    """
+    tmp = '{:}.{:}.tmp'.format(filename, os.getpid())
+    if os.path.isfile(tmp): os.remove(tmp)
+    exported = {}
+    scnx = sqlite3.connect(tmp)
+    try:
+        for table in tables:
+            cursor = cnx.cursor()
+            cursor.execute('SELECT * FROM {:}'.format(table))
+            columns = [ c[0] for c in cursor.description ]
+            rows = cursor.fetchall()
+            cursor.close()
+            scnx.execute('CREATE TABLE {:} ({:})'.format(table, ', '.join(['"{:}" COLLATE NOCASE'.format(c) for c in columns])))
+            scnx.executemany('INSERT INTO {:} VALUES ({:})'.format(table, ', '.join(['?'] * len(columns))),
+                [ tuple(sqlite_value(v) for v in row) for row in rows ])
+            exported[table] = len(rows)
+        scnx.commit()
+    except:
+        scnx.close()
+        os.remove(tmp)
+        raise
+    scnx.close()
+    os.replace(tmp, filename)
+    return exported
+
+class SqliteCursor:
+    """ A (minimal) stand-in for a mysql.connector cursor, on a snapshot;
+        queries use the MySQL '%s' placeholders.
+    """
+
+    def __init__(self, cursor, dictionary=False):
+        self.cursor = cursor
+        self.dictionary = dictionary
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query_str, args=()):
+        self.cursor.execute(query_str.replace('%s', '?'), tuple(sqlite_value(v) for v in args))
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        if not self.dictionary:
+            return rows
+        columns = [ c[0] for c in self.cursor.description ]
+        return [ dict(zip(columns, row)) for row in rows ]
+
+    def close(self):
+        self.cursor.close()
+
+class SqliteConnection:
+    """ A (minimal) stand-in for a mysql.connector connection, on a snapshot.
+    """
+
+    def __init__(self, filename):
+        if not os.path.isfile(filename):
+            msg = '[ERROR] gnssdb_sqlite::SqliteConnection Snapshot file does not exist {:}'.format(filename)
+            raise RuntimeError(msg)
+        self.cnx = sqlite3.connect('file:{:}?mode=ro'.format(filename), uri=True, check_same_thread=False)
+
+    def cursor(self, dictionary=False):
+        return SqliteCursor(self.cnx.cursor(), dictionary)
+
+    def close(self):
+        self.cnx.close()
@@ -6,14 +6,32 @@ import os
 import datetime
 import sys
 import re
+import threading
+import contextlib
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from pybern.products.fileutils.keyholders import extract_key_values
 from pybern.products.downloaders.retrieve import web_retrieve
+from pybern.products.downloaders.dcscheduler import AsyncDcScheduler, shared_scheduler, interleave_by_dc
+from pybern.products.downloaders.aretrieve import AsyncRetriever
+from pybern.products.downloaders.transfers import transfer_label
+from pybern.products.fileutils.prodstore import open_store, deliver
+from pybern.products.fileutils.rnxstream import rinex_stream_decoder, rinex_decompressed_name
+from pybern.products.gnssdb_query import connect as gnssdb_connect
+from pybern.products.utils.timing import span
 import mysql.connector
 from mysql.connector import errorcode
+import sqlite3
 import locale ## for local datetimes (TREECOMP)
 
 g_verbose_rnxdwnl = False
 
+## setlocale is process-wide; serialize b2gr3 calls when downloading with
+## multiple threads
+g_locale_lock = threading.Lock()
+
 network_query=(
     """SELECT station.station_id, 
         station.mark_name_DSO, 
@@ -81,45 +99,119 @@ def b2gr3(dt):
         Needs locale package and el_GR available
         sudo apt install locales-all
     """
-    locale.setlocale(locale.LC_ALL, "el_GR")
-    mgr = dt.strftime("%b")
-    locale.setlocale(locale.LC_ALL,locale.getdefaultlocale())
+    with g_locale_lock:
+        locale.setlocale(locale.LC_ALL, "el_GR")
+        mgr = dt.strftime("%b")
+        locale.setlocale(locale.LC_ALL,locale.getdefaultlocale())
     return mgr
 
-def rinex_exists_as(possible_rinex, output_dir=os.getcwd()):
+def rinex_local_variants(prnx):
+    """ Given a (compressed) RINEX filename, return the list of filenames it
+        can be found as locally, in order of preference:
+        * same as input,
+        * decompressed (.Z, .gz)
+        * Hatanaka-decompressed (d, .crx)
+    """
+    variants = [prnx]
+    for ext in ['.Z', '.gz']:
+        if prnx.endswith(ext):
+            hrnx = prnx[0:-len(ext)]
+            variants.append(hrnx)
+            if hrnx.endswith('d'):
+                variants.append(hrnx[0:-1]+'o')
+            elif hrnx.endswith('crx'):
+                variants.append(hrnx[0:-3]+'rnx')
+    return variants
+
+def rinex_base_name(fn):
+    """ Normalize a RINEX filename to a compression/Hatanaka agnostic name,
+        e.g. 'dion0010.21d.Z', 'dion0010.21d' and 'dion0010.21o' are all
+        normalized to 'dion0010.21o'.
+    """
+    return rinex_decompressed_name(fn)
+
+class RinexDirIndex:
+    """ An index of the files in a (local) directory, e.g. the DATAPOOL area,
+        built with a single directory scan; files are indexed by their
+        compression/Hatanaka agnostic name (see rinex_base_name), so that
+        checking if a RINEX file exists in any form, is a dictionary lookup.
+        The index can be shared by all stations of a run (and threads).
+        For one-off lookups, names (a list of RINEX filenames) can be given;
+        then only the local variants of these names are indexed, each checked
+        with os.path.isfile, instead of scanning the whole directory.
+    """
+
+    def __init__(self, directory=os.getcwd(), names=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        ## base name -> {filename: size or None (not yet known)}
+        self.index = {}
+        if names is not None:
+            for prnx in names:
+                for fn in rinex_local_variants(prnx):
+                    if os.path.isfile(os.path.join(directory, fn)):
+                        self.index.setdefault(rinex_base_name(fn), {})[fn] = None
+            return
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file():
+                    self.index.setdefault(rinex_base_name(entry.name), {})[entry.name] = None
+
+    def find(self, prnx):
+        """ Return the (full path of the) local file prnx can be found as
+            (see rinex_local_variants), or None.
+        """
+        with self.lock:
+            base = rinex_base_name(prnx)
+            if base not in self.index:
+                return None
+            for fn in rinex_local_variants(prnx):
+                if fn in self.index[base]:
+                    return os.path.join(self.directory, fn)
+        return None
+
+    def size(self, fn):
+        """ Size (bytes) of an indexed file (fn is the full path, as returned
+            by find); the file is stat'ed only on the first call.
+        """
+        name = os.path.basename(fn)
+        base = rinex_base_name(name)
+        with self.lock:
+            if self.index[base][name] is None:
+                self.index[base][name] = os.path.getsize(fn)
+            return self.index[base][name]
+
+    def remove(self, fn):
+        """ Remove the file fn (full path, as returned by find) from disk and
+            from the index.
+        """
+        os.remove(fn)
+        name = os.path.basename(fn)
+        with self.lock:
+            del self.index[rinex_base_name(name)][name]
+
+def possible_rinex_names(possible_rinex):
+    """ The local filenames of possible_rinex (as returned by
+        query_dict_to_rinex_list).
+    """
+    return [ rltpl[1] for prl in possible_rinex.values() for rltpl in prl ]
+
+def rinex_exists_as(possible_rinex, output_dir=os.getcwd(), index=None):
     """ Given a list of (possible rinex) files, this function will search for
         a matching file, where matching is one of the following:
         * same as input,
         * decompressed (.Z, .gz)
         * Hatanaka-decompressed (d, .crx)
+        The search is performed on an index (a RinexDirIndex instance) of
+        output_dir; if not given, only the possible files are looked up.
     """
-    # for prnx in possible_rinex:
+    if index is None: index = RinexDirIndex(output_dir, possible_rinex_names(possible_rinex))
     for site, prl in possible_rinex.items():
         for rltpl in prl:
-            prnx = rltpl[1] ## should-exist local RINEX filename
-            fn = os.path.join(output_dir, prnx)
-            
-            ## check for the fully compressed file
-            if os.path.isfile(fn):
+            ## should-exist local RINEX filename
+            fn = index.find(rltpl[1])
+            if fn is not None:
                 return fn
-            
-            ## check for the decompressed Hatanaka version, aka no .Z or .gz
-            for ext in ['.Z', '.gz']:
-                if prnx.endswith(ext):
-                    rnx = re.sub(r'{:}$'.format(ext), '', prnx)
-                    fn = os.path.join(output_dir, rnx)
-                    if os.path.isfile(fn): return fn
-            
-            ## check for the fully-decompressed RINEX
-            for ext in ['.Z', '.gz']:
-                if prnx.endswith(ext):
-                    hrnx = re.sub(r'{:}$'.format(ext), '', prnx)
-                    if hrnx.endswith('d'):
-                        fn = os.path.join(output_dir, hrnx[-1]+'o')
-                        if os.path.isfile(fn): return fn
-                    elif hrnx.endswith('crx'):
-                        fn = os.path.join(output_dir, hrnx[-3]+'rnx')
-                        if os.path.isfile(fn): return fn
     return None
 
 
@@ -262,23 +354,14 @@ def compare_query_result_dictionaries(dict_list):
                     
     return difs, missing
 
-def download_station_rinex(query_dict, pt, holdings, output_dir=os.getcwd()):
-    """ given a station query result as dictionary (query_dict), parse and
-        formulate the correct fields to enable RINEX download. The function
-        will formulate:
-        1. the remote url (path)
-        2. a list of candidate RINEX (2 or 3) files
-        Then it will iteratively try to download the remote RINEX files, trying
-        all RINEX files in the possible_rinex list
-        If a RINEX file is successefully downloaded, the holdings dictionary 
-        will be update with an entry of type:
-        holdings = { ...., mark_name_DSO: {'local': saved_RINEX_filename, 
-                                           'remote': remote_RINEX_downloaded}
-                                       ...}
+def station_rinex_candidates(query_dict, pt):
+    """ Given a station query result as dictionary (query_dict) and a python
+        datetime instance (pt), formulate:
+        1. the remote url (path), and
+        2. a list of candidate RINEX (2 or 3) files (see
+           query_dict_to_rinex_list)
+        and return them.
     """
-    verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
-    verboseprint("[DEBUG] Here is the row dictionary fed to download: {}".format(query_dict))
-
     ## grab the first row/dictionary and formulate the url
     remote_path = query_dict['pth2rnx30s']
     for tf in zip(['%Y', '%j', '%m', '%d', '%y', '%d'],['_YYYY_', '_DDD_', '_MM_', '_DD_', '_YY_', '_DOM_']):
@@ -291,7 +374,8 @@ def download_station_rinex(query_dict, pt, holdings, output_dir=os.getcwd()):
         remote_path = remote_path.replace('_FULL_STA_NAME_', query_dict['station_name'])
     
     ## TREECOMP data also include a local month name
-    remote_path = remote_path.replace('_GRM3_', b2gr3(pt))
+    if '_GRM3_' in remote_path:
+        remote_path = remote_path.replace('_GRM3_', b2gr3(pt))
     
     ## here is the final URL
     remote_dir = query_dict['protocol'] + '://' + query_dict['url_domain'] + remote_path
@@ -299,20 +383,79 @@ def download_station_rinex(query_dict, pt, holdings, output_dir=os.getcwd()):
     ## make a list of candidate RINEX filenames to (try to) download
     possible_rinex = query_dict_to_rinex_list(query_dict, pt)
 
+    return remote_dir, possible_rinex
+
+def station_rinex_local(query_dict, pt, possible_rinex, holdings, output_dir, store=None, index=None):
+    """ Check if any of the possible RINEX files (of a station) already exists
+        in output_dir (compressed or not), or is held in the product store (in
+        which case it is linked to output_dir). If so, update holdings and
+        return True, else return False (aka the file needs to be downloaded).
+        If given, index is a RinexDirIndex of output_dir; else, only the
+        possible files are looked up.
+    """
+    verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
+
     ## check if any of the possible RINEX files already exist in the specified
     ## location (compressed or not).
-    old_rnx = rinex_exists_as(possible_rinex, output_dir)
+    if index is None: index = RinexDirIndex(output_dir, possible_rinex_names(possible_rinex))
+    old_rnx = rinex_exists_as(possible_rinex, output_dir, index)
     if old_rnx is not None:
         ## well ok, but let's check the file size first before skipping download
-        fsz = os.path.getsize(old_rnx) // 1024 ##Kb
+        fsz = index.size(old_rnx) // 1024 ##Kb
         if fsz < 10:
             print('[DEBUG] A version of RINEX ({:}) already exists localy but is too small ({:}Kb)'.format(old_rnx, fsz))
-            os.remove(old_rnx)
+            index.remove(old_rnx)
         else:
             verboseprint('[DEBUG] Skipping download for {:}; RINEX already exists as {:}'.format(query_dict['mark_name_DSO'], old_rnx))
             print('[DEBUG] Skipping download for {:}; RINEX already exists as {:}'.format(query_dict['mark_name_DSO'], old_rnx))
             holdings[query_dict['mark_name_DSO']]={'local': old_rnx, 'remote': None}
-            return
+            return True
+
+    ## check if the RINEX file is held in the product store
+    stored = store.lookup('rinex', pt, query_dict['mark_name_DSO']) if store is not None else None
+    if stored is not None:
+        local = deliver(stored, os.path.join(output_dir, os.path.basename(stored)))
+        verboseprint('[DEBUG] Skipping download for {:}; RINEX linked from store {:}'.format(query_dict['mark_name_DSO'], stored))
+        holdings[query_dict['mark_name_DSO']]={'local': local, 'remote': None}
+        return True
+    return False
+
+def download_station_rinex(query_dict, pt, holdings, output_dir=os.getcwd(), scheduler=None, store=None, negative_cache_ttl=None, index=None, stream_decoder=None):
+    """ given a station query result as dictionary (query_dict), parse and
+        formulate the correct fields to enable RINEX download. The function
+        will formulate:
+        1. the remote url (path)
+        2. a list of candidate RINEX (2 or 3) files
+        Then it will iteratively try to download the remote RINEX files, trying
+        all RINEX files in the possible_rinex list
+        If a RINEX file is successefully downloaded, the holdings dictionary 
+        will be update with an entry of type:
+        holdings = { ...., mark_name_DSO: {'local': saved_RINEX_filename, 
+                                           'remote': remote_RINEX_downloaded}
+                                       ...}
+        If a scheduler (aka a DcScheduler instance) is given, every transfer
+        is performed within a connection slot of the station's data center
+        (query_dict['dc_name']), so that the data center's limits are met.
+        Candidate RINEX files are checked against the (cached) listing of the
+        remote directory (see downloaders.listcache) before any transfer.
+        If a store (aka a ProductStore instance) is given, a RINEX file held
+        in the store for the station/date is linked to output_dir instead of
+        being downloaded; downloaded files are added to the store.
+        If negative_cache_ttl (seconds) is given, remote files that failed to
+        download recently are not tried again (see downloaders.negcache), so
+        that stations known to be offline are skipped right away.
+        If an index (aka a RinexDirIndex instance of output_dir) is given, it
+        is used to check for local RINEX files (else output_dir is scanned).
+        If a stream_decoder is given (see fileutils.rnxstream), the RINEX
+        file is decompressed (gzip/LZW and Hatanaka) while being downloaded,
+        and the holdings 'local' entry is the observation RINEX file.
+    """
+    verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
+    verboseprint("[DEBUG] Here is the row dictionary fed to download: {}".format(query_dict))
+
+    remote_dir, possible_rinex = station_rinex_candidates(query_dict, pt)
+    if station_rinex_local(query_dict, pt, possible_rinex, holdings, output_dir, store, index):
+        return
 
     ## iteratively try downloading RINEX files from possible_rinex; stop when
     ## we succed
@@ -324,15 +467,148 @@ def download_station_rinex(query_dict, pt, holdings, output_dir=os.getcwd()):
             verboseprint("[DEBUG] This is the remote file we should download: {:} (local: {:})".format(remote_fn, lfn))
             use_active_ftp = True if query_dict['dc_name'] == 'TREECOMP2' else False
             try:
-                status, target, saveas = web_retrieve(remote_fn, save_dir=output_dir, save_as=lfn, username=query_dict['ftp_usname'], password=query_dict['ftp_passwd'], active=use_active_ftp)
+                with scheduler.slot(query_dict['dc_name']) if scheduler is not None else contextlib.nullcontext(), transfer_label(query_dict['dc_name']):
+                    status, target, saveas = web_retrieve(remote_fn, save_dir=output_dir, save_as=lfn, username=query_dict['ftp_usname'], password=query_dict['ftp_passwd'], active=use_active_ftp, check_listing=True, negative_cache_ttl=negative_cache_ttl, stream_decoder=stream_decoder)
                 verboseprint('[DEBUG] Downloaded remote file {:} to {:}'.format(target, saveas))
                 if status == 0 and os.path.isfile(saveas):
                     holdings[query_dict['mark_name_DSO']]={'local': saveas, 'remote': target}
+                    if store is not None: store.add('rinex', pt, query_dict['mark_name_DSO'], saveas)
                     return
             except:
                 print('[WRNNG] Failed retrieving remote file {:}'.format(remote_fn))
 
-def query_station(cursor, station, pt, holdings, output_dir=os.getcwd()):
+def download_rows_rinex(rows, pt, holdings, output_dir=os.getcwd(), max_workers=1, scheduler=None, store=None, negative_cache_ttl=None, index=None, stream_decoder=None):
+    """ Download the RINEX files for a list of station query rows (rows), as
+        returned by a station_query or network_query query, for a python
+        datetime instance (pt). Each row is handled by download_station_rinex.
+        If max_workers > 1, the rows are handled concurrently, using a thread
+        pool of (at most) max_workers threads; else they are handled one after
+        the other.
+        Rows refering to the same station (aka same mark_name_DSO) are only
+        handled once (the first one is used), so that no two threads write to
+        the same local file.
+        The scheduler, store, negative_cache_ttl and stream_decoder (if any)
+        are passed on to download_station_rinex, along with an index of output_dir (a
+        RinexDirIndex instance, shared by all rows; built here if not
+        given); rows are ordered round-robin over data
+        centers, so that workers are not all kept waiting by a data center
+        allowing few connections.
+        Holdings is a dictionary that holds station RINEX download results; it
+        is updated in the same way as in download_station_rinex.
+    """
+    unique_rows = []
+    stations = set()
+    for row in rows:
+        if row['mark_name_DSO'] not in stations:
+            stations.add(row['mark_name_DSO'])
+            unique_rows.append(row)
+
+    ## one scan of the output directory, shared by all stations
+    if index is None: index = RinexDirIndex(output_dir)
+
+    if max_workers is None or max_workers <= 1 or len(unique_rows) <= 1:
+        for row in unique_rows:
+            download_station_rinex(row, pt, holdings, output_dir, scheduler, store, negative_cache_ttl, index, stream_decoder)
+        return holdings
+
+    unique_rows = interleave_by_dc(unique_rows)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_rows))) as executor:
+        futures = [ executor.submit(contextvars.copy_context().run, download_station_rinex, row, pt, holdings, output_dir, scheduler, store, negative_cache_ttl, index, stream_decoder) for row in unique_rows ]
+        ## re-raise any exception thrown within a worker thread
+        for future in futures:
+            future.result()
+    return holdings
+
+async def async_download_station_rinex(retriever, query_dict, pt, holdings, output_dir=os.getcwd(), scheduler=None, store=None, negative_cache_ttl=None, index=None, stream_decoder=None):
+    """ The asyncio counterpart of download_station_rinex; retriever is an
+        (open) AsyncRetriever instance and scheduler (if any) an
+        AsyncDcScheduler instance.
+    """
+    verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
+    verboseprint("[DEBUG] Here is the row dictionary fed to download: {}".format(query_dict))
+
+    remote_dir, possible_rinex = station_rinex_candidates(query_dict, pt)
+    if station_rinex_local(query_dict, pt, possible_rinex, holdings, output_dir, store, index):
+        return
+
+    for site, prl in possible_rinex.items():
+        for tpl in prl:
+            rfn = tpl[0]
+            lfn = tpl[1]
+            remote_fn = remote_dir + rfn
+            verboseprint("[DEBUG] This is the remote file we should download: {:} (local: {:})".format(remote_fn, lfn))
+            use_active_ftp = True if query_dict['dc_name'] == 'TREECOMP2' else False
+            try:
+                async with scheduler.slot(query_dict['dc_name']) if scheduler is not None else contextlib.nullcontext():
+                    with transfer_label(query_dict['dc_name']):
+                        status, target, saveas = await retriever.web_retrieve(remote_fn, save_dir=output_dir, save_as=lfn, username=query_dict['ftp_usname'], password=query_dict['ftp_passwd'], active=use_active_ftp, check_listing=True, negative_cache_ttl=negative_cache_ttl, stream_decoder=stream_decoder)
+                verboseprint('[DEBUG] Downloaded remote file {:} to {:}'.format(target, saveas))
+                if status == 0 and os.path.isfile(saveas):
+                    holdings[query_dict['mark_name_DSO']]={'local': saveas, 'remote': target}
+                    if store is not None: store.add('rinex', pt, query_dict['mark_name_DSO'], saveas)
+                    return
+            except:
+                print('[WRNNG] Failed retrieving remote file {:}'.format(remote_fn))
+
+def download_rows_rinex_async(rows, pt, holdings, output_dir=os.getcwd(), max_per_host=8, scheduler=None, store=None, negative_cache_ttl=None, stream_decoder=None):
+    """ Same as download_rows_rinex, but all rows are handled concurrently
+        from a single thread, using asyncio (see downloaders.aretrieve);
+        max_per_host is the maximum number of concurrent connections to any
+        one host. The scheduler (if any) must be an AsyncDcScheduler
+        instance.
+    """
+    unique_rows = []
+    stations = set()
+    for row in rows:
+        if row['mark_name_DSO'] not in stations:
+            stations.add(row['mark_name_DSO'])
+            unique_rows.append(row)
+
+    index = RinexDirIndex(output_dir)
+
+    async def run():
+        async with AsyncRetriever(max_per_host) as retriever:
+            await asyncio.gather(*[ async_download_station_rinex(retriever, row, pt, holdings, output_dir, scheduler, store, negative_cache_ttl, index, stream_decoder) for row in interleave_by_dc(unique_rows) ])
+
+    asyncio.run(run())
+    return holdings
+
+def check_station_rows(rows):
+    """ Given the rows returned by a station query for a single station, check
+        that they only differ in the 'network_name' column (aka a station can
+        belong to several networks). Returns 0 if the rows are consistent, 2
+        if they differ in any other column and 3 if columns are missing from
+        some rows.
+    """
+    difs, missing = compare_query_result_dictionaries(rows)
+    if difs != [] and difs != ['network_name']:
+        print('[ERROR] Query results are different between queries! Can\'t handle that! (maybe an erronuous data enrty?)', file=sys.stderr)
+        return 2
+    if missing != []:
+        print('[ERROR] Query results are different between queries! Can\'t handle that! (maybe an erronuous data enrty?)', file=sys.stderr)
+        return 3
+    return 0
+
+def unique_stations(stations):
+    """ Remove duplicates (case-insensitive) from a list of station names,
+        keeping the order given.
+    """
+    unique = []
+    for station in stations:
+        if station.upper() not in [ sta.upper() for sta in unique ]:
+            unique.append(station)
+    return unique
+
+def station_list_query(num_stations):
+    """ Formulate a query (same columns as station_query) for a list of
+        num_stations stations, aka with a 'WHERE station.mark_name_DSO IN
+        (%s, %s, ...)' clause. Arguments to the query should be the station
+        names, followed by the (python datetime) date twice.
+    """
+    return station_query.replace('WHERE station.mark_name_DSO=%s',
+        'WHERE station.mark_name_DSO IN ({:})'.format(', '.join(['%s'] * num_stations)))
+
+def query_station(cursor, station, pt, holdings, output_dir=os.getcwd(), download_queue=None):
     """ Given a cursor to the GNSS database, perform a station query as
         defined in station_query, for a given station 4-char id (station) and
         a python datetime instance (pt).
@@ -346,6 +622,9 @@ def query_station(cursor, station, pt, holdings, output_dir=os.getcwd()):
         Holdings is a dictionary that holds station RINEX download results. It
         will be passed to download_station_rinex and if we succed in RINEX
         download a new entry will be apended for the given station.
+        If download_queue is a list, the (validated) station row is appended
+        to it instead of being downloaded right away; the caller is then
+        responsible for the download (see download_rows_rinex).
     """
     verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
     
@@ -361,18 +640,63 @@ def query_station(cursor, station, pt, holdings, output_dir=os.getcwd()):
     
     ## compare rows (if multiple); the only acceptable result is that two
     ## different rows differ in the network_name key/column
-    difs, missing = compare_query_result_dictionaries(rows)
-    if difs != [] and difs != ['network_name']:
-        print('[ERROR] Query results are different between queries! Can\'t handle that! (maybe an erronuous data enrty?)', file=sys.sdterr)
-        return 2
-    if missing != []:
-        print('[ERROR] Query results are different between queries! Can\'t handle that! (maybe an erronuous data enrty?)', file=sys.stderr)
-        return 3
+    status = check_station_rows(rows)
+    if status > 0:
+        return status
 
     ## procced to station RINEX download ...
+    if download_queue is not None:
+        download_queue.append(rows[0])
+        return 0
     return download_station_rinex(rows[0], pt, holdings, output_dir)
 
-def query_network(cursor, network, pt, holdings, output_dir=os.getcwd()):
+def query_stations(cursor, stations, pt, holdings, output_dir=os.getcwd(), download_queue=None):
+    """ Same as query_station, but for a list of station 4-char ids
+        (stations); all stations are queried at once (one database round
+        trip), using station_list_query. The resulting rows are grouped per
+        station (mark_name_DSO, case-insensitive) and each group is checked
+        with check_station_rows; stations with inconsistent rows are skipped.
+        Returns a dictionary with the status of every station, as returned by
+        query_station (-1 means that no rows were found for the station).
+    """
+    verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
+
+    stations = unique_stations(stations)
+    if stations == []: return {}
+
+    ## execute the query ...
+    cursor.execute(station_list_query(len(stations)), tuple(stations) + (pt, pt))
+    rows = cursor.fetchall()
+    verboseprint('[DEBUG] Processing rows for {:} stations rowcount={:}'.format(len(stations), len(rows)))
+
+    ## group rows per station
+    station_rows = {}
+    for row in rows:
+        key = row['mark_name_DSO'].upper()
+        if key not in station_rows: station_rows[key] = []
+        station_rows[key].append(row)
+
+    ## one index of output_dir for all stations downloaded here
+    index = RinexDirIndex(output_dir) if download_queue is None else None
+
+    status = {}
+    for station in stations:
+        if station.upper() not in station_rows:
+            verboseprint('[WRNNG] Empty set returned for station {:} and date {:}.'.format(station, pt.strftime('%Y-%m-%d')))
+            status[station] = -1
+            continue
+        rows = station_rows[station.upper()]
+        status[station] = check_station_rows(rows)
+        if status[station] > 0:
+            continue
+        ## procced to station RINEX download ...
+        if download_queue is not None:
+            download_queue.append(rows[0])
+        else:
+            download_station_rinex(rows[0], pt, holdings, output_dir, index=index)
+    return status
+
+def query_network(cursor, network, pt, holdings, output_dir=os.getcwd(), download_queue=None):
     """ Given a cursor to the GNSS database, perform a network query as
         defined in network_query, for a given network name (network) and a
         a python datetime instance (pt).
@@ -382,6 +706,9 @@ def query_network(cursor, network, pt, holdings, output_dir=os.getcwd()):
         Holdings is a dictionary that holds station RINEX download results. It
         will be passed to download_station_rinex and if we succed in RINEX
         download a new entry will be apended for the given station.
+        If download_queue is a list, the station rows are appended to it
+        instead of being downloaded right away; the caller is then
+        responsible for the download (see download_rows_rinex).
     """
     verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
 
@@ -399,8 +726,162 @@ def query_network(cursor, network, pt, holdings, output_dir=os.getcwd()):
         return -1
 
     ## every row in the response string, is a station row; handle the station
+    if download_queue is not None:
+        download_queue.extend(rows)
+        return 0
+    index = RinexDirIndex(output_dir)
     for row in rows:
-        download_station_rinex(row, pt, holdings, output_dir)
+        download_station_rinex(row, pt, holdings, output_dir, index=index)
+
+def range_query(query):
+    """ Given a (network or station) query, also select the validity period
+        (periodstart/periodstop) of each row; with arguments (..., stop,
+        start), the query returns all rows with a validity period overlapping
+        the date range [start, stop].
+    """
+    return query.replace('dataperiod.rnx_v', 'dataperiod.rnx_v,\n        dataperiod.periodstart,\n        dataperiod.periodstop', 1)
+
+def row_covers_date(row, pt):
+    """ Check if a row returned by a range_query is valid for the (python
+        datetime) date pt; periods can be datetime, date or (for database
+        snapshots) 'YYYY-MM-DD HH:MM:SS' string values.
+    """
+    start, stop = row['periodstart'], row['periodstop']
+    if isinstance(start, str):
+        t = pt.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(start, datetime.datetime):
+        t = pt
+    else:
+        t = pt.date()
+    return start <= t and stop >= t
+
+def query_range_rows(cursor, stations, network, dates):
+    """ Query the database once for a list of stations (4-char ids) and a
+        network (or None), for a list of (python datetime) dates; returns a
+        dictionary with the station rows to download per date:
+        {date: [row, row, ...], ...}
+        Rows are split per date using their validity period; for each date,
+        the rows of every station in stations are checked with
+        check_station_rows (stations with inconsistent rows are skipped for
+        that date).
+    """
+    verboseprint = print if g_verbose_rnxdwnl else lambda *a, **k: None
+    start, stop = min(dates), max(dates)
+    stations = unique_stations(stations)
+    strip_period = lambda row: { k: v for k, v in row.items() if k not in ['periodstart', 'periodstop'] }
+
+    station_rows = []
+    if stations != []:
+        cursor.execute(range_query(station_list_query(len(stations))), tuple(stations) + (stop, start))
+        station_rows = cursor.fetchall()
+    network_rows = []
+    if network:
+        cursor.execute(range_query(network_query), (network, stop, start))
+        network_rows = cursor.fetchall()
+    verboseprint('[DEBUG] Range query returned {:} station and {:} network rows'.format(len(station_rows), len(network_rows)))
+
+    day_rows = {}
+    for pt in dates:
+        day_rows[pt] = []
+        ## group (this day's) station rows per station and check them
+        grouped = {}
+        for row in [ strip_period(r) for r in station_rows if row_covers_date(r, pt) ]:
+            key = row['mark_name_DSO'].upper()
+            if key not in grouped: grouped[key] = []
+            grouped[key].append(row)
+        for station in stations:
+            if station.upper() not in grouped:
+                verboseprint('[WRNNG] Empty set returned for station {:} and date {:}.'.format(station, pt.strftime('%Y-%m-%d')))
+            elif check_station_rows(grouped[station.upper()]) == 0:
+                day_rows[pt].append(grouped.pop(station.upper())[0])
+        day_rows[pt] += [ strip_period(r) for r in network_rows if row_covers_date(r, pt) ]
+    return day_rows
+
+def download_options(**kwargs):
+    """ Resolve the RINEX download options (see main) from kwargs; returns
+        a tuple (max_workers, use_asyncio, scheduler, store,
+        negative_cache_ttl, stream_decoder).
+    """
+    ## number of concurrent downloads (1 means download one station at a time)
+    max_workers = int(kwargs['max_workers']) if 'max_workers' in kwargs and kwargs['max_workers'] is not None else 1
+
+    ## per data center connection/rate limits; use the defaults in
+    ## dcscheduler.DC_LIMITS, updated by the dc_limits_file (if any). The
+    ## scheduler is process-wide (per limits table), so the limits hold
+    ## across calls/runs
+    dc_limits_file = kwargs['dc_limits_file'] if 'dc_limits_file' in kwargs else None
+    scheduler = shared_scheduler(dc_limits_file)
+    ## use the asyncio downloader (one thread, many connections)
+    use_asyncio = kwargs['use_asyncio'] if 'use_asyncio' in kwargs else False
+    if use_asyncio: scheduler = AsyncDcScheduler(scheduler)
+
+    ## product store shared between runs (if any)
+    store = open_store(kwargs['product_store_dir'] if 'product_store_dir' in kwargs else None,
+        kwargs['product_store_max_size'] if 'product_store_max_size' in kwargs else None)
+
+    ## seconds to wait before retrying RINEX files that failed to download
+    ## (None or 0 means always retry)
+    negative_cache_ttl = float(kwargs['negative_cache_ttl']) if 'negative_cache_ttl' in kwargs and kwargs['negative_cache_ttl'] is not None else None
+
+    ## decompress RINEX files while downloading; Hatanaka files are decoded
+    ## in-process, or using the CRX2RNX program in crx2rnx_dir (if given)
+    stream_decoder = None
+    if 'stream_decompress' in kwargs and kwargs['stream_decompress']:
+        stream_decoder = functools.partial(rinex_stream_decoder, crx2rnx_dir=kwargs['crx2rnx_dir'] if 'crx2rnx_dir' in kwargs else None)
+
+    return max_workers, use_asyncio, scheduler, store, negative_cache_ttl, stream_decoder
+
+def db_credentials(**kwargs):
+    """ Resolve the database credentials (credentials_file, username,
+        password, mysql_host, db_name and db_snapshot kwargs) to a dictionary
+        (see gnssdb_query.parse_db_credentials_file).
+    """
+    credentials_dct = {'GNSS_DB_USER':None, 'GNSS_DB_PASS':None, 'GNSS_DB_HOST':None, 'GNSS_DB_NAME':None, 'GNSS_DB_BACKEND':'mysql', 'GNSS_DB_SQLITE':None}
+    if 'credentials_file' in kwargs and kwargs['credentials_file']:
+        credentials_dct = extract_key_values(kwargs['credentials_file'], **credentials_dct)
+    for k,v in zip(['username', 'password', 'mysql_host', 'db_name'], ['GNSS_DB_USER', 'GNSS_DB_PASS', 'GNSS_DB_HOST', 'GNSS_DB_NAME']):
+        if k in kwargs and kwargs[k] is not None: credentials_dct[v] = kwargs[k]
+    if 'db_snapshot' in kwargs and kwargs['db_snapshot'] is not None:
+        credentials_dct['GNSS_DB_BACKEND'] = 'sqlite'
+        credentials_dct['GNSS_DB_SQLITE'] = kwargs['db_snapshot']
+    return credentials_dct
+
+def run_db_queries(credentials_dct, queries):
+    """ Connect to the database and call queries(cursor), where cursor is a
+        (dictionary) cursor; the connection is closed afterwards. Any
+        database error is reported and triggers a RuntimeError.
+    """
+    connection_error = 0
+    ## Connect to the database
+    try:
+        ## (pooled) connection, shared with other queries of this process
+        cnx = gnssdb_connect(credentials_dct)
+        ## get a cursor to perform queries ...
+        cursor = cnx.cursor(dictionary=True)
+        queries(cursor)
+        ## close the cursor
+        cursor.close()
+    except mysql.connector.Error as err:
+        print('[ERROR] Failed to connect to database!', file=sys.stderr)
+        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
+            print("[ERROR] Something is wrong with your user name or password", file=sys.stderr)
+            connection_error = 10
+        elif err.errno == errorcode.ER_BAD_DB_ERROR:
+            print("[ERROR] Database does not exist", file=sys.stderr)
+            connection_error = 11
+        else:
+            print('[ERROR] ' + str(err), file=sys.stderr)
+            connection_error = 12
+    except sqlite3.Error as err:
+        print('[ERROR] Failed to query database snapshot {:}'.format(credentials_dct['GNSS_DB_SQLITE']), file=sys.stderr)
+        print('[ERROR] ' + str(err), file=sys.stderr)
+        connection_error = 13
+    else:
+        cnx.close()
+
+    if connection_error > 0:
+        msg = '[ERROR] Failed to connect to to database at {:}@{:}; fatal!'.format(credentials_dct['GNSS_DB_NAME'], credentials_dct['GNSS_DB_HOST'])
+        raise RuntimeError(msg)
 
 def main(**kwargs):
     """ Drive the rnxdwnl script
@@ -416,6 +897,9 @@ def main(**kwargs):
 
     ## verbose global verbosity level
     g_verbose_rnxdwnl = kwargs['verbose']
+
+    ## concurrency, data center limits, product store and negative cache
+    max_workers, use_asyncio, scheduler, store, negative_cache_ttl, stream_decoder = download_options(**kwargs)
     
     ## Resolve the date from input args.
     dt = datetime.datetime.strptime('{:} {:03d}'.format(kwargs['year'], kwargs['doy']),
@@ -428,49 +912,99 @@ def main(**kwargs):
         sys.exit(5)
 
     ## We now need credentials ... store them all in a credentials_dct dict
-    credentials_dct = {'GNSS_DB_USER':None, 'GNSS_DB_PASS':None, 'GNSS_DB_HOST':None, 'GNSS_DB_NAME':None}
-    if kwargs['credentials_file']:
-        credentials_dct = extract_key_values(kwargs['credentials_file'], **credentials_dct)
-    for k,v in zip(['username', 'password', 'mysql_host', 'db_name'], ['GNSS_DB_USER', 'GNSS_DB_PASS', 'GNSS_DB_HOST', 'GNSS_DB_NAME']):
-        if k in kwargs and kwargs[k] is not None: credentials_dct[v] = kwargs[k]
+    credentials_dct = db_credentials(**kwargs)
 
     ## create a dictionary to hold RINEX download results
     holdings = {}
+    ## station rows to be downloaded (after all queries are performed)
+    download_queue = []
 
-    connection_error = 0
-    ## Connect to the database
-    try:
-        cnx = mysql.connector.connect(
-            host=credentials_dct['GNSS_DB_HOST'], 
-            database=credentials_dct['GNSS_DB_NAME'], 
-            user=credentials_dct['GNSS_DB_USER'], 
-            password=credentials_dct['GNSS_DB_PASS'],
-            connect_timeout=10)
-        ## get a cursor to perform queries ...
-        cursor = cnx.cursor(dictionary=True)
-        ## ask the database for stations first
-        for station in kwargs['station_list']:
-            query_station(cursor, station, dt, holdings, save_dir)
+    def queries(cursor):
+        ## ask the database for stations first (all stations in one query)
+        query_stations(cursor, kwargs['station_list'], dt, holdings, save_dir, download_queue)
         ## query the database for networks
-        query_network(cursor, kwargs['network'], dt, holdings, save_dir)
-        ## close the cursor
-        cursor.close()
-    except mysql.connector.Error as err:
-        print('[ERROR] Failed to connect to database!', file=sys.stderr)
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-            print("[ERROR] Something is wrong with your user name or password", file=sys.stderr)
-            connection_error = 10
-        elif err.errno == errorcode.ER_BAD_DB_ERROR:
-            print("[ERROR] Database does not exist", file=sys.stderr)
-            connection_error = 11
+        query_network(cursor, kwargs['network'], dt, holdings, save_dir, download_queue)
+    with span('rinex_query'):
+        run_db_queries(credentials_dct, queries)
+
+    ## download RINEX files for all stations queried (the database connection
+    ## is already closed at this point)
+    with span('rinex_fetch') as sp:
+        if use_asyncio:
+            download_rows_rinex_async(download_queue, dt, holdings, save_dir, max(max_workers, 1), scheduler, store, negative_cache_ttl, stream_decoder)
         else:
-            print('[ERROR] ' + str(err), file=sys.stderr)
-            connection_error = 12
-    else:
-        cnx.close()
+            download_rows_rinex(download_queue, dt, holdings, save_dir, max_workers, scheduler, store, negative_cache_ttl, None, stream_decoder)
+        sp['files'] = len([ h for h in holdings.values() if h['local'] is not None ])
 
-    if connection_error > 0:
-        msg = '[ERROR] Failed to connect to to database at {:}@{:}; fatal!'.format(credentials_dct['GNSS_DB_NAME'], credentials_dct['GNSS_DB_HOST'])
+    return holdings
+
+def main_range(**kwargs):
+    """ Drive the rnxdwnl script for a range of dates (backfill mode); the
+        range starts at year/doy and ends at end_year/end_doy (inclusive),
+        see the rnxdwnl script in the bin/ folder for the rest of kwargs.
+        The database is queried once for the whole range (see
+        query_range_rows) and the RINEX files of all days are fed to a single
+        (thread) pool of max_workers workers, day after day.
+        This is a generator; it yields a tuple (date, holdings) for every day
+        in the range, in order, as soon as the downloads for that day are
+        done (while the downloads for later days continue), where holdings
+        is the same as the return value of main.
+        All files are downloaded to output_dir (RINEX filenames include the
+        date). Note that the asyncio downloader (use_asyncio) is not used in
+        this mode.
+    """
+    if 'station_list' not in kwargs: kwargs['station_list'] = []
+
+    max_workers, use_asyncio, scheduler, store, negative_cache_ttl, stream_decoder = download_options(**dict(kwargs, use_asyncio=False))
+
+    ## Resolve the date range from input args.
+    start = datetime.datetime.strptime('{:} {:03d}'.format(kwargs['year'], kwargs['doy']), '%Y %j')
+    stop = datetime.datetime.strptime('{:} {:03d}'.format(kwargs['end_year'], kwargs['end_doy']), '%Y %j')
+    if stop < start:
+        msg = '[ERROR] rnxdwnl_impl::main_range Invalid date range {:} to {:}'.format(start.strftime('%Y-%j'), stop.strftime('%Y-%j'))
         raise RuntimeError(msg)
+    dates = [ start + datetime.timedelta(days=i) for i in range((stop - start).days + 1) ]
 
-    return holdings
+    save_dir = kwargs['output_dir'] if kwargs['output_dir'] is not None else os.getcwd()
+    if not os.path.isdir(save_dir):
+        print('[ERROR] Failed to find requested directory \'{:}\''.format(save_dir), file=sys.stderr)
+        sys.exit(5)
+
+    credentials_dct = db_credentials(**kwargs)
+
+    ## query the database once for the whole range and split the rows per day
+    day_rows = {}
+    run_db_queries(credentials_dct, lambda cursor: day_rows.update(query_range_rows(cursor, kwargs['station_list'], kwargs['network'], dates)))
+
+    ## one scan of the output directory, shared by all days/stations
+    index = RinexDirIndex(save_dir)
+
+    if max_workers is None or max_workers <= 1:
+        for pt in dates:
+            holdings = {}
+            download_rows_rinex(day_rows[pt], pt, holdings, save_dir, 1, scheduler, store, negative_cache_ttl, index, stream_decoder)
+            yield pt, holdings
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        ## submit all jobs, day after day, so that the first days are done first
+        jobs = []
+        for pt in dates:
+            holdings = {}
+            rows = []
+            stations = set()
+            for row in day_rows[pt]:
+                if row['mark_name_DSO'] not in stations:
+                    stations.add(row['mark_name_DSO'])
+                    rows.append(row)
+            futures = [ executor.submit(contextvars.copy_context().run, download_station_rinex, row, pt, holdings, save_dir, scheduler, store, negative_cache_ttl, index, stream_decoder) for row in interleave_by_dc(rows) ]
+            jobs.append((pt, holdings, futures))
+        for pt, holdings, futures in jobs:
+            ## re-raise any exception thrown within a worker thread
+            for future in futures:
+                future.result()
+            yield pt, holdings
+    finally:
+        ## if the caller stops early, do not start any more downloads
+        executor.shutdown(wait=True, cancel_futures=True)
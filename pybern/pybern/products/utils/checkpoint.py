@@ -0,0 +1,77 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import json
+import datetime
+import threading
+
+##  A checkpoint journal for (resumable) processing runs; it records every
+##+ finished stage (see pybern.products.utils.stages) with its result and the
+##+ files it produced, plus any other (json serializable) run information.
+##  The journal is a json file, rewritten (atomically) on every update:
+##  {'stages': {'rinex_download': {'result': {...}, 'files': [...],
+##+   'finished_at': '2022-11-28T10:15:02'}, ...},
+##+  'info': {'pcf_file': '/home/bpe/GPSUSER52/PCF/RUNDD.PCF', ...}}
+##  A recorded stage is considered finished only as long as all of its files
+##+ exist, so that a stage whose outputs were removed in the meantime is run
+##+ again on resume.
+
+class CheckpointJournal:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.journal = {'stages': {}, 'info': {}}
+
+    def load(self):
+        """ Load the journal from its file (if any); returns True if a journal
+            was loaded.
+        """
+        if not os.path.isfile(self.filename):
+            return False
+        try:
+            with open(self.filename, 'r') as fin:
+                journal = json.load(fin)
+            self.journal = {'stages': journal['stages'], 'info': journal['info']}
+        except:
+            print('[WRNNG] Failed to read checkpoint journal {:}; ignoring'.format(self.filename), file=sys.stderr)
+            return False
+        return True
+
+    def dump(self):
+        tmp = '{:}.{:}.tmp'.format(self.filename, os.getpid())
+        with open(tmp, 'w') as fout:
+            json.dump(self.journal, fout, indent=1, default=str)
+        os.replace(tmp, self.filename)
+
+    def record(self, stage, result, files=[]):
+        """ Record stage as finished, with its result and the list of files it
+            produced.
+        """
+        with self.lock:
+            self.journal['stages'][stage] = {'result': result, 'files': list(files), 'finished_at': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}
+            self.dump()
+
+    def set_info(self, key, value):
+        with self.lock:
+            self.journal['info'][key] = value
+            self.dump()
+
+    def info(self, key, default=None):
+        return self.journal['info'][key] if key in self.journal['info'] else default
+
+    def finished(self):
+        """ Returns a dictionary (stage name -> result) of all finished stages,
+            aka the ones recorded with all their files still available.
+        """
+        return { name: stage['result'] for name, stage in self.journal['stages'].items() if all(os.path.exists(f) for f in stage['files']) }
+
+    def remove(self):
+        """ Remove the journal file (e.g. after a successful run).
+        """
+        with self.lock:
+            self.journal = {'stages': {}, 'info': {}}
+            if os.path.isfile(self.filename): os.remove(self.filename)
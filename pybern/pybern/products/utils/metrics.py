@@ -0,0 +1,122 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import json
+import datetime
+import threading
+
+##  Machine readable metrics of processing runs (e.g. rundd), for alerting
+##+ and trending; a run is described by a record (see run_record):
+##  {'time': '2022-11-28T10:45:02', 'date': '2022-331',
+##+  'labels': {'network': 'greece', ...}, 'success': True,
+##+  'wall': 2714.2, 'cpu': 1903.5, 'bytes_downloaded': 73400320,
+##+  'stats': {'sites_in_network': 42, 'obs_count': 119946, 'rms': 0.0012, ...},
+##+  'stages': {'rinex_download': 315.2, 'bpe': 2210.7, ...},
+##+  'transfers': {'DSO_MTRC': {'bytes': 10485760, 'files': 12,
+##+    'seconds': 8.2, 'throughput': 1278751.2}, ...}}
+##+ (transfers are per data center, i.e. the RINEX dc_name, or the remote
+##+ host for products; see downloaders.transfers),
+##  which can be appended to a JSON lines file (append_jsonl), or written as
+##+ a Prometheus textfile (write_textfile), e.g. in the directory of the
+##+ node-exporter textfile collector; in the latter case only the last run
+##+ (of a textfile) is kept, as gauges labeled with the record's labels.
+
+## serialize writes of runs in the same process (e.g. rundd_batch)
+g_metrics_lock = threading.Lock()
+
+## prefix of all Prometheus metric names
+g_metric_prefix = 'rundd'
+
+## stats reported as Prometheus gauges; stats key -> (metric name, help)
+g_stats_metrics = {
+    'sites_in_network': ('sites_in_network', 'Number of sites in network'),
+    'sites_downloaded': ('rinex_downloaded', 'Number of RINEX downloaded (excluding skipped)'),
+    'sites_processed': ('sites_processed', 'Number of sites processed'),
+    'site_ts_updated': ('timeseries_updated', 'Number of time-series updated'),
+    'num_reference_sites': ('reference_sites', 'Number of reference stations'),
+    'obs_count': ('observations', 'Number of observations (total)'),
+    'par_count': ('parameters', 'Number of parameters (adjusted)'),
+    'rms': ('rms_unit_weight', 'A-posteriori RMS of unit weight'),
+    'xdof': ('chi2_dof', 'Chi^2 / DoF')}
+
+def run_record(labels, stats, summary, success=True, date=None):
+    """ Make the metrics record of a run; labels is a dictionary identifying
+        the run (e.g. network, campaign), stats a dictionary of run statistics
+        (see g_stats_metrics), summary the timing summary of the run (see
+        pybern.products.utils.timing.RunTimer.summary) and date (a datetime)
+        the day processed.
+    """
+    stages = {}
+    for span in summary['spans']:
+        stages[span['name']] = round(stages.get(span['name'], 0e0) + span['wall'], 3)
+    transfers = {}
+    for dc, t in summary['transfers'].items():
+        transfers[dc] = dict(t)
+        transfers[dc]['throughput'] = round(t['bytes'] / t['seconds'], 1) if t['seconds'] > 0 else None
+    return {'time': datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'),
+        'date': date.strftime('%Y-%j') if date is not None else None,
+        'labels': dict(labels),
+        'success': success,
+        'wall': summary['wall'],
+        'cpu': summary['cpu'],
+        'bytes_downloaded': summary['bytes_downloaded'],
+        'stats': dict(stats),
+        'stages': stages,
+        'transfers': transfers}
+
+def append_jsonl(filename, record):
+    """ Append record (as a single line) to the JSON lines file filename.
+    """
+    line = json.dumps(record, default=str) + '\n'
+    with g_metrics_lock:
+        with open(filename, 'a') as fout:
+            fout.write(line)
+
+def label_str(labels):
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join([ '{:}="{:}"'.format(k, escape(v)) for k, v in labels.items() ]) + '}'
+
+def write_textfile(filename, record):
+    """ Write record as (gauge) metrics to the Prometheus textfile filename;
+        the file is replaced atomically, so that it is never read half
+        written.
+    """
+    lines = []
+    def gauge(name, help, samples):
+        if not samples: return
+        name = '{:}_{:}'.format(g_metric_prefix, name)
+        lines.append('# HELP {:} {:}'.format(name, help))
+        lines.append('# TYPE {:} gauge'.format(name))
+        for labels, value in samples:
+            lines.append('{:}{:} {:}'.format(name, label_str(labels), value))
+
+    labels = record['labels']
+    run_time = datetime.datetime.strptime(record['time'], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+    gauge('last_run_timestamp_seconds', 'Time the run finished', [(labels, int(run_time.timestamp()))])
+    gauge('last_run_success', 'Whether the run was successeful (1) or not (0)', [(labels, int(bool(record['success'])))])
+    if record['date'] is not None:
+        processed = datetime.datetime.strptime(record['date'], '%Y-%j').replace(tzinfo=datetime.timezone.utc)
+        gauge('processed_date_timestamp_seconds', 'Day processed by the run', [(labels, int(processed.timestamp()))])
+    gauge('run_duration_seconds', 'Wall time of the run', [(labels, record['wall'])])
+    gauge('run_cpu_seconds', 'CPU time of the run (including waited child processes)', [(labels, record['cpu'])])
+    for key, (name, help) in g_stats_metrics.items():
+        if key in record['stats'] and record['stats'][key] is not None:
+            try:
+                gauge(name, help, [(labels, float(record['stats'][key]))])
+            except (TypeError, ValueError):
+                print('[WRNNG] Non-numeric value for {:}: {:}; not exported'.format(key, record['stats'][key]), file=sys.stderr)
+    gauge('stage_duration_seconds', 'Wall time of a run stage', [ (dict(labels, stage=stage), wall) for stage, wall in record['stages'].items() ])
+    gauge('download_bytes', 'Bytes downloaded from a data center', [ (dict(labels, data_center=dc), t['bytes']) for dc, t in record['transfers'].items() ])
+    gauge('download_files', 'Files downloaded from a data center', [ (dict(labels, data_center=dc), t['files']) for dc, t in record['transfers'].items() ])
+    gauge('download_seconds', 'Time spent receiving data from a data center', [ (dict(labels, data_center=dc), round(t['seconds'], 3)) for dc, t in record['transfers'].items() ])
+    gauge('download_throughput_bytes_per_second', 'Download throughput from a data center', [ (dict(labels, data_center=dc), t['throughput']) for dc, t in record['transfers'].items() if t['throughput'] is not None ])
+
+    ## not .prom, so that the collector ignores it
+    tmp = '{:}.{:}.tmp'.format(filename, os.getpid())
+    with g_metrics_lock:
+        with open(tmp, 'w') as fout:
+            fout.write('\n'.join(lines) + '\n')
+        os.replace(tmp, filename)
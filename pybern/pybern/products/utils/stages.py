@@ -0,0 +1,109 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import sys
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pybern.products.utils.timing import span
+
+##  A (small) executor for a graph of dependent stages; every stage is a
+##+ callable that is run (in a thread) as soon as all the stages it depends on
+##+ are done, so that independent stages overlap. Use as:
+##  graph = StageGraph()
+##  graph.add('download', lambda r: download())
+##  graph.add('decompress', lambda r: decompress(r['download']), ['download'])
+##  results = graph.run()
+##
+##  Every stage is called with the dictionary of results (stage name -> value
+##+ returned by the stage) of the stages done so far; a stage should only read
+##+ the results of the stages it depends on.
+##  Stages can only depend on stages already added, hence the graph is always
+##+ acyclic and the order stages are added in is a valid (sequential) order.
+##  Stages already done (e.g. in a previous, checkpointed run; see
+##+ pybern.products.utils.checkpoint) can be given to run with their results,
+##+ and are then skipped (as long as none of the stages they depend on is run
+##+ again). Stages added with always_run (e.g. ones acquiring a lock) are run
+##+ anyway, but do not cause the stages depending on them to run again.
+##  Stages run in a copy of the context (see contextvars) run is called in;
+##+ every stage run is timed as a span of the current timer (if any; see
+##+ pybern.products.utils.timing).
+##  If a stage fails (raises, including sys.exit), no new stages are started,
+##+ the running ones are waited for and the (first) exception is re-raised
+##+ by run. Long running stages (e.g. retry loops) can check the aborted
+##+ event to stop early.
+
+class StageGraph:
+
+    def __init__(self, verbose=False):
+        ## name -> (callable, list of dependencies, always_run), in insertion
+        ## order
+        self.stages = {}
+        self.results = {}
+        self.aborted = threading.Event()
+        self.verbose = verbose
+
+    def add(self, name, func, deps=[], always_run=False):
+        """ Add a stage named name, to be run (as func(results)) after all the
+            stages in deps are done. If always_run is True, the stage is run
+            even if it is given as done (see run).
+        """
+        if name in self.stages:
+            msg = '[ERROR] stages::StageGraph::add Stage {:} already added'.format(name)
+            raise RuntimeError(msg)
+        for dep in deps:
+            if dep not in self.stages:
+                msg = '[ERROR] stages::StageGraph::add Unknown dependency {:} for stage {:}'.format(dep, name)
+                raise RuntimeError(msg)
+        self.stages[name] = (func, list(deps), always_run)
+
+    def run_stage(self, name):
+        func = self.stages[name][0]
+        if self.verbose: print('[DEBUG] Starting stage {:}'.format(name))
+        with span(name):
+            return func(self.results)
+
+    def run(self, max_workers=None, done={}, on_done=None):
+        """ Run all stages (at most max_workers at a time; by default, as many
+            as can be run); returns the dictionary of results.
+            done is a dictionary of (stage name -> result) of stages not to be
+            run again; on_done, if given, is called as on_done(name, result)
+            for every stage run, as soon as it finishes.
+        """
+        pending = dict(self.stages)
+        running = {}
+        ## stages run (not skipped), apart from always_run ones
+        rerun = set()
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers if max_workers else max(len(self.stages), 1)) as executor:
+            while pending or running:
+                ## start (or skip) every stage with all dependencies done
+                ready = [ n for n, (_, deps, _) in pending.items() if all(d in self.results for d in deps) ] if error is None else []
+                while ready:
+                    for name in ready:
+                        _, deps, always_run = pending.pop(name)
+                        if name in done and not always_run and not any(d in rerun for d in deps):
+                            self.results[name] = done[name]
+                            if self.verbose: print('[DEBUG] Stage {:} already done; skipped'.format(name))
+                        else:
+                            if not always_run: rerun.add(name)
+                            running[executor.submit(contextvars.copy_context().run, self.run_stage, name)] = name
+                    ready = [ n for n, (_, deps, _) in pending.items() if all(d in self.results for d in deps) ]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        if self.verbose: print('[DEBUG] Stage {:} done'.format(name))
+                        if on_done is not None: on_done(name, self.results[name])
+                    except BaseException as e:
+                        print('[ERROR] Stage {:} failed: {:}'.format(name, e), file=sys.stderr)
+                        if error is None:
+                            error = e
+                            self.aborted.set()
+        if error is not None:
+            raise error
+        return self.results
@@ -0,0 +1,143 @@
+#! /usr/bin/python3
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import json
+import time
+import datetime
+import threading
+import subprocess
+import contextlib
+import contextvars
+from pybern.products.downloaders.transfers import TransferStats, g_run_transfers
+
+##  Timing spans of a processing run (e.g. rundd); every span records its
+##+ wall time, CPU time, the bytes downloaded and (if given) the number of
+##+ files it touched. Use as:
+##  timer = start_run_timer()
+##  with span('rinex_download') as sp:
+##      holdings = download()
+##      sp['files'] = len(holdings)
+##  timer.dump('rundd_21100_4242.json')
+##  span() records to the timer of the current run (g_timer, a context
+##+ variable; see contextvars), and is a no-op if there is none, so library
+##+ functions can use it freely. Several runs can share the process (see
+##+ rundd_batch.py); all figures are kept per run:
+##  * cpu is the CPU time of the thread running the span, plus the CPU time
+##+   of child processes reported to it (see call and add_child_cpu); work
+##+   done by other (pool) threads is not included. The run's cpu is the sum
+##+   of its outermost spans,
+##  * transfers (and bytes_downloaded) are the ones recorded to the run's
+##+   TransferStats (see downloaders.transfers), hence worker threads must run
+##+   in (a copy of) the run's context; the bytes of a span include the
+##+   transfers of concurrent spans of the same run.
+
+g_timer = contextvars.ContextVar('timer', default=None)
+## the records of the spans open in the current context, outermost first
+g_open_spans = contextvars.ContextVar('open_spans', default=())
+
+class RunTimer:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+        self.start = time.time()
+        self.cpu = 0e0
+        self.transfers = TransferStats()
+
+    @contextlib.contextmanager
+    def span(self, name, **kwargs):
+        """ Time the enclosed block as span name; kwargs (and any keys set on
+            the yielded dictionary, e.g. files) are added to the span record.
+        """
+        record = {'name': name, 'start': datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'), 'files': None}
+        record.update(kwargs)
+        start, cpu, nbytes = time.time(), time.thread_time(), self.transfers.total_bytes()
+        record['status'] = 'ok'
+        record['cpu'] = 0e0
+        outer = g_open_spans.get()
+        token = g_open_spans.set(outer + (record,))
+        try:
+            yield record
+        except BaseException:
+            record['status'] = 'error'
+            raise
+        finally:
+            g_open_spans.reset(token)
+            record['wall'] = round(time.time() - start, 3)
+            record['cpu'] = round(record['cpu'] + time.thread_time() - cpu, 3)
+            record['bytes_downloaded'] = self.transfers.total_bytes() - nbytes
+            with self.lock:
+                self.spans.append(record)
+                if not outer: self.cpu += record['cpu']
+
+    def update(self, name, **kwargs):
+        """ Update the (last) record of span name with kwargs.
+        """
+        with self.lock:
+            for record in reversed(self.spans):
+                if record['name'] == name:
+                    record.update(kwargs)
+                    return
+
+    def summary(self):
+        """ Returns a (json serializable) dictionary with the total wall/CPU
+            time of the run, the transfers made (per data center) and all
+            spans.
+        """
+        transfers = self.transfers.snapshot()
+        with self.lock:
+            return {'started': datetime.datetime.fromtimestamp(self.start, tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'),
+                'wall': round(time.time() - self.start, 3),
+                'cpu': round(self.cpu, 3),
+                'bytes_downloaded': sum([ t['bytes'] for t in transfers.values() ]),
+                'transfers': transfers,
+                'spans': [ dict(record) for record in self.spans ]}
+
+    def dump(self, filename):
+        """ Write the summary (see summary) to the json file filename.
+        """
+        tmp = '{:}.{:}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'w') as fout:
+            json.dump(self.summary(), fout, indent=1)
+        os.replace(tmp, filename)
+
+def start_run_timer():
+    """ Start timing a run in the current context; transfers made in it (see
+        downloaders.transfers) are recorded to the timer. Returns the timer.
+    """
+    timer = RunTimer()
+    g_timer.set(timer)
+    g_run_transfers.set(timer.transfers)
+    return timer
+
+def span(name, **kwargs):
+    """ A span of the current run's timer (see g_timer), or a no-op if there
+        is none.
+    """
+    timer = g_timer.get()
+    return timer.span(name, **kwargs) if timer is not None else contextlib.nullcontext({})
+
+def add_child_cpu(seconds):
+    """ Add the CPU time of a (finished) child process, or of work done in
+        another process (e.g. a process pool), to the spans open in the
+        current context.
+    """
+    for record in g_open_spans.get():
+        record['cpu'] += seconds
+
+def call(args, **kwargs):
+    """ Same as subprocess.call, but the CPU time of the child process is
+        added to the spans open in the current context (see add_child_cpu).
+    """
+    proc = subprocess.Popen(args, **kwargs)
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except:
+        proc.kill()
+        proc.wait()
+        raise
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    add_child_cpu(rusage.ru_utime + rusage.ru_stime)
+    return proc.returncode
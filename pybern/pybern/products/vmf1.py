@@ -5,7 +5,9 @@ from __future__ import print_function
 import sys
 import os
 import datetime
+import contextvars
 from shutil import copyfileobj
+from concurrent.futures import ThreadPoolExecutor
 from pybern.products.downloaders.retrieve import http_retrieve
 from pybern.products.fileutils.keyholders import parse_key_file
 
@@ -72,6 +74,65 @@ def get_credentials_from_args(arg_dict):
         raise RuntimeError('[ERROR] Could not resolve credentials for forecast grid file access')
     return username, password
 
+class GridBuffer:
+    """ A (stream) decoder for http_retrieve (see its stream_decoder kwarg),
+        holding the downloaded grid file in memory instead of writing it to
+        a local file. Use as:
+        grid = GridBuffer()
+        http_retrieve(url, fn, stream_decoder=grid.decoder, ...)
+        data = grid.data()
+    """
+
+    def __init__(self):
+        self.output = None
+        self.blocks = []
+
+    def decoder(self, saveas):
+        self.output = saveas
+        self.blocks = []
+        return self
+
+    def write(self, block):
+        self.blocks.append(block)
+
+    def close(self):
+        return self.output
+
+    def abort(self):
+        self.blocks = []
+
+    def data(self):
+        return b''.join(self.blocks)
+
+def get_grid(fn, dt, save_dir, allow_fc, credentials, use_cache=False, in_memory=False):
+    """ Download the (remote) grid file fn; try the final grid first and (if
+        the final is not available) the forecast one, if credentials (a
+        tuple username, password) are given.
+        If credentials is an exception (i.e. credentials could not be
+        resolved) it is raised when a forecast grid is needed.
+        If in_memory is True, the grid is not saved to a local file but held
+        in a GridBuffer (use_cache is then ignored).
+        Returns a dictionary of the form {'op':0/1, 'fc':0/1, 'fn':foo,
+        'grid': GridBuffer or None} (see main).
+    """
+    status = {'op': 0, 'fc': 0, 'grid': GridBuffer() if in_memory else None}
+    stream = {'stream_decoder': status['grid'].decoder} if in_memory else {}
+    if dt < datetime.datetime.now():
+        rstatus, target, saveas = http_retrieve(final_dir(dt), fn, save_dir=save_dir, fail_error=(not allow_fc), use_cache=use_cache, **stream)
+        if not rstatus:
+            status['op'] = 1
+            status['fn'] = saveas
+            return status
+
+    if allow_fc and credentials is not None and (datetime.datetime.now().date() - dt.date()).days < 2:
+        if isinstance(credentials, Exception): raise credentials
+        user, passwd = credentials
+        rstatus, target, saveas = http_retrieve(forecast_dir(dt), fn, save_dir=save_dir, username=user, password=passwd, use_cache=use_cache, **stream)
+        if not rstatus:
+            status['fc'] = 1
+            status['fn'] = saveas
+    return status
+
 def final_dir(dt):
     return '{:}/{:}/{:4d}'.format(TUW_URL, OP_URL_DIR, dt.year)
 
@@ -136,6 +197,9 @@ def main(**kwargs):
     ## should we delete individual files after merge ?
     if 'del_after_merge' not in kwargs: kwargs['del_after_merge'] = True
 
+    ## skip downloading grid files that have not changed remotely ?
+    if 'use_cache' not in kwargs: kwargs['use_cache'] = False
+
     ## Generic format of grid files is: VMFG_YYYYMMDD.H00; make a list with the
     ## (remote) grid files we want.
     if 'hour' in kwargs:
@@ -156,81 +220,70 @@ def main(**kwargs):
     grid_files_dict = {}
     for i in grid_files_remote:
         grid_files_dict[i] = {'op': 0, 'fc': 0}
-    
-    ## Try downloading first for final products. If we can also try for the 
-    ## forecast products, do not exit if download fails.
-    verboseprint('Trying to download final grid files.')
-    for fn in grid_files_remote:
-        throw = False
-        if dt < datetime.datetime.now():
+
+    ## If forecast allowed and date is close to the current, we may need to
+    ## download forecast files. Of course we need to have credentials for
+    ## that! (if they cannot be resolved, fail only if a forecast file is
+    ## actually needed)
+    credentials = None
+    if kwargs['allow_fc'] and (datetime.datetime.now().date() - dt.date()).days < 2:
+        try:
+            credentials = get_credentials_from_args(kwargs)
+        except Exception as e:
+            credentials = e
+
+    ## If the individual grid files are only needed for the merge, hold them
+    ## in memory (no intermediate files written)
+    in_memory = kwargs['merge_to'] is not None and kwargs['del_after_merge']
+
+    ## Download all grid files concurrently; for each file, try the final
+    ## grid first and then (if allowed) the forecast one.
+    verboseprint('Trying to download (final, else forecast) grid files.')
+    throw = False
+    with ThreadPoolExecutor(max_workers=len(grid_files_remote)) as executor:
+        futures = { fn: executor.submit(contextvars.copy_context().run, get_grid, fn, dt, save_dir, kwargs['allow_fc'], credentials, kwargs['use_cache'], in_memory) for fn in grid_files_remote }
+        for fn, future in futures.items():
             try:
-              status, target, saveas = http_retrieve(final_dir(dt), fn, save_dir=save_dir, fail_error=(not kwargs['allow_fc']))
-              if not status:
-                  grid_files_dict[fn]['op'] = 1
-                  grid_files_dict[fn]['fn'] = saveas
-                  verboseprint('\tFinal VMF1 grid file {:} downloaded and saved to {:}'.format(fn, saveas))
-              else:
-                  verboseprint('\tFailed downloading final VMF1 grid file {:}'.format(fn))
+                grid_files_dict[fn] = future.result()
+                if grid_files_dict[fn]['op']:
+                    verboseprint('\tFinal VMF1 grid file {:} downloaded'.format(fn))
+                elif grid_files_dict[fn]['fc']:
+                    verboseprint('\tForecast VMF1 grid file {:} downloaded'.format(fn))
+                else:
+                    verboseprint('\tFailed downloading VMF1 grid file {:}'.format(fn))
             except Exception as e:
-                remove_local(grid_files_dict)
                 msg = '[ERROR] Aborting because: {:}'.format(e)
                 throw = True
-            
-            if throw: raise RuntimeError(msg)
-
-    
-    ## If forecast allowed and date is close to the current, try downloading
-    ## forecast files. If we fail, exit. Of course we need to have credentials
-    ## for that!
-    ## We are only trying for forecast if:
-    ## 1. we haven't already downloaded everything,
-    ## 2. forecast files are allowed (via --allow-forecast)
-    ## 3. date requested is less than 2 days from today
-    if not downloading_complete(grid_files_dict, 'op') and kwargs['allow_fc'] and (datetime.datetime.now().date() - dt.date()).days < 2:
-        verboseprint('Trying to download forecast grid files.')
-        #user, passwd = get_credentials_from_args(vars(args))
-        user, passwd = get_credentials_from_args(kwargs)
-        for fn in grid_files_remote:
-            if not grid_files_dict[fn]['op'] and (datetime.datetime.now().date() -
-                                                dt.date()).days < 2:
-                throw = False
-                try:
-                    status, target, saveas = http_retrieve(forecast_dir(dt),
-                                                        fn,
-                                                        save_dir=save_dir,
-                                                        username=user,
-                                                        password=passwd)
-                    if not status:
-                        grid_files_dict[fn]['fc'] = 1
-                        grid_files_dict[fn]['fn'] = saveas
-                        verboseprint('\tForecast VMF1 grid file {:} downloaded and saved to {:}'.format(fn, saveas))
-                    else:
-                        verboseprint('\tFailed downloading forecast VMF1 grid file {:}'.format(fn))
-                except Exception as e:
-                    remove_local(grid_files_dict)
-                    msg = '[ERROR] Aborting! because {:}'.format(e)
-                    throw = True
-                
-                if throw: raise RuntimeError(msg)
+    if throw:
+        if not in_memory: remove_local(grid_files_dict)
+        raise RuntimeError(msg)
 
     ## Done downloading; if we don't have everything, delete what we downloaded
     ## and exit. Aka, a final check.
     for fn, status in grid_files_dict.items():
-        if status['op'] + status['fc'] < 1 or not os.path.isfile(status['fn']):
+        if status['op'] + status['fc'] < 1 or (not in_memory and not os.path.isfile(status['fn'])):
             msg = '[ERROR] Failed to download grid file: {:}'.format(fn)
             print(msg, file=sys.stderr)
-            remove_local(grid_files_dict)
+            if not in_memory: remove_local(grid_files_dict)
             raise RuntimeError(msg)
 
-    ## Merge individual grid files if needed.
+    ## Merge individual grid files if needed (in hour order).
     if kwargs['merge_to']:
-        fn2merge = sorted([ status['fn'] for _, status in grid_files_dict.items() ])
-        with open(kwargs['merge_to'], 'w') as fout:
-            for fn in fn2merge:
-                with open(fn, 'r') as fin:
-                    copyfileobj(fin, fout)
-        if kwargs['del_after_merge']:
+        partial = kwargs['merge_to'] + '.part'
+        with open(partial, 'wb') as fout:
+            for fn in sorted(grid_files_dict):
+                if in_memory:
+                    fout.write(grid_files_dict[fn]['grid'].data())
+                else:
+                    with open(grid_files_dict[fn]['fn'], 'rb') as fin:
+                        copyfileobj(fin, fout)
+        os.replace(partial, kwargs['merge_to'])
+        if kwargs['del_after_merge'] and not in_memory:
             remove_local(grid_files_dict)
-    
+
+    ## grid data is not part of the returned info
+    for fn in grid_files_dict:
+        grid_files_dict[fn].pop('grid', None)
+
     ## return a dictionary with info
     return grid_files_dict
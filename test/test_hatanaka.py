@@ -0,0 +1,13 @@
+#! /usr/bin/python
+
+import sys
+from pybern.products.fileutils.decompress import decompress_rinex_batch
+
+## decompress (.Z/.gz/.zip and Hatanaka) the RINEX files given as command line
+## arguments, in parallel; compressed files are kept
+if len(sys.argv) < 2:
+    print('Usage: {:} RINEX [RINEX ...]'.format(sys.argv[0]))
+    sys.exit(1)
+
+for rnx, (obs, error) in decompress_rinex_batch(sys.argv[1:], remove_compressed=False).items():
+    print('{:} -> {:}'.format(rnx, obs if error is None else error))
@@ -0,0 +1,14 @@
+#! /usr/bin/python
+
+import os
+import sys
+from pybern.products.fileutils import lzw
+
+## round-trip a few byte strings (including one large enough to fill the
+## string table), and decode one given as command line argument (if any)
+for data in [b'', b'a', b'abababababababab', os.urandom(200000), b'RINEX OBS'*100000]:
+    cmp = lzw.compress(data)
+    print('{:} bytes -> {:} bytes, round-trip ok: {:}'.format(len(data), len(cmp), lzw.decompress(cmp) == data))
+
+if len(sys.argv) > 1:
+    print(lzw.decompress_file(sys.argv[1], sys.argv[1][0:-2]))